@@ -0,0 +1,158 @@
+"""
+考勤记录
+
+每次考勤识别的结果写入 AttendanceRecord 和 AttendanceEntry 两张表，
+每次调用只有一次记录插入和一次批量插入。
+下载时按原来的 attendance_YYYYMMDD_HHMMSS.txt 文本格式（每行 "id 姓名 是否出席"）从数据库生成。
+指定课程时间时，同时把整个花名册的出勤情况写入 Status.if_come。
+列表接口按(created_at, id)做游标分页，每页只需一次索引范围扫描，与记录总数无关。
+"""
+import datetime
+import json
+import re
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+from status_management.models import Status
+
+from .course_gallery import roster_student_ids
+from .models import AttendanceEntry, AttendanceRecord
+
+ATTENDANCE_DIR = 'attendance_records'
+
+FILENAME_PATTERN = re.compile(r'^attendance_(\d{8}_\d{6})(?:_\w+)?\.txt$')
+
+# 文件名冲突时最多尝试的次数
+FILENAME_ATTEMPTS = 5
+
+# 列表接口默认和最大的每页条数
+ATTENDANCE_PAGE_SIZE = 50
+ATTENDANCE_MAX_PAGE_SIZE = 200
+
+
+def record_filename(created_at):
+    """按考勤时间（本地时区）生成文件名"""
+    return f"attendance_{timezone.localtime(created_at).strftime('%Y%m%d_%H%M%S')}.txt"
+
+
+def _create_record(filename, **fields):
+    """
+    插入考勤记录。不事先查询文件名是否存在（并发时查询结果会过期），
+    同一秒内多次考勤导致文件名冲突时，与 default_storage 一样追加随机后缀重试
+    """
+    candidate = filename
+    for attempt in range(FILENAME_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return AttendanceRecord.objects.create(filename=candidate, **fields)
+        except IntegrityError:
+            if attempt == FILENAME_ATTEMPTS - 1:
+                raise
+            base, ext = filename.rsplit('.', 1)
+            candidate = f"{base}_{get_random_string(7)}.{ext}"
+
+
+def save_attendance(records, course_id=None, course_time_id=None, created_at=None, filename=None):
+    """
+    保存一次考勤结果，返回AttendanceRecord。
+    records: [{'id', 'name', 'present', 'confidence'(可选)}, ...]，未识别的人脸id为-1
+    """
+    created_at = created_at or timezone.now()
+    with transaction.atomic():
+        record = _create_record(
+            filename or record_filename(created_at),
+            course_id=course_id,
+            course_time_id=course_time_id,
+            created_at=created_at,
+            face_count=len(records),
+            present_count=sum(1 for item in records if item['present']),
+        )
+        AttendanceEntry.objects.bulk_create([
+            AttendanceEntry(
+                record=record,
+                student_id=item['id'] if item['id'] >= 0 else None,
+                name=item['name'],
+                present=bool(item['present']),
+                confidence=item.get('confidence'),
+            )
+            for item in records
+        ])
+    return record
+
+
+def update_status(course_time_id, course_id, present_ids):
+    """
+    把识别结果写入该课程时间的Status：花名册上识别出的学生if_come为True，其余为False。
+    缺少的Status行一次批量插入，已有的行用两条条件更新语句修改，查询次数与班级人数无关。
+    返回{'present': 出席人数, 'absent': 缺席人数, 'created': 新建的Status行数}
+    """
+    roster = roster_student_ids(course_id)
+    present = roster & set(present_ids)
+    with transaction.atomic():
+        statuses = Status.objects.filter(course_time_id=course_time_id)
+        existing = set(statuses.filter(student_id__in=roster).values_list('student_id', flat=True))
+        created = Status.objects.bulk_create(
+            [
+                Status(student_id=student_id, course_time_id=course_time_id, if_come=student_id in present)
+                for student_id in roster - existing
+            ],
+            batch_size=500,
+        )
+        statuses.filter(student_id__in=present & existing).update(if_come=True)
+        statuses.filter(student_id__in=existing - present).update(if_come=False)
+    return {'present': len(present), 'absent': len(roster) - len(present), 'created': len(created)}
+
+
+def render_attendance(record):
+    """按原来的文本格式生成考勤文件内容"""
+    lines = []
+    for student_id, name, present in record.entries.order_by('id').values_list('student_id', 'name', 'present'):
+        lines.append(f"{student_id if student_id is not None else -1} {name} {int(present)}\n")
+    return ''.join(lines)
+
+
+def encode_cursor(record):
+    return urlsafe_base64_encode(json.dumps([record.created_at.isoformat(), record.id]).encode('utf-8'))
+
+
+def decode_cursor(cursor):
+    """解析游标，返回(created_at, id)"""
+    try:
+        created_at, record_id = json.loads(urlsafe_base64_decode(cursor))
+        return datetime.datetime.fromisoformat(created_at), int(record_id)
+    except (ValueError, TypeError):
+        raise ValueError("cursor无效")
+
+
+def paginate_records(records, cursor, limit):
+    """
+    按(created_at, id)从新到旧做游标分页，返回(本页记录, 下一页游标)，没有下一页时游标为None。
+    不使用OFFSET，翻到很深的页也只需扫描limit+1行索引
+    """
+    records = records.order_by('-created_at', '-id')
+    if cursor:
+        created_at, record_id = decode_cursor(cursor)
+        records = records.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=record_id))
+    page = list(records[:limit + 1])
+    if len(page) > limit:
+        return page[:limit], encode_cursor(page[limit - 1])
+    return page, None
+
+
+def parse_attendance_file(content):
+    """解析文本格式的考勤文件，返回records列表"""
+    records = []
+    for line in content.splitlines():
+        parts = line.split()
+        if len(parts) < 3:
+            continue
+        records.append({
+            'id': int(parts[0]),
+            'name': ' '.join(parts[1:-1]),
+            'present': int(parts[-1]),
+        })
+    return records
@@ -0,0 +1,285 @@
+"""
+人脸识别后端
+
+视图通过 face_recognition.views.app 使用的分析器都实现同一个接口：
+get(img) 返回与 insightface FaceAnalysis.get 相同的人脸列表（bbox、kps、det_score、normed_embedding），
+model_version 标识特征所属的模型。
+
+- insightface：真实模型
+- fake：不加载模型的确定性假后端。特征由随机种子和图像内容决定，并模拟检测与特征提取的耗时，
+  测试模式下默认使用，使解码、匹配、写库等真实代码路径在压测中有接近真实的开销
+- replay：按解码后图像的内容哈希回放录制的检测结果；RECORD开启时未录制的图像交给insightface处理并保存
+
+通过 settings.FACE_RECOGNITION['BACKEND'] 配置，环境变量 FACE_RECOGNITION_BACKEND 可以覆盖类型。
+SESSION_POOL.SIZE大于1时创建多个实例组成会话池（session_pool.py）。
+"""
+import hashlib
+import json
+import os
+import time
+import uuid
+
+import numpy as np
+from django.conf import settings
+
+from .metrics import metrics
+
+BACKEND_TYPES = ('insightface', 'fake', 'replay')
+
+
+class DetectedFace:
+    """
+    不依赖insightface的人脸结果，属性与 insightface.app.common.Face 一致。
+    未通过质量检查的人脸embedding为None，rejected为不合格原因（见quality.py）
+    """
+
+    def __init__(self, bbox, kps, det_score, embedding, rejected=None):
+        self.bbox = bbox
+        self.kps = kps
+        self.det_score = det_score
+        self.embedding = embedding
+        self.rejected = rejected
+
+    @property
+    def normed_embedding(self):
+        return self.embedding / np.linalg.norm(self.embedding)
+
+
+class FaceBackend:
+    """识别后端接口"""
+
+    name = None
+
+    @property
+    def model_version(self):
+        raise NotImplementedError
+
+    def get(self, img):
+        """检测图像中的人脸并提取特征"""
+        raise NotImplementedError
+
+
+class InsightFaceBackend(FaceBackend):
+    """
+    insightface FaceAnalysis，检测模型和识别模型也可以分别调用。
+    指定intra_op_threads/inter_op_threads时按该线程数重新创建各模型的onnxruntime会话
+    """
+
+    name = 'insightface'
+
+    def __init__(self, model_name='buffalo_sc', providers=None, ctx_id=0, det_size=(640, 640),
+                 intra_op_threads=None, inter_op_threads=None):
+        from insightface.app import FaceAnalysis
+
+        self.model_name = model_name
+        self.providers = providers
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.analyzer = FaceAnalysis(name=model_name, providers=providers)
+        self.analyzer.prepare(ctx_id=ctx_id, det_size=det_size)
+        if intra_op_threads or inter_op_threads:
+            self.reinit_sessions()
+
+    @property
+    def det_model(self):
+        return self.analyzer.det_model
+
+    @property
+    def models(self):
+        return self.analyzer.models
+
+    @property
+    def model_version(self):
+        return self.model_name
+
+    def get(self, img):
+        return self.analyzer.get(img)
+
+    def reinit_sessions(self):
+        """为每个模型重新创建onnxruntime会话（设置线程数，或fork之后）"""
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if self.intra_op_threads:
+            options.intra_op_num_threads = self.intra_op_threads
+        if self.inter_op_threads:
+            options.inter_op_num_threads = self.inter_op_threads
+        for model in self.analyzer.models.values():
+            model.session = onnxruntime.InferenceSession(model.model_file, sess_options=options, providers=self.providers)
+
+
+class FakeBackend(FaceBackend):
+    """
+    确定性假后端。
+    竖拍的图像视为单人照，返回一张人脸（用于录入）；横拍的图像视为教室照片，返回FACES_PER_IMAGE张人脸。
+    每张人脸对应IDENTITIES个虚拟身份之一，特征为该身份的基准向量加噪声，
+    因此同一身份的录入照片和考勤照片能够匹配上。相同的图像总是得到相同的结果。
+    """
+
+    name = 'fake'
+
+    def __init__(self, seed=0, identities=1000, faces_per_image=30, noise=0.5, detect_ms=40, embed_ms=3, dim=512):
+        self.seed = seed
+        self.identities = identities
+        self.faces_per_image = faces_per_image
+        self.noise = noise
+        self.detect_ms = detect_ms
+        self.embed_ms = embed_ms
+        self.dim = dim
+
+    @property
+    def model_version(self):
+        return f"fake-{self.seed}-{self.dim}"
+
+    def identity(self, index):
+        """虚拟身份的基准特征"""
+        feat = np.random.default_rng([self.seed, index]).standard_normal(self.dim).astype(np.float32)
+        return feat / np.linalg.norm(feat)
+
+    def get(self, img):
+        height, width = img.shape[:2]
+        digest = int.from_bytes(hashlib.blake2b(img.tobytes(), digest_size=8).digest(), 'little')
+        rng = np.random.default_rng([self.seed, digest])
+        count = 1 if height > width else min(self.faces_per_image, self.identities)
+
+        # 人脸排成网格，关键点位于框内的固定位置
+        columns = max(1, int(np.ceil(np.sqrt(count * width / max(height, 1)))))
+        rows = int(np.ceil(count / columns))
+        cell_w, cell_h = width / columns, height / rows
+        size = 0.6 * min(cell_w, cell_h)
+        template = np.array([[0.3, 0.35], [0.7, 0.35], [0.5, 0.55], [0.35, 0.75], [0.65, 0.75]], dtype=np.float32)
+
+        faces = []
+        for i, identity in enumerate(rng.choice(self.identities, size=count, replace=False)):
+            x1 = (i % columns) * cell_w + (cell_w - size) / 2
+            y1 = (i // columns) * cell_h + (cell_h - size) / 2
+            bbox = np.array([x1, y1, x1 + size, y1 + size], dtype=np.float32)
+            kps = bbox[:2] + template * size
+            feat = self.identity(int(identity)) + rng.standard_normal(self.dim).astype(np.float32) * self.noise / np.sqrt(self.dim)
+            faces.append(DetectedFace(bbox, kps, np.float32(rng.uniform(0.6, 0.99)), feat))
+
+        time.sleep((self.detect_ms + self.embed_ms * count) / 1000)
+        return faces
+
+
+class ReplayBackend(FaceBackend):
+    """
+    回放录制的结果：每张图像（解码后像素的哈希）的检测结果保存为目录中的一个.npz文件，
+    latency为True时按录制时的耗时等待。record_with为真实后端时，未录制的图像交给它处理并保存。
+    """
+
+    name = 'replay'
+
+    def __init__(self, directory, record_with=None, latency=True):
+        self.directory = directory
+        self.record_with = record_with
+        self.latency = latency
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, 'manifest.json')
+        if record_with is not None:
+            with open(manifest_path, 'w') as f:
+                json.dump({'model_version': record_with.model_version}, f)
+        self._model_version = 'replay'
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self._model_version = json.load(f).get('model_version', 'replay')
+
+    @property
+    def model_version(self):
+        return self._model_version
+
+    def get(self, img):
+        path = os.path.join(self.directory, f"{hashlib.blake2b(img.tobytes(), digest_size=16).hexdigest()}.npz")
+        if os.path.exists(path):
+            metrics.inc('face_replay_hits')
+            with np.load(path) as data:
+                if self.latency:
+                    time.sleep(float(data['elapsed']))
+                return [
+                    DetectedFace(bbox, kps, det_score, embedding)
+                    for bbox, kps, det_score, embedding in zip(data['bbox'], data['kps'], data['det_score'], data['embedding'])
+                ]
+
+        metrics.inc('face_replay_misses')
+        if self.record_with is None:
+            return []
+        start = time.perf_counter()
+        faces = self.record_with.get(img)
+        self._save(path, faces, time.perf_counter() - start)
+        return faces
+
+    def _save(self, path, faces, elapsed):
+        dim = len(faces[0].embedding) if faces else 0
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp.npz"
+        np.savez(
+            tmp_path,
+            bbox=np.array([face.bbox[:4] for face in faces], dtype=np.float32).reshape(-1, 4),
+            kps=np.array([face.kps for face in faces], dtype=np.float32).reshape(-1, 5, 2),
+            det_score=np.array([face.det_score for face in faces], dtype=np.float32),
+            embedding=np.array([face.embedding for face in faces], dtype=np.float32).reshape(-1, dim),
+            elapsed=np.float64(elapsed),
+        )
+        os.replace(tmp_path, path)
+
+
+def backend_type(face_config, test_mode=False):
+    """实际使用的后端类型：环境变量优先，测试模式下insightface换成fake"""
+    backend = os.environ.get('FACE_RECOGNITION_BACKEND') or face_config.get('BACKEND', {}).get('TYPE', 'insightface')
+    if backend not in BACKEND_TYPES:
+        raise ValueError(f"未知的人脸识别后端: {backend}")
+    if test_mode and backend == 'insightface':
+        return 'fake'
+    return backend
+
+
+def create_backend(test_mode=False):
+    """按settings创建识别后端，SESSION_POOL.SIZE大于1时返回由多个实例组成的会话池"""
+    from .session_pool import SessionPool
+
+    face_config = getattr(settings, 'FACE_RECOGNITION', {})
+    pool_config = face_config.get('SESSION_POOL', {})
+    size = pool_config.get('SIZE', 1)
+    if size <= 1:
+        return _create_backend(face_config, test_mode)
+    backends = [_create_backend(face_config, test_mode, size) for _ in range(size)]
+    return SessionPool(backends, checkout_timeout=pool_config.get('CHECKOUT_TIMEOUT', 30))
+
+
+def _create_backend(face_config, test_mode, pool_size=1):
+    backend_config = face_config.get('BACKEND', {})
+    backend = backend_type(face_config, test_mode)
+
+    if backend == 'fake':
+        fake_config = backend_config.get('FAKE', {})
+        return FakeBackend(
+            seed=fake_config.get('SEED', 0),
+            identities=fake_config.get('IDENTITIES', 1000),
+            faces_per_image=fake_config.get('FACES_PER_IMAGE', 30),
+            noise=fake_config.get('NOISE', 0.5),
+            detect_ms=fake_config.get('DETECT_MS', 40),
+            embed_ms=fake_config.get('EMBED_MS', 3),
+        )
+
+    if backend == 'replay':
+        replay_config = backend_config.get('REPLAY', {})
+        directory = replay_config.get('DIR') or os.path.join(settings.MEDIA_ROOT, 'face_replay')
+        record_with = _create_insightface(face_config, pool_size) if replay_config.get('RECORD', False) else None
+        return ReplayBackend(directory, record_with=record_with, latency=replay_config.get('LATENCY', True))
+
+    return _create_insightface(face_config, pool_size)
+
+
+def _create_insightface(face_config, pool_size=1):
+    pool_config = face_config.get('SESSION_POOL', {})
+    intra_op_threads = pool_config.get('INTRA_OP_THREADS')
+    if intra_op_threads is None and pool_size > 1:
+        # 多个会话同时推理，平分CPU核数以免线程数超过核数
+        intra_op_threads = max(1, (os.cpu_count() or 1) // pool_size)
+    return InsightFaceBackend(
+        model_name=face_config.get('MODEL_NAME', 'buffalo_sc'),
+        providers=face_config.get('PROVIDERS', ['CUDAExecutionProvider', 'CPUExecutionProvider']),
+        ctx_id=face_config.get('CUDA_DEVICE_ID', 0),
+        det_size=face_config.get('DET_SIZE', (640, 640)),
+        intra_op_threads=intra_op_threads,
+        inter_op_threads=pool_config.get('INTER_OP_THREADS'),
+    )
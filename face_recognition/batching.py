@@ -0,0 +1,154 @@
+"""
+跨请求的微批调度
+
+上课开始时多个教室终端几乎同时上传考勤照片。每个请求先在推理线程池中各自解码、
+检测人脸并做质量检查（buffalo系列的检测模型以单张图像导出，且各请求图像尺寸不同，
+检测只能逐张进行，放在各自的任务中可以在多个推理线程上并行），然后进入调度队列。
+调度线程把几毫秒内到达的请求收集成一批，所有请求的合格人脸对齐后作为一个批次送入识别模型，
+再把结果分别返回给各自的请求。
+
+通过 settings.FACE_RECOGNITION['BATCHING'] 配置：
+    'ENABLED': 是否启用
+    'MAX_BATCH_SIZE': 每批最多的请求数
+    'MAX_WAIT_MS': 第一个请求到达后最多等待的毫秒数
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+
+from . import quality
+from .inference import InferenceQueueFull, alignment_items, decode_image, detect, embed_faces, has_models, make_faces
+from .metrics import metrics
+from .session_pool import checkout, members
+from .timing import timed
+
+
+class MicroBatchScheduler:
+    """微批调度器"""
+
+    def __init__(self, analyzer, executor, max_batch_size=8, max_wait_ms=5):
+        self.analyzer = analyzer
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue(maxsize=max(executor.queue_size, 1) * max_batch_size)
+        self._thread = threading.Thread(target=self._loop, name='face-batcher', daemon=True)
+        self._thread.start()
+
+        metrics.register_gauge('face_batch_fill_rate', self.fill_rate)
+        metrics.register_gauge('face_batch_avg_size', self.average_batch_size)
+
+    def submit(self, img_data, timer=None):
+        """
+        提交一张图像，返回Future，结果为与 FaceAnalysis.get 相同的人脸列表。
+        解码、检测和质量检查作为单独的任务提交到推理线程池，推理线程池已满时抛出InferenceQueueFull。
+        timer为请求的StageTimer，记录该图像的解码、检测耗时以及所在批次的特征提取耗时
+        """
+        future = Future()
+        self.executor.submit(self._prepare, img_data, future, timer)
+        return future
+
+    def _prepare(self, img_data, future, timer):
+        """解码并检测一张图像，有合格人脸时放入调度队列等待合并提取特征"""
+        # 已超时取消的请求直接跳过
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            with timed(timer, 'decode'):
+                img, scale = decode_image(img_data)
+            with timed(timer, 'detect'):
+                bboxes, kpss = detect(self.analyzer, img)
+            with timed(timer, 'quality'):
+                reasons = quality.assess_faces(img, bboxes, kpss, scale)
+            items = alignment_items(img_data, img, scale, bboxes, kpss, reasons, timer)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        if not items:
+            future.set_result(make_faces(bboxes, kpss, reasons, []))
+            return
+        try:
+            self._queue.put_nowait((future, timer, items, bboxes, kpss, reasons))
+        except queue.Full:
+            future.set_exception(InferenceQueueFull("人脸识别服务繁忙，请稍后重试"))
+
+    def fill_rate(self):
+        """平均每批请求数占最大批大小的比例"""
+        batches = metrics.get('face_batch_count')
+        return metrics.get('face_batch_items') / (batches * self.max_batch_size) if batches else None
+
+    def average_batch_size(self):
+        batches = metrics.get('face_batch_count')
+        return metrics.get('face_batch_items') / batches if batches else None
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            metrics.inc('face_batch_count')
+            metrics.inc('face_batch_items', len(batch))
+            try:
+                # 推理线程池满时等待，多个批次可以在不同推理线程上并行执行
+                self.executor.submit(self._run_batch, batch, block=True)
+            except Exception as e:
+                for future, *_ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _run_batch(self, batch):
+        # 使用会话池时整个批次占用一个实例
+        with checkout(self.analyzer) as backend:
+            self._run_batch_on(backend, batch)
+
+    def _run_batch_on(self, backend, batch):
+        # 所有请求中质量合格的人脸一次送入识别模型
+        items = [item for _, _, faces, _, _, _ in batch for item in faces]
+        start = time.perf_counter()
+        try:
+            feats = embed_faces(backend, items)
+        except Exception as e:
+            for future, *_ in batch:
+                future.set_exception(e)
+            return
+        elapsed = time.perf_counter() - start
+
+        offset = 0
+        for future, timer, faces, bboxes, kpss, reasons in batch:
+            if timer is not None:
+                timer.add('embed', elapsed)
+            future.set_result(make_faces(bboxes, kpss, reasons, feats[offset:offset + len(faces)]))
+            offset += len(faces)
+
+
+_scheduler = None
+
+
+def start(analyzer, executor):
+    """根据settings启动微批调度器，未启用或后端不能分别调用检测、识别模型时返回None"""
+    global _scheduler
+    batching_config = getattr(settings, 'FACE_RECOGNITION', {}).get('BATCHING', {})
+    if not batching_config.get('ENABLED', False) or not has_models(members(analyzer)[0]):
+        return None
+    _scheduler = MicroBatchScheduler(
+        analyzer,
+        executor,
+        max_batch_size=batching_config.get('MAX_BATCH_SIZE', 8),
+        max_wait_ms=batching_config.get('MAX_WAIT_MS', 5),
+    )
+    return _scheduler
+
+
+def get_scheduler():
+    return _scheduler
@@ -0,0 +1,69 @@
+"""
+课程范围的人脸特征库
+
+考勤时只与该课程花名册上的学生比较：直接选课的学生（StudentCourse）
+加上所有上该课程的班级（ClassCourse）中的学生。
+Face.id 与 Student.student_id 一致（录入时文件名为 姓名_学号）。
+每门课程的特征子矩阵缓存在进程内，特征库或花名册变化后重新生成。
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from course_management.models import StudentCourse
+from user_management.models import Student
+
+from .gallery import gallery
+
+
+def roster_student_ids(course_id):
+    """课程花名册上所有学生的id"""
+    direct = StudentCourse.objects.filter(course_id=course_id, student__isnull=False).values_list('student_id', flat=True)
+    via_class = Student.objects.filter(class_id__class_courses__course_id=course_id).values_list('student_id', flat=True)
+    return set(direct) | set(via_class)
+
+
+class CourseGalleryCache:
+    """按课程缓存的特征子矩阵"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    @property
+    def ttl(self):
+        # 其他worker修改花名册时本进程收不到信号，超过TTL后重新查询
+        return getattr(settings, 'FACE_RECOGNITION', {}).get('ROSTER_CACHE_TTL', 300)
+
+    def get(self, course_id):
+        """返回课程的(特征矩阵, 缩放系数, id数组, 姓名数组)"""
+        gallery.ensure_current()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(course_id)
+        if entry is not None and entry['generation'] == gallery.generation and now - entry['created'] < self.ttl:
+            return entry['feats'], entry['scales'], entry['ids'], entry['names']
+
+        feats, scales, ids, names, generation = gallery.subset(roster_student_ids(course_id))
+        with self._lock:
+            self._entries[course_id] = {
+                'feats': feats,
+                'scales': scales,
+                'ids': ids,
+                'names': names,
+                'generation': generation,
+                'created': now,
+            }
+        return feats, scales, ids, names
+
+    def invalidate(self, course_id=None):
+        """花名册变化时清除缓存"""
+        with self._lock:
+            if course_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(course_id, None)
+
+
+course_galleries = CourseGalleryCache()
@@ -0,0 +1,205 @@
+"""
+考勤文件下载
+
+- 数据库中的考勤记录按文本格式生成；尚未导入数据库的历史文件从存储中流式读取
+- 按日期范围导出时逐批查询明细，用一个流返回多次考勤的结果
+- 考勤记录写入后不再修改，响应带ETag和Last-Modified，客户端可用If-None-Match/If-Modified-Since得到304
+- 单个文件支持Range请求（206）；完整响应较大且客户端接受时用gzip压缩
+"""
+import hashlib
+import re
+
+from django.core.files.storage import default_storage
+from django.db.models import Count, Max
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.utils.text import compress_sequence, compress_string
+
+from .models import AttendanceEntry
+
+# 超过该大小（字节）的完整响应才压缩
+GZIP_MIN_SIZE = 8 * 1024
+
+# 流式读取文件和导出明细时每块的大小
+CHUNK_SIZE = 64 * 1024
+EXPORT_BATCH_SIZE = 2000
+
+_ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def parse_range(header, size):
+    """
+    解析单个字节范围，返回(起始, 结束)（含结束位置）。
+    没有Range头或格式不支持（如多个范围）时返回None，按完整内容响应；范围无效时抛出RangeNotSatisfiable
+    """
+    match = _RANGE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-N 表示最后N个字节
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def _accepts_gzip(request):
+    return bool(_ACCEPTS_GZIP.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+
+
+def _set_headers(response, filename, etag, last_modified):
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    # 与GZipMiddleware一致：压缩后的内容使用弱ETag
+    response['ETag'] = 'W/' + etag if response.get('Content-Encoding') == 'gzip' else etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def _requested_range(request, size, etag):
+    # If-Range与当前ETag不一致时内容已变化，忽略Range返回完整内容
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag:
+        return None
+    return parse_range(request.META.get('HTTP_RANGE'), size)
+
+
+def _partial(response, start, end, size):
+    response.status_code = 206
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(end - start + 1)
+    return response
+
+
+def _not_satisfiable(size):
+    response = HttpResponse(status=416)
+    response['Content-Range'] = f'bytes */{size}'
+    return response
+
+
+def _gzip(response):
+    response['Content-Encoding'] = 'gzip'
+    return response
+
+
+def content_response(request, content, filename, last_modified):
+    """返回内存中生成的考勤文件内容"""
+    etag = f'"{hashlib.md5(content).hexdigest()}"'
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified and int(last_modified.timestamp()))
+    if conditional is not None:
+        return conditional
+
+    size = len(content)
+    try:
+        byte_range = _requested_range(request, size, etag)
+    except RangeNotSatisfiable:
+        return _not_satisfiable(size)
+
+    content_type = 'text/plain; charset=utf-8'
+    if byte_range is not None:
+        start, end = byte_range
+        response = _partial(HttpResponse(content[start:end + 1], content_type=content_type), start, end, size)
+    elif size >= GZIP_MIN_SIZE and _accepts_gzip(request):
+        response = _gzip(HttpResponse(compress_string(content), content_type=content_type))
+    else:
+        response = HttpResponse(content, content_type=content_type)
+    response['Accept-Ranges'] = 'bytes'
+    return _set_headers(response, filename, etag, last_modified)
+
+
+def _read_range(path, start, end):
+    with default_storage.open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_response(request, path, filename):
+    """流式返回存储中的考勤文件"""
+    size = default_storage.size(path)
+    last_modified = default_storage.get_modified_time(path)
+    etag = f'"{int(last_modified.timestamp()):x}-{size:x}"'
+    conditional = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+    if conditional is not None:
+        return conditional
+
+    try:
+        byte_range = _requested_range(request, size, etag)
+    except RangeNotSatisfiable:
+        return _not_satisfiable(size)
+
+    content_type = 'text/plain; charset=utf-8'
+    if byte_range is not None:
+        start, end = byte_range
+        response = _partial(StreamingHttpResponse(_read_range(path, start, end), content_type=content_type), start, end, size)
+    elif size >= GZIP_MIN_SIZE and _accepts_gzip(request):
+        response = _gzip(StreamingHttpResponse(compress_sequence(_read_range(path, 0, size - 1)), content_type=content_type))
+    else:
+        response = FileResponse(default_storage.open(path, 'rb'), content_type=content_type)
+    response['Accept-Ranges'] = 'bytes'
+    return _set_headers(response, filename, etag, last_modified)
+
+
+def _iter_export(records):
+    """按考勤时间顺序逐批输出明细，每次考勤前有一行 "# 文件名" """
+    entries = (
+        AttendanceEntry.objects.filter(record__in=records)
+        .order_by('record__created_at', 'record_id', 'id')
+        .values_list('record_id', 'record__filename', 'student_id', 'name', 'present')
+    )
+    current = None
+    lines = []
+    size = 0
+    for record_id, filename, student_id, name, present in entries.iterator(chunk_size=EXPORT_BATCH_SIZE):
+        if record_id != current:
+            current = record_id
+            lines.append(f"# {filename}\n")
+        line = f"{student_id if student_id is not None else -1} {name} {int(present)}\n"
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(lines).encode('utf-8')
+            lines, size = [], 0
+    if lines:
+        yield ''.join(lines).encode('utf-8')
+
+
+def export_response(request, records, filename):
+    """
+    把多次考勤的结果拼接为一个流返回。
+    考勤记录只会新增，ETag由记录数和最大id决定；总长度事先未知，不支持Range
+    """
+    summary = records.aggregate(count=Count('id'), last_id=Max('id'), last_modified=Max('created_at'))
+    last_modified = summary['last_modified']
+    etag = f'"export-{summary["count"]}-{summary["last_id"] or 0}"'
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified and int(last_modified.timestamp()))
+    if conditional is not None:
+        return conditional
+
+    content = _iter_export(records)
+    if _accepts_gzip(request):
+        response = _gzip(StreamingHttpResponse(compress_sequence(content), content_type='text/plain; charset=utf-8'))
+    else:
+        response = StreamingHttpResponse(content, content_type='text/plain; charset=utf-8')
+    response['Accept-Ranges'] = 'none'
+    return _set_headers(response, filename, etag, last_modified)
@@ -0,0 +1,269 @@
+"""
+人脸识别引擎的启动
+
+支持三种启动方式，通过 settings.FACE_RECOGNITION['START_MODE']
+或环境变量 FACE_RECOGNITION_START_MODE 指定：
+- eager：每个worker在应用加载时加载模型并预热，预热完成后才开始处理请求（默认）
+- lazy：第一次需要识别时才加载模型
+- preload：在gunicorn --preload / uwsgi master中应用加载时导入依赖、加载模型文件、
+  完成预热并加载特征库；fork之后每个worker重新创建onnxruntime会话
+  （onnxruntime的线程池不能跨fork使用）并再次预热，然后启动推理线程池。
+  之后没有fork时（runserver、未加--preload的gunicorn、uwsgi lazy-apps），
+  首次使用时直接启用已加载的模型，不重新加载
+
+只有处理请求的服务器进程（runserver、gunicorn、uwsgi、ASGI服务器、mod_wsgi）在应用加载时按启动方式初始化；
+其他管理命令、pytest、celery以及调用django.setup()的脚本不加载模型也不启动线程池，
+需要识别时按lazy方式加载。其他服务器可以用环境变量 FACE_RECOGNITION_AUTOSTART=1 强制初始化。
+
+应用加载期间不访问数据库（Django会给出RuntimeWarning，preload模式下连接还会被fork到各worker），
+人脸特征库在第一个请求开始时于后台线程加载，在此之前到达的考勤请求自行加载。
+
+识别后端见 backends.py。测试模式（FACE_RECOGNITION_TEST_MODE）下默认使用确定性的fake后端，
+不加载模型，但解码、匹配和写库仍走真实的代码路径。
+"""
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .metrics import metrics
+from .session_pool import members
+
+START_MODES = ('eager', 'lazy', 'preload')
+
+# 导入后即可判断运行在该服务器进程中的模块
+SERVER_MODULES = ('gunicorn', 'uwsgi', 'uvicorn', 'daphne', 'hypercorn', 'mod_wsgi')
+
+_lock = threading.Lock()
+_attempted = False
+_gallery_scheduled = False
+# preload模式下已加载的分析器及加载它的进程，fork后的worker和未fork的进程都复用它
+_preloaded = None
+_preload_pid = None
+
+# 启动耗时（秒）
+timings = {}
+
+
+def _face_config():
+    return getattr(settings, 'FACE_RECOGNITION', {})
+
+
+def start_mode():
+    mode = os.environ.get('FACE_RECOGNITION_START_MODE') or _face_config().get('START_MODE', 'eager')
+    if mode not in START_MODES:
+        raise ValueError(f"未知的人脸识别启动方式: {mode}")
+    return mode
+
+
+def test_mode():
+    return getattr(settings, 'FACE_RECOGNITION_TEST_MODE', True)
+
+
+def _is_server_process():
+    """是否为处理请求的服务器进程，只有这些进程在应用加载时初始化识别引擎"""
+    autostart = os.environ.get('FACE_RECOGNITION_AUTOSTART')
+    if autostart:
+        return autostart.lower() not in ('0', 'false', 'no')
+    if any(name in sys.modules for name in SERVER_MODULES):
+        return True
+    if os.path.basename(sys.argv[0]) not in ('manage.py', 'django-admin', 'django-admin.py'):
+        return False
+    if len(sys.argv) < 2 or sys.argv[1] != 'runserver':
+        return False
+    # 自动重载的父进程只负责监视文件变化，真正处理请求的是设置了RUN_MAIN的子进程
+    return '--noreload' in sys.argv or os.environ.get('RUN_MAIN') == 'true'
+
+
+def load_analyzer():
+    """按settings创建并准备识别后端"""
+    from .backends import create_backend
+
+    return create_backend(test_mode())
+
+
+def warm_up(analyzer):
+    """
+    用合成图像分别跑一次检测和识别模型，
+    让onnxruntime完成图初始化和首次推理的开销，而不是由第一个真实请求承担。
+    会话池中的每个实例都要预热
+    """
+    det_size = _face_config().get('DET_SIZE', (640, 640))
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (det_size[1], det_size[0], 3), dtype=np.uint8)
+
+    for backend in members(analyzer):
+        det_model = getattr(backend, 'det_model', None)
+        rec_model = getattr(backend, 'models', {}).get('recognition')
+        if det_model is None or rec_model is None:
+            backend.get(img)
+            continue
+        det_model.detect(img, max_num=0, metric='default')
+        size = rec_model.input_size[0]
+        rec_model.get_feat([img[:size, :size]])
+
+
+def _reinit_sessions(analyzer):
+    """fork后为每个模型重新创建onnxruntime会话（onnxruntime的线程池不能跨fork使用）"""
+    for backend in members(analyzer):
+        if hasattr(backend, 'reinit_sessions'):
+            backend.reinit_sessions()
+
+
+def _timed(name, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    timings[name] = time.perf_counter() - start
+    return result
+
+
+def _install(analyzer):
+    """把分析器交给视图使用，并启动推理线程池、微批调度器"""
+    import face_recognition.views
+    from . import batching, inference
+
+    face_recognition.views.app = analyzer
+
+    # 启动推理线程池，视图将解码、检测和特征提取提交到线程池执行
+    executor = inference.start()
+    print(f"人脸推理线程池已启动：{executor.workers}个线程，队列长度{executor.queue_size}")
+    if len(members(analyzer)) > 1:
+        print(f"识别会话池已启用：{len(members(analyzer))}个实例，推理时借出、用完归还")
+
+    # 启用时启动跨请求微批调度器
+    scheduler = batching.start(analyzer, executor)
+    if scheduler is not None:
+        print(f"人脸识别微批调度已启用：每批最多{scheduler.max_batch_size}个请求，最长等待{scheduler.max_wait * 1000:.0f}ms")
+
+
+def _load_gallery():
+    """预先加载人脸特征库，避免第一次考勤时才从数据库重建"""
+    from django.db import connection
+
+    from .gallery import gallery
+
+    try:
+        if not gallery.loaded:
+            _timed('gallery_load', gallery.load)
+            print(f"人脸特征库加载完成，共{len(gallery)}个人脸，耗时{timings['gallery_load']:.2f}s")
+    except Exception as e:
+        print(f"人脸特征库加载失败，将在首次考勤时加载: {e}")
+    finally:
+        # 后台线程的数据库连接不会被请求结束时的清理关闭
+        connection.close()
+
+
+def _schedule_gallery_load():
+    """应用加载完成后，在第一个请求开始时于后台线程加载特征库（只触发一次）"""
+    from django.core.signals import request_started
+
+    def load_on_first_request(**kwargs):
+        global _gallery_scheduled
+        with _lock:
+            if _gallery_scheduled:
+                return
+            _gallery_scheduled = True
+        request_started.disconnect(dispatch_uid='face_recognition_gallery_load')
+        threading.Thread(target=_load_gallery, name='face-gallery-load', daemon=True).start()
+
+    request_started.connect(load_on_first_request, weak=False, dispatch_uid='face_recognition_gallery_load')
+
+
+def _report():
+    import face_recognition.views
+
+    backend = getattr(face_recognition.views.app, 'name', None)
+    print(
+        f"人脸识别引擎启动成功（{start_mode()}，后端{backend}，进程{os.getpid()}）："
+        f"模型加载{timings.get('model_load', 0):.2f}s，预热{timings.get('warm_up', 0):.2f}s"
+    )
+
+
+def start():
+    """加载模型、预热并启动相关组件，失败时以测试模式运行。返回分析器或None"""
+    global _attempted
+    import face_recognition.views
+
+    with _lock:
+        if _attempted:
+            return face_recognition.views.app
+        _attempted = True
+        try:
+            if _preloaded is not None and os.getpid() == _preload_pid:
+                # preload之后没有fork，模型已在本进程加载并预热
+                analyzer = _preloaded
+            else:
+                analyzer = _timed('model_load', load_analyzer)
+                _timed('warm_up', warm_up, analyzer)
+            _install(analyzer)
+        except Exception as e:
+            print(f"人脸识别引擎初始化失败: {e}")
+            print("系统将以测试模式运行，不使用真实的人脸识别功能")
+            return None
+        _report()
+    return analyzer
+
+
+def _preload():
+    """在master进程中加载模型并预热，fork后在每个worker中完成剩余的初始化"""
+    global _attempted, _preloaded, _preload_pid
+    try:
+        analyzer = _timed('model_load', load_analyzer)
+        _timed('warm_up', warm_up, analyzer)
+    except Exception as e:
+        print(f"人脸识别引擎预加载失败: {e}")
+        print("系统将以测试模式运行，不使用真实的人脸识别功能")
+        _attempted = True
+        return
+    _preloaded, _preload_pid = analyzer, os.getpid()
+    print(f"人脸识别模型已在master进程预加载：模型加载{timings['model_load']:.2f}s，预热{timings['warm_up']:.2f}s")
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _after_fork_in_child():
+    """fork出的worker重新创建会话并预热，再启动本进程的推理线程池（父进程的线程不会被fork）"""
+    global _attempted
+    if _preloaded is None:
+        return
+    try:
+        _timed('model_load', _reinit_sessions, _preloaded)
+        _timed('warm_up', warm_up, _preloaded)
+        _install(_preloaded)
+        _attempted = True
+        _report()
+    except Exception as e:
+        _attempted = True
+        print(f"人脸识别引擎在worker中初始化失败: {e}")
+
+
+def on_ready():
+    """由 apps.py 的 ready() 方法调用，按启动方式初始化"""
+    metrics.register_gauge('face_model_load_seconds', lambda: timings.get('model_load'))
+    metrics.register_gauge('face_warm_up_seconds', lambda: timings.get('warm_up'))
+
+    if not _is_server_process():
+        return
+
+    _schedule_gallery_load()
+    if test_mode():
+        print("人脸识别应用启动为测试模式，不加载insightface模型")
+
+    mode = start_mode()
+    if mode == 'lazy':
+        print("人脸识别引擎将在首次使用时加载")
+    elif mode == 'preload':
+        _preload()
+    else:
+        start()
+
+
+def get_analyzer():
+    """返回人脸分析器；lazy模式下首次调用时加载。加载失败时返回None"""
+    import face_recognition.views
+
+    if face_recognition.views.app is None and not _attempted:
+        return start()
+    return face_recognition.views.app
@@ -0,0 +1,166 @@
+"""
+人脸录入
+
+单张录入与批量录入共用的逻辑：解析文件名、提取单人脸特征、
+流式读取zip/tar压缩包、批量写入数据库。
+同一身份可以录入多张照片，每张照片保存为一个模板（FaceTemplate），
+超过 TEMPLATES['MAX_PER_IDENTITY'] 时丢弃最早的模板；Face.feat 保存各模板的归一化均值（质心）。
+"""
+import os
+import re
+import tarfile
+import zipfile
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+
+from .gallery import gallery
+from .inference import analyze_image
+from .models import Face, FaceTemplate
+from .quality import REASON_LABELS, split_faces
+from .quantization import decode, encode
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+
+
+def parse_name_id(filename):
+    """从 姓名_学号.jpg 形式的文件名中解析出(姓名, id)，无法解析id时id为None"""
+    name_id = os.path.splitext(os.path.basename(filename))[0]  # 移除扩展名
+    match = re.search(r'(.+)_(\d+)', name_id)
+    if match:
+        return match.group(1), int(match.group(2))
+    return name_id, None
+
+
+def extract_single_face_feat(analyzer, img_data):
+    """解码图像并提取唯一一张人脸的特征，无人脸、多张人脸或人脸质量不合格时抛出ValueError"""
+    faces, rejected = split_faces(analyze_image(analyzer, img_data))
+    if len(faces) == 0 and rejected:
+        raise ValueError(f"人脸质量不合格：{REASON_LABELS.get(rejected[0].rejected, rejected[0].rejected)}")
+    if len(faces) == 0:
+        raise ValueError("未检测到人脸")
+    if len(faces) > 1:
+        raise ValueError(f"检测到多个人脸({len(faces)}个)，请提供单人照片")
+    return faces[0].normed_embedding
+
+
+def max_templates():
+    """每个身份最多保留的模板数"""
+    return max(1, getattr(settings, 'FACE_RECOGNITION', {}).get('TEMPLATES', {}).get('MAX_PER_IDENTITY', 5))
+
+
+def centroid(feats):
+    """各模板特征的归一化均值"""
+    mean = np.mean(np.asarray(feats, dtype=np.float32), axis=0)
+    norm = np.linalg.norm(mean)
+    return mean / norm if norm > 0 else mean
+
+
+def add_template(face_id, name, feat):
+    """
+    为一个身份新增一个模板并重新计算质心，身份不存在时创建。
+    返回(是否新建, 当前模板数)
+    """
+    with transaction.atomic():
+        face = Face.objects.select_for_update().filter(id=face_id).first()
+        if face is None:
+            # 只有一个模板时质心就是该模板
+            face = Face.objects.create(id=face_id, name=name, **encode(feat))
+            FaceTemplate.objects.create(face=face, **encode(feat))
+            return True, 1
+
+        FaceTemplate.objects.create(face=face, **encode(feat))
+        template_ids = list(face.templates.order_by('-created_at', '-id').values_list('id', flat=True))
+        stale = template_ids[max_templates():]
+        if stale:
+            FaceTemplate.objects.filter(id__in=stale).delete()
+        feats = [template.get_embedding() for template in face.templates.all()]
+
+        face.name = name
+        for field, value in encode(centroid(feats)).items():
+            setattr(face, field, value)
+        # post_save信号用新的质心和模板更新进程内特征库
+        face.save()
+        return False, len(feats)
+
+
+def _is_image(name):
+    base = os.path.basename(name)
+    if not base or base.startswith('.') or name.startswith('__MACOSX/'):
+        return False
+    return os.path.splitext(base)[1].lower() in IMAGE_EXTENSIONS
+
+
+def iter_archive_images(archive_file):
+    """
+    逐个读取压缩包中的图片，生成(文件名, 图片字节)。
+    上传的文件较大时Django已将其保存为临时文件，这里按成员逐个读取，不会把整个压缩包载入内存。
+    """
+    archive_file.seek(0)
+    if zipfile.is_zipfile(archive_file):
+        archive_file.seek(0)
+        with zipfile.ZipFile(archive_file) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not _is_image(info.filename):
+                    continue
+                with archive.open(info) as member:
+                    yield os.path.basename(info.filename), member.read()
+        return
+
+    archive_file.seek(0)
+    try:
+        archive = tarfile.open(fileobj=archive_file, mode='r|*')
+    except tarfile.TarError:
+        raise ValueError("不支持的压缩包格式，请上传zip或tar文件")
+    with archive:
+        for member in archive:
+            if not member.isfile() or not _is_image(member.name):
+                continue
+            extracted = archive.extractfile(member)
+            if extracted is not None:
+                yield os.path.basename(member.name), extracted.read()
+
+
+def bulk_save_faces(records):
+    """
+    一次性批量写入人脸，每张照片作为对应身份的一个新模板，并更新姓名和质心。
+    records: [(id, 姓名, [特征, ...]), ...]，id不重复，同一身份的多张照片按时间先后排列；
+    超过MAX_PER_IDENTITY时先丢弃已有的最早模板，新照片本身超过上限时只保留最后的几张。
+    bulk_create不会触发post_save信号，这里直接同步进程内特征库。
+    """
+    limit = max_templates()
+    records = [(face_id, name, list(feats)[-limit:]) for face_id, name, feats in records]
+    options = {'update_conflicts': True, 'update_fields': ['name', 'feat', 'feat_format', 'feat_scale']}
+    if connection.features.supports_update_conflicts_with_target:
+        options['unique_fields'] = ['id']
+
+    with transaction.atomic():
+        # 一次查询取出这些身份已有的模板（从旧到新）
+        existing = {}
+        rows = (
+            FaceTemplate.objects.filter(face_id__in=[face_id for face_id, _, _ in records])
+            .order_by('created_at', 'id')
+            .values_list('face_id', 'id', 'feat', 'feat_format', 'feat_scale')
+        )
+        for face_id, template_id, feat, feat_format, feat_scale in rows:
+            existing.setdefault(face_id, []).append((template_id, decode(feat, feat_format, feat_scale)))
+
+        stale, templates = [], {}
+        for face_id, _, feats in records:
+            history = existing.get(face_id, [])
+            drop = max(0, len(history) + len(feats) - limit)
+            stale.extend(template_id for template_id, _ in history[:drop])
+            templates[face_id] = [template for _, template in history[drop:]] + feats
+
+        centroids = {face_id: centroid(feats) for face_id, feats in templates.items()}
+        faces = [Face(id=face_id, name=name, **encode(centroids[face_id])) for face_id, name, _ in records]
+        Face.objects.bulk_create(faces, batch_size=500, **options)
+        if stale:
+            FaceTemplate.objects.filter(id__in=stale).delete()
+        FaceTemplate.objects.bulk_create(
+            [FaceTemplate(face_id=face_id, **encode(feat)) for face_id, _, feats in records for feat in feats],
+            batch_size=500,
+        )
+        for face_id, name, _ in records:
+            gallery.queue_upsert(face_id, name, centroids[face_id], templates[face_id])
@@ -0,0 +1,417 @@
+"""
+人脸特征库缓存
+
+在进程内常驻一份连续的特征矩阵以及对应的id、姓名数组，
+考勤时直接使用，不再每次请求都从数据库重建。
+特征矩阵以 FEAT_FORMAT 指定的格式（float32/float16/int8）保存，int8格式另有每行的缩放系数。
+Face的保存和删除会原地更新本进程的特征库，并递增数据库中的版本号，
+其他worker在匹配前比较版本号，发现变化后重新加载。
+同一事务内的多次修改在提交后一次性应用，只递增一次版本号、导出一次快照。
+启用快照（snapshot.py）时，特征库从按版本号命名的内存映射文件加载，
+各worker共享同一份页缓存；本进程修改后导出新版本的快照并切换过去。
+有多个录入模板的身份另外保存各模板的特征：先与质心（Face.feat）比较，
+只对每个检测人脸的前几名候选逐模板重新打分。
+"""
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+
+from . import snapshot
+from .index import create_index
+from .matching import match_faces, rescore_templates
+from .models import Face, FaceTemplate, GalleryVersion
+from .quantization import DTYPES, decode, default_format, dequantize, quantize
+
+
+def current_version():
+    """读取数据库中的特征库版本号"""
+    version = GalleryVersion.objects.filter(pk=GalleryVersion.SINGLETON_ID).values_list('version', flat=True).first()
+    return version or 0
+
+
+def bump_version():
+    """递增特征库版本号，返回递增后的版本号"""
+    with transaction.atomic():
+        updated = GalleryVersion.objects.filter(pk=GalleryVersion.SINGLETON_ID).update(version=F('version') + 1)
+        if not updated:
+            GalleryVersion.objects.get_or_create(pk=GalleryVersion.SINGLETON_ID, defaults={'version': 1})
+        return current_version()
+
+
+def rescore_top_k():
+    """每个检测人脸逐模板重新打分的候选数，0表示只比较质心"""
+    return getattr(settings, 'FACE_RECOGNITION', {}).get('TEMPLATES', {}).get('RESCORE_TOP_K', 5)
+
+
+class FaceGallery:
+    """进程内人脸特征库"""
+
+    # 初始容量，之后按倍数扩容，保证追加人脸时不必每次重新分配矩阵
+    INITIAL_CAPACITY = 64
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.feat_format = 'f32'
+        self._feats = np.empty((0, 0), dtype=np.float32)
+        self._scales = np.empty(0, dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._names = np.empty(0, dtype=object)
+        self._size = 0
+        # 数组的视图是否已交给锁外的调用方（见snapshot）
+        self._shared = False
+        self._index = {}
+        # 人脸id -> (模板特征, 缩放系数)，只保存有多个模板的身份（只有一个模板时质心就是该模板）
+        self._templates = {}
+        self.index = None
+        self.version = None
+        # 本进程内特征库每次变化都会递增，用于判断派生缓存（如课程子矩阵）是否过期
+        self.generation = 0
+
+    @property
+    def loaded(self):
+        return self.version is not None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def dim(self):
+        """特征维度；只读取矩阵形状，不像snapshot那样把数组标记为共享"""
+        return self._feats.shape[1]
+
+    @property
+    def nbytes(self):
+        """特征矩阵占用的内存（字节）"""
+        template_bytes = sum(feats.nbytes + scales.nbytes for feats, scales in self._templates.values())
+        return self._feats[:self._size].nbytes + self._scales[:self._size].nbytes + template_bytes
+
+    def load(self):
+        """加载特征库：优先打开当前版本的快照，没有快照时从数据库全量加载"""
+        with self._lock:
+            feat_format = default_format()
+            version = current_version()
+            if snapshot.enabled():
+                arrays = snapshot.open_snapshot(version)
+                if arrays is not None and arrays['feats'].dtype == DTYPES[feat_format]:
+                    self.feat_format = feat_format
+                    self._templates = _group_templates(arrays['template_feats'], arrays['template_scales'], arrays['template_ids'])
+                    self._adopt(arrays['feats'], arrays['scales'], arrays['ids'], arrays['names'], len(arrays['ids']), version)
+                    return self
+
+            rows = list(Face.objects.order_by('id').values_list('id', 'name', 'feat', 'feat_format', 'feat_scale'))
+            dim = len(decode(rows[0][2], rows[0][3])) if rows else 0
+            capacity = max(self.INITIAL_CAPACITY, len(rows))
+
+            feats = np.empty((capacity, dim), dtype=DTYPES[feat_format])
+            scales = np.ones(capacity, dtype=np.float32)
+            ids = np.empty(capacity, dtype=np.int64)
+            names = np.empty(capacity, dtype=object)
+            for row, (face_id, name, feat, row_format, row_scale) in enumerate(rows):
+                # 存储格式与特征库格式一致时直接读取字节
+                feats[row], scales[row] = decode(feat, row_format, row_scale, target_format=feat_format)
+                ids[row] = face_id
+                names[row] = name
+
+            self.feat_format = feat_format
+            self._templates = self._load_templates(feat_format)
+            self._adopt(feats, scales, ids, names, len(rows), version)
+            if snapshot.enabled():
+                self._export_snapshot()
+        return self
+
+    @staticmethod
+    def _load_templates(feat_format):
+        """从数据库加载有多个模板的身份的全部模板"""
+        multi = Face.objects.annotate(template_count=Count('templates')).filter(template_count__gt=1).values('id')
+        rows = (
+            FaceTemplate.objects.filter(face_id__in=multi)
+            .order_by('face_id', 'created_at', 'id')
+            .values_list('face_id', 'feat', 'feat_format', 'feat_scale')
+        )
+        grouped = {}
+        for face_id, feat, row_format, row_scale in rows.iterator():
+            grouped.setdefault(face_id, []).append(decode(feat, row_format, row_scale, target_format=feat_format))
+        return {
+            face_id: (np.stack([feat for feat, _ in items]), np.array([scale for _, scale in items], dtype=np.float32))
+            for face_id, items in grouped.items()
+        }
+
+    def _template_arrays(self):
+        """把各身份的模板拼接为连续数组，用于导出快照"""
+        items = sorted(self._templates.items())
+        if not items:
+            dtype = DTYPES[self.feat_format]
+            return np.empty((0, self._feats.shape[1]), dtype=dtype), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        feats = np.concatenate([feats for _, (feats, _) in items])
+        scales = np.concatenate([scales for _, (_, scales) in items])
+        ids = np.repeat([face_id for face_id, _ in items], [len(feats) for _, (feats, _) in items])
+        return feats, scales, ids
+
+    def _adopt(self, feats, scales, ids, names, size, version):
+        self._feats, self._scales, self._ids, self._names = feats, scales, ids, names
+        self._shared = False
+        self._size = size
+        self._index = {int(face_id): row for row, face_id in enumerate(ids[:size])}
+        if self.index is None:
+            self.index = create_index()
+        # 传入存储格式的矩阵，FlatIndex不需要特征，IVFIndex自行按需反量化
+        self.index.build(feats[:size], ids[:size], scales[:size])
+        self.version = version
+        self.generation += 1
+
+    def _export_snapshot(self):
+        """导出当前版本的快照，并改为使用内存映射的快照文件以共享页缓存"""
+        try:
+            size = self._size
+            snapshot.write_snapshot(
+                self.version, self._feats[:size], self._scales[:size], self._ids[:size], self._names[:size],
+                self._template_arrays(),
+            )
+            arrays = snapshot.open_snapshot(self.version)
+        except Exception as e:
+            print(f"特征库快照导出失败: {e}")
+            return
+        if arrays is not None:
+            self._feats, self._scales, self._ids, self._names = arrays['feats'], arrays['scales'], arrays['ids'], arrays['names']
+            self._templates = _group_templates(arrays['template_feats'], arrays['template_scales'], arrays['template_ids'])
+
+    def _make_writable(self):
+        """内存映射的快照是只读的，修改前复制到进程内存中（预留扩容空间）"""
+        if self._feats.flags.writeable and self._names.dtype == object:
+            return
+        size = self._size
+        capacity = max(self.INITIAL_CAPACITY, size * 2)
+        feats = np.empty((capacity, self._feats.shape[1]), dtype=self._feats.dtype)
+        feats[:size] = self._feats[:size]
+        scales = np.ones(capacity, dtype=np.float32)
+        scales[:size] = self._scales[:size]
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:size] = self._ids[:size]
+        names = np.empty(capacity, dtype=object)
+        names[:size] = [str(name) for name in self._names[:size]]
+        self._feats, self._scales, self._ids, self._names = feats, scales, ids, names
+        self._shared = False
+
+    def ensure_current(self):
+        """若其他worker修改过人脸数据（版本号变化）则重新加载"""
+        if not self.loaded or current_version() != self.version:
+            self.load()
+        return self
+
+    def snapshot(self):
+        """
+        返回当前特征矩阵、缩放系数、id数组、姓名数组的视图。
+        取出视图后数组标记为共享，之后修改已有的行前先复制（追加到容量余量中的行不影响已取出的视图）
+        """
+        with self._lock:
+            self._shared = True
+            size = self._size
+            return self._feats[:size], self._scales[:size], self._ids[:size], self._names[:size]
+
+    def dense(self, rows=None):
+        """返回float32格式的特征矩阵（用于索引训练等，不用于在线匹配）"""
+        with self._lock:
+            feats, scales = self._feats[:self._size], self._scales[:self._size]
+            if rows is not None:
+                feats, scales = feats[rows], scales[rows]
+            if feats.dtype == np.float32:
+                return feats
+            return dequantize(feats, scales)
+
+    def subset(self, face_ids):
+        """取出指定人脸id对应的连续子矩阵，返回(特征矩阵, 缩放系数, id数组, 姓名数组, generation)"""
+        with self._lock:
+            rows = np.array(sorted(self._index[i] for i in set(face_ids) if i in self._index), dtype=np.int64)
+            return (
+                np.ascontiguousarray(self._feats[rows]),
+                self._scales[rows],
+                self._ids[rows],
+                self._names[rows],
+                self.generation,
+            )
+
+    def rescorer(self, query_feats, candidate_ids):
+        """
+        返回按模板重新打分的函数（传给 match_faces），没有多模板身份时返回None。
+        candidate_ids为相似度矩阵各列对应的人脸id
+        """
+        top_k = rescore_top_k()
+        templates = self._templates
+        if not templates or top_k <= 0:
+            return None
+        return lambda sim: rescore_templates(sim, query_feats, candidate_ids, templates, top_k)
+
+    def match(self, query_feats, threshold):
+        """
+        通过索引缩小候选范围后做批量一对一匹配。
+        返回(特征库行下标数组, 相似度数组, id数组, 姓名数组)，未识别的行下标为-1。
+        锁内只取出数组引用和候选行，矩阵乘法在锁外进行（修改已取出的行前会先复制数组）
+        """
+        with self._lock:
+            feats, scales, ids, names = self.snapshot()
+            rows = self.index.candidates(query_feats, len(ids)) if self.index is not None else None
+            candidate_ids = ids if rows is None else ids[rows]
+            rescorer = self.rescorer(query_feats, candidate_ids)
+
+        if rows is None:
+            matches, scores = match_faces(query_feats, feats, threshold, scales, rescorer)
+        elif len(rows) == 0:
+            matches = np.full(len(query_feats), -1, dtype=np.int64)
+            scores = np.zeros(len(query_feats), dtype=np.float32)
+        else:
+            matches, scores = match_faces(query_feats, feats[rows], threshold, scales[rows], rescorer)
+            matches = np.where(matches >= 0, rows[np.maximum(matches, 0)], -1)
+        return matches, scores, ids, names
+
+    def upsert(self, face_id, name, feat, templates=None):
+        """
+        原地插入或更新一个人脸，feat为float32的质心特征。
+        templates为该身份全部模板的float32特征，None表示模板不变
+        """
+        feat = np.asarray(feat, dtype=np.float32)
+        with self._lock:
+            if not self.loaded:
+                return
+            self._make_writable()
+            row = self._index.get(int(face_id))
+            if self._feats.shape[1] != feat.shape[0]:
+                if self._size:
+                    raise ValueError(f"特征维度不一致: {feat.shape[0]} != {self._feats.shape[1]}")
+                self._feats = np.empty((len(self._ids), feat.shape[0]), dtype=DTYPES[self.feat_format])
+            if row is not None:
+                self._unshare()
+            else:
+                if self._size == len(self._ids):
+                    self._grow()
+                row = self._size
+                self._ids[row] = face_id
+                self._index[int(face_id)] = row
+                self._size += 1
+            self._feats[row], self._scales[row] = quantize(feat, self.feat_format)
+            self._names[row] = name
+            if templates is not None:
+                self._set_templates(int(face_id), templates)
+            self.index.add(row, face_id, feat)
+            self.generation += 1
+
+    def remove(self, face_id):
+        """删除一个人脸，用最后一行填补空位"""
+        with self._lock:
+            row = self._index.pop(int(face_id), None)
+            if row is None:
+                return
+            self._make_writable()
+            self._set_templates(int(face_id), [])
+            last = self._size - 1
+            # 删除后空出的末行可能被之后追加的人脸覆盖，因此即使删除的是末行也要先复制
+            self._unshare()
+            if row != last:
+                self._feats[row] = self._feats[last]
+                self._scales[row] = self._scales[last]
+                self._ids[row] = self._ids[last]
+                self._names[row] = self._names[last]
+                self._index[int(self._ids[row])] = row
+            self._size = last
+            self.index.remove(row, last)
+            self.generation += 1
+
+    def _set_templates(self, face_id, templates):
+        # 替换整个字典，锁外正在重新打分的匹配仍使用取出时的字典
+        updated = dict(self._templates)
+        if len(templates) > 1:
+            updated[face_id] = quantize(np.asarray(templates, dtype=np.float32), self.feat_format)
+        else:
+            updated.pop(face_id, None)
+        self._templates = updated
+
+    def queue_upsert(self, face_id, name, feat, templates=None):
+        """事务提交后插入或更新一个人脸（参数同upsert）"""
+        self._queue(face_id, (name, feat, templates))
+
+    def queue_remove(self, face_id):
+        """事务提交后删除一个人脸"""
+        self._queue(face_id, None)
+
+    def _queue(self, face_id, change):
+        """
+        同一事务（同一层保存点）内的修改合并到一个on_commit回调中。
+        回调随保存点回滚被Django丢弃，排队的修改也一起丢弃；不在事务中时立即应用
+        """
+        connection = transaction.get_connection()
+        # atomic(savepoint=False)（如Model.delete）记为None，不影响回滚时丢弃哪些回调
+        savepoint_ids = set(connection.savepoint_ids) - {None}
+        if connection.in_atomic_block:
+            for sids, func, _ in connection.run_on_commit:
+                if isinstance(func, _PendingChanges) and func.gallery is self and sids - {None} == savepoint_ids:
+                    func.changes[int(face_id)] = change
+                    return
+        pending = _PendingChanges(self)
+        pending.changes[int(face_id)] = change
+        transaction.on_commit(pending)
+
+    def after_change(self):
+        """本进程修改后递增版本号；若期间其他worker也有修改，则标记为需要重新加载"""
+        with self._lock:
+            version_before = self.version
+            new_version = bump_version()
+            if self.index is not None:
+                self.index.save()
+            if version_before is not None and version_before == new_version - 1:
+                self.version = new_version
+                if snapshot.enabled():
+                    self._export_snapshot()
+            else:
+                self.version = None
+
+    def _unshare(self):
+        """数组的视图已交给调用方时，复制一份再原地修改"""
+        if self._shared:
+            self._copy_arrays(len(self._ids))
+
+    def _grow(self):
+        self._copy_arrays(max(self.INITIAL_CAPACITY, len(self._ids) * 2))
+
+    def _copy_arrays(self, capacity):
+        feats = np.empty((capacity, self._feats.shape[1]), dtype=self._feats.dtype)
+        feats[:self._size] = self._feats[:self._size]
+        scales = np.ones(capacity, dtype=np.float32)
+        scales[:self._size] = self._scales[:self._size]
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        names = np.empty(capacity, dtype=object)
+        names[:self._size] = self._names[:self._size]
+        self._feats, self._scales, self._ids, self._names = feats, scales, ids, names
+        self._shared = False
+
+
+class _PendingChanges:
+    """一个事务内排队的特征库修改，同一id只保留最后一次；提交后依次应用，再递增一次版本号"""
+
+    def __init__(self, gallery):
+        self.gallery = gallery
+        # 人脸id -> (姓名, 质心, 模板)，None表示删除
+        self.changes = {}
+
+    def __call__(self):
+        for face_id, change in self.changes.items():
+            if change is None:
+                self.gallery.remove(face_id)
+            else:
+                self.gallery.upsert(face_id, *change)
+        self.gallery.after_change()
+
+
+def _group_templates(feats, scales, ids):
+    """把快照中连续存放的模板按人脸id分组（切片仍指向内存映射的文件）"""
+    face_ids, starts, counts = np.unique(ids, return_index=True, return_counts=True)
+    return {
+        int(face_id): (feats[start:start + count], scales[start:start + count])
+        for face_id, start, count in zip(face_ids, starts, counts)
+    }
+
+
+# 全局特征库实例，由 apps.py 的 ready() 方法加载
+gallery = FaceGallery()
@@ -0,0 +1,90 @@
+"""
+图像预处理
+
+检测模型以 DET_SIZE（默认640×640）运行，手机拍摄的千万像素照片全分辨率解码纯属浪费。
+先只读取图像头获得尺寸，再按需用 IMREAD_REDUCED_* 模式在解码时直接缩小，
+最后一次性缩放到检测输入尺寸。
+
+检测只需要检测输入尺寸的图像，但人脸对齐需要足够的分辨率：检测到的人脸在缩小后的图像中
+不足识别模型的输入尺寸时，按 decode_reduced 以较小的缩小倍数重新解码一次用于对齐（见inference.py）。
+
+通过 settings.FACE_RECOGNITION['PRESCALE'] 配置：
+    'ENABLED': 是否启用
+    'MIN_FACE_SIZE': 可选，原图中不小于该尺寸（像素）的人脸，在检测图像中仍不低于识别模型的输入尺寸，
+                     用于限制检测图像缩小的程度；不设置时直接缩放到检测输入尺寸
+"""
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# 识别模型（ArcFace）的输入边长
+RECOGNITION_INPUT_SIZE = 112
+
+# 解码时可直接缩小的倍数及对应的imread模式
+_REDUCED_MODES = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def read_image_size(img_data):
+    """只读取图像头，返回(宽, 高)，无法识别时返回None"""
+    try:
+        with Image.open(io.BytesIO(img_data)) as header:
+            return header.size
+    except Exception:
+        return None
+
+
+def target_scale(size, det_size, min_face_size=None):
+    """计算缩放比例（不超过1）"""
+    longest = max(size)
+    scale = max(det_size) / longest
+    if min_face_size:
+        scale = max(scale, RECOGNITION_INPUT_SIZE / min_face_size)
+    return min(scale, 1.0)
+
+
+def _reduced_mode(scale):
+    """缩小后不低于scale的最大缩小倍数对应的imread模式"""
+    for factor, reduced_mode in _REDUCED_MODES:
+        if 1 / factor >= scale:
+            return reduced_mode
+    return cv2.IMREAD_COLOR
+
+
+def decode_reduced(img_data, scale):
+    """只用 IMREAD_REDUCED_* 模式解码，分辨率不低于原图的scale倍，返回(图像, 实际缩放比例)"""
+    size = read_image_size(img_data)
+    img = cv2.imdecode(np.frombuffer(img_data, np.uint8), _reduced_mode(scale) if size else cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("无法解码图像")
+    return img, (max(img.shape[:2]) / max(size) if size else 1.0)
+
+
+def decode_scaled(img_data, det_size, min_face_size=None):
+    """按检测输入尺寸缩小解码图像，返回(图像, 实际缩放比例)"""
+    nparr = np.frombuffer(img_data, np.uint8)
+    size = read_image_size(img_data)
+    scale = target_scale(size, det_size, min_face_size) if size else 1.0
+
+    img = cv2.imdecode(nparr, _reduced_mode(scale))
+    if img is None:
+        raise ValueError("无法解码图像")
+    if scale >= 1.0:
+        return img, 1.0
+
+    # EXIF旋转后宽高可能互换，按解码结果的最长边计算目标尺寸
+    target_longest = round(max(size) * scale)
+    height, width = img.shape[:2]
+    if max(height, width) > target_longest:
+        resize_scale = target_longest / max(height, width)
+        img = cv2.resize(
+            img,
+            (max(1, round(width * resize_scale)), max(1, round(height * resize_scale))),
+            interpolation=cv2.INTER_AREA,
+        )
+    return img, max(img.shape[:2]) / max(size)
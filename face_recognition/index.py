@@ -0,0 +1,231 @@
+"""
+人脸特征索引
+
+索引与 gallery.FaceGallery 的特征矩阵按行对齐，用于在匹配前缩小候选范围：
+- FlatIndex：精确的暴力搜索（默认），不缩小候选范围
+- IVFIndex：倒排聚类索引，先与聚类中心比较，只在最近的几个聚类中搜索
+
+一张教室照片的几十个人脸各自探测的聚类合起来往往覆盖大部分特征库，
+此时取出候选行再计算比直接精确搜索更慢，候选行超过 MAX_CANDIDATE_FRACTION 时改为精确搜索。
+
+通过 settings.FACE_RECOGNITION['INDEX'] 配置，例如：
+    'INDEX': {'TYPE': 'ivf', 'NLIST': 256, 'NPROBE': 8, 'MAX_CANDIDATE_FRACTION': 0.5}
+"""
+import os
+import uuid
+
+import numpy as np
+from django.conf import settings
+
+from .matching import DEQUANTIZE_BLOCK
+from .metrics import metrics
+from .quantization import dequantize
+
+
+def _top_k(sim, k):
+    """返回每行相似度最高的k个下标（按相似度降序）"""
+    k = min(k, sim.shape[1])
+    idx = np.argpartition(-sim, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(sim, idx, axis=1), axis=1)
+    return np.take_along_axis(idx, order, axis=1)
+
+
+class FlatIndex:
+    """精确搜索，所有行都是候选"""
+    name = 'flat'
+
+    def build(self, feats, ids, scales=None):
+        """
+        为特征库的所有行建立索引。feats为特征库存储格式（float32/float16/int8）的矩阵，
+        scales为int8格式的每行缩放系数；索引需要时自行分块反量化
+        """
+        pass
+
+    def add(self, row, face_id, feat):
+        pass
+
+    def remove(self, row, last):
+        pass
+
+    def save(self):
+        pass
+
+    def candidates(self, query_feats, size):
+        """返回前size行中的候选行下标，None表示全部行"""
+        return None
+
+    def search(self, query_feats, feats, k=1):
+        """返回每个查询的top-k行下标"""
+        rows = self.candidates(query_feats, len(feats))
+        if rows is None:
+            return _top_k(query_feats @ feats.T, k)
+        if len(rows) == 0:
+            return np.empty((len(query_feats), 0), dtype=np.int64)
+        return rows[_top_k(query_feats @ feats[rows].T, k)]
+
+    def recall(self, feats, k=1, sample=200, noise=0.05, seed=0):
+        """
+        以特征库中加噪声的特征作为查询，统计本索引top-k与精确搜索top-k的召回率
+        """
+        if len(feats) == 0:
+            return 1.0
+        rng = np.random.default_rng(seed)
+        picks = rng.choice(len(feats), size=min(sample, len(feats)), replace=False)
+        queries = feats[picks] + rng.standard_normal((len(picks), feats.shape[1])).astype(np.float32) * noise
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        exact = _top_k(queries @ feats.T, k)
+        approx = self.search(queries, feats, k)
+        hits = sum(len(np.intersect1d(e, a)) for e, a in zip(exact, approx))
+        return hits / exact.size
+
+
+class IVFIndex(FlatIndex):
+    """倒排聚类索引（IVF），聚类中心用scikit-learn的MiniBatchKMeans训练"""
+    name = 'ivf'
+
+    # 每个聚类至少需要的训练样本数，特征库过小时退化为精确搜索
+    MIN_POINTS_PER_LIST = 39
+    # 特征库增长超过训练时规模的倍数后重新训练
+    RETRAIN_GROWTH = 4
+
+    def __init__(self, nlist=None, nprobe=8, path=None, max_candidate_fraction=0.5):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.max_candidate_fraction = max_candidate_fraction
+        self.path = path
+        self.centroids = None
+        self.trained_size = 0
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.size = 0
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def build(self, feats, ids, scales=None):
+        """加载磁盘上已训练的聚类中心，必要时重新训练，然后为所有行分配聚类"""
+        n = len(feats)
+        self.ids = np.array(ids, dtype=np.int64)
+        self.size = n
+        saved = self._load()
+        if saved is not None and n <= saved['trained_size'] * self.RETRAIN_GROWTH:
+            self.centroids = saved['centroids']
+            self.trained_size = int(saved['trained_size'])
+            # 已持久化的行直接复用聚类分配，只为新增的行重新计算
+            known = dict(zip(saved['ids'].tolist(), saved['assignments'].tolist()))
+            self.assignments = np.array([known.get(int(i), -1) for i in self.ids], dtype=np.int32)
+            missing = np.flatnonzero(self.assignments < 0)
+            if len(missing):
+                self.assignments[missing] = self._nearest(feats[missing])
+        else:
+            # 只有重新训练时才需要完整的float32矩阵
+            self.train(feats if feats.dtype == np.float32 else dequantize(feats, scales))
+            self.assignments = self._nearest(feats) if self.trained else np.zeros(n, dtype=np.int32)
+        self.save()
+
+    def train(self, feats):
+        nlist = self.nlist or int(np.sqrt(len(feats)))
+        if nlist < 2 or len(feats) < nlist * self.MIN_POINTS_PER_LIST:
+            self.centroids = None
+            self.trained_size = 0
+            return
+        from sklearn.cluster import MiniBatchKMeans
+
+        kmeans = MiniBatchKMeans(n_clusters=nlist, random_state=0, n_init=3, batch_size=4096)
+        kmeans.fit(feats)
+        centroids = kmeans.cluster_centers_.astype(np.float32)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        self.centroids = centroids
+        self.trained_size = len(feats)
+
+    def add(self, row, face_id, feat):
+        """为新增或更新的行分配聚类"""
+        if row >= len(self.assignments):
+            grow = max(row + 1, len(self.assignments) * 2)
+            self.assignments = np.resize(self.assignments, grow)
+            self.ids = np.resize(self.ids, grow)
+        self.ids[row] = face_id
+        self.size = max(self.size, row + 1)
+        self.assignments[row] = self._nearest(np.asarray(feat, dtype=np.float32)[None])[0] if self.trained else 0
+
+    def remove(self, row, last):
+        """删除一行，用最后一行填补空位（与特征库保持一致）"""
+        self.assignments[row] = self.assignments[last]
+        self.ids[row] = self.ids[last]
+        self.size = last
+
+    def candidates(self, query_feats, size):
+        if not self.trained:
+            return None
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = np.unique(_top_k(query_feats @ self.centroids.T, nprobe))
+        mask = np.isin(self.assignments[:size], probes)
+        # 候选行占比过高时，取出候选行的复制开销超过节省的计算量
+        if np.count_nonzero(mask) > size * self.max_candidate_fraction:
+            metrics.inc('face_index_flat_fallbacks')
+            return None
+        return np.flatnonzero(mask)
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp.npz"
+        try:
+            np.savez(
+                tmp_path,
+                centroids=self.centroids if self.trained else np.empty((0, 0), dtype=np.float32),
+                trained_size=self.trained_size,
+                ids=self.ids[:self.size],
+                assignments=self.assignments[:self.size],
+            )
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return None
+        try:
+            with np.load(self.path) as data:
+                if data['centroids'].size == 0:
+                    return None
+                return {key: data[key] for key in data.files}
+        except Exception as e:
+            print(f"人脸索引文件读取失败，将重新训练: {e}")
+            return None
+
+    def _nearest(self, feats):
+        """
+        每行最近的聚类中心。紧凑格式分块转换为float32后计算；
+        int8的每行缩放系数为正数，不改变该行的argmax，因此不必乘上
+        """
+        if feats.dtype == np.float32:
+            return (feats @ self.centroids.T).argmax(axis=1).astype(np.int32)
+        nearest = np.empty(len(feats), dtype=np.int32)
+        for start in range(0, len(feats), DEQUANTIZE_BLOCK):
+            block = feats[start:start + DEQUANTIZE_BLOCK].astype(np.float32)
+            nearest[start:start + len(block)] = (block @ self.centroids.T).argmax(axis=1)
+        return nearest
+
+
+def create_index():
+    """根据settings创建索引"""
+    face_config = getattr(settings, 'FACE_RECOGNITION', {})
+    index_config = face_config.get('INDEX', {})
+    index_type = index_config.get('TYPE', 'flat')
+
+    if index_type == 'flat':
+        return FlatIndex()
+    if index_type == 'ivf':
+        path = index_config.get('PATH') or os.path.join(settings.MEDIA_ROOT, 'face_index', 'ivf.npz')
+        return IVFIndex(
+            nlist=index_config.get('NLIST'),
+            nprobe=index_config.get('NPROBE', 8),
+            path=path,
+            max_candidate_fraction=index_config.get('MAX_CANDIDATE_FRACTION', 0.5),
+        )
+    raise ValueError(f"未知的人脸索引类型: {index_type}")
@@ -0,0 +1,236 @@
+"""
+人脸推理线程池
+
+insightface的推理（onnxruntime）会释放GIL，放到专用的有界线程池中执行，
+请求线程只提交任务并等待结果。排队任务数有上限，队列满时直接拒绝，
+每个任务有超时时间，避免一张大照片长时间占住请求线程。
+
+通过 settings.FACE_RECOGNITION 配置：
+    'INFERENCE_WORKERS': 推理线程数
+    'INFERENCE_QUEUE_SIZE': 除正在执行的任务外，最多排队的任务数
+    'INFERENCE_TIMEOUT': 单个任务的超时时间（秒）
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from .backends import DetectedFace
+from .imaging import RECOGNITION_INPUT_SIZE, decode_reduced, decode_scaled
+from .metrics import metrics
+from . import quality, tiling
+from .session_pool import checkout, members
+from .timing import timed
+
+
+class InferenceQueueFull(Exception):
+    """推理队列已满"""
+
+
+class InferenceTimeout(Exception):
+    """推理任务超时"""
+
+
+def decode_image(img_data):
+    """
+    解码上传的图像数据，返回(图像, 图像相对原图的缩放比例)。
+    启用预缩放时直接按检测输入尺寸缩小解码；启用分块检测时不缩小到检测尺寸，只限制最长边
+    """
+    if tiling.enabled():
+        return tiling.decode_full(img_data)
+
+    face_config = getattr(settings, 'FACE_RECOGNITION', {})
+    prescale_config = face_config.get('PRESCALE', {})
+    if prescale_config.get('ENABLED', True):
+        return decode_scaled(img_data, face_config.get('DET_SIZE', (640, 640)), prescale_config.get('MIN_FACE_SIZE'))
+
+    nparr = np.frombuffer(img_data, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("无法解码图像")
+    return img, 1.0
+
+
+def alignment_image(img_data, img, scale, bboxes, reasons):
+    """
+    人脸对齐所用的图像。检测图像缩小较多时，小人脸在其中不足识别模型的输入尺寸，
+    此时按合格人脸中最小的一张所需的分辨率（不超过原图）重新解码一次。
+    返回(对齐用图像, 对齐图像坐标相对检测图像坐标的比例)
+    """
+    sizes = [min(bbox[2] - bbox[0], bbox[3] - bbox[1]) for bbox, reason in zip(bboxes, reasons) if reason is None]
+    if not sizes or scale >= 1.0:
+        return img, 1.0
+    # 最小的人脸在原图中为 min(sizes) / scale 像素
+    needed = min(RECOGNITION_INPUT_SIZE * scale / max(min(sizes), 1.0), 1.0)
+    if needed <= scale:
+        return img, 1.0
+    aligned, aligned_scale = decode_reduced(img_data, needed)
+    if aligned_scale <= scale:
+        return img, 1.0
+    metrics.inc('face_alignment_redecodes')
+    return aligned, aligned_scale / scale
+
+
+def alignment_items(img_data, img, scale, bboxes, kpss, reasons, timer=None):
+    """合格人脸的(对齐用图像, 关键点)列表，关键点换算到对齐图像的坐标"""
+    if all(reason is not None for reason in reasons):
+        return []
+    with timed(timer, 'decode'):
+        aligned, ratio = alignment_image(img_data, img, scale, bboxes, reasons)
+    return [(aligned, kps * ratio) for kps, reason in zip(kpss, reasons) if reason is None]
+
+
+def analyze_image(analyzer, img_data, timer=None):
+    """
+    解码、检测并提取图像中所有人脸的特征，返回与 FaceAnalysis.get 相同的人脸列表。
+    检测和特征提取分开调用以便分别计时，一张图像中的所有人脸作为一个批次提取特征
+    """
+    with timed(timer, 'decode'):
+        img, scale = decode_image(img_data)
+    # 使用会话池时只在检测和特征提取期间各借出一个实例
+    if not has_models(members(analyzer)[0]):
+        with checkout(analyzer) as backend, timed(timer, 'detect'):
+            return backend.get(img)
+
+    with timed(timer, 'detect'):
+        bboxes, kpss = detect(analyzer, img)
+    if len(bboxes) == 0:
+        return []
+    # 质量不合格的人脸不提取特征
+    with timed(timer, 'quality'):
+        reasons = quality.assess_faces(img, bboxes, kpss, scale)
+    items = alignment_items(img_data, img, scale, bboxes, kpss, reasons, timer)
+    feats = []
+    if items:
+        with checkout(analyzer) as backend, timed(timer, 'embed'):
+            feats = embed_faces(backend, items)
+    return make_faces(bboxes, kpss, reasons, feats)
+
+
+def has_models(analyzer):
+    """是否为可以分别调用检测、识别模型的insightface后端"""
+    return getattr(analyzer, 'det_model', None) is not None and 'recognition' in getattr(analyzer, 'models', {})
+
+
+def detect(analyzer, img, parallel=True):
+    """
+    检测人脸，返回(bboxes, kpss)。启用分块检测且图像大于检测尺寸时分块检测，
+    parallel为True时各小块在会话池上并行检测，否则依次使用同一个实例
+    """
+    if not tiling.should_tile(img):
+        return _detect_checked_out(analyzer, img)
+    map_fn = tiling.get_executor(len(members(analyzer))).map if parallel else map
+    return tiling.detect_tiled(img, lambda tile: _detect_checked_out(analyzer, tile), map_fn)
+
+
+def _detect_checked_out(analyzer, img):
+    with checkout(analyzer) as backend:
+        return detect_faces(backend, img)
+
+
+def detect_faces(analyzer, img):
+    """只运行检测模型，返回(bboxes, kpss)，bboxes每行为 x1, y1, x2, y2, score"""
+    return analyzer.det_model.detect(img, max_num=0, metric='default')
+
+
+def embed_batch_size():
+    return getattr(settings, 'FACE_RECOGNITION', {}).get('EMBED_BATCH_SIZE', 32)
+
+
+def embed_faces(analyzer, items):
+    """
+    对齐所有人脸并按批次送入识别模型，每批 (B, 3, 112, 112)，B不超过EMBED_BATCH_SIZE。
+    逐批对齐，人脸很多时也只占用一批的输入内存。
+    items: [(图像, 5点关键点), ...]，返回 (N, 特征维度) 的特征矩阵
+    """
+    from insightface.utils import face_align
+
+    rec_model = analyzer.models['recognition']
+    size = rec_model.input_size[0]
+    chunk = max(1, embed_batch_size())
+    feats = []
+    for start in range(0, len(items), chunk):
+        crops = [face_align.norm_crop(img, landmark=kps, image_size=size) for img, kps in items[start:start + chunk]]
+        metrics.observe('face_embed_batch_size', len(crops))
+        feats.append(rec_model.get_feat(crops))
+    return np.concatenate(feats) if len(feats) > 1 else feats[0]
+
+
+def make_face(bbox, kps, feat, rejected=None):
+    """构造与 FaceAnalysis.get 返回结果一致的人脸对象"""
+    return DetectedFace(bbox=bbox[:4], kps=kps, det_score=bbox[4], embedding=feat, rejected=rejected)
+
+
+def make_faces(bboxes, kpss, reasons, feats):
+    """按检测顺序构造人脸列表，feats只包含合格人脸的特征；不合格的人脸没有特征"""
+    feats = iter(feats)
+    return [
+        make_face(bbox, kps, next(feats) if reason is None else None, reason)
+        for bbox, kps, reason in zip(bboxes, kpss, reasons)
+    ]
+
+
+class InferenceExecutor:
+    """有界推理线程池"""
+
+    def __init__(self, workers=2, queue_size=16, timeout=30):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='face-inference')
+
+    def submit(self, fn, *args, block=False):
+        """
+        提交任务，返回Future。
+        block=False时队列已满直接抛出InferenceQueueFull；block=True时等待空位（用于批量任务）
+        """
+        if not self._slots.acquire(blocking=block):
+            raise InferenceQueueFull("人脸识别服务繁忙，请稍后重试")
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def result(self, future, timeout=None):
+        """等待任务结果，超时则取消尚未开始的任务并抛出InferenceTimeout"""
+        try:
+            return future.result(timeout=timeout or self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise InferenceTimeout("人脸识别超时，请稍后重试")
+
+    def run(self, fn, *args):
+        """提交任务并等待结果"""
+        return self.result(self.submit(fn, *args))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def start():
+    """根据settings创建推理线程池，由 apps.py 的 ready() 方法调用"""
+    global _executor
+    face_config = getattr(settings, 'FACE_RECOGNITION', {})
+    with _executor_lock:
+        if _executor is None:
+            _executor = InferenceExecutor(
+                workers=face_config.get('INFERENCE_WORKERS', 2),
+                queue_size=face_config.get('INFERENCE_QUEUE_SIZE', 16),
+                timeout=face_config.get('INFERENCE_TIMEOUT', 30),
+            )
+    return _executor
+
+
+def get_executor():
+    """获取推理线程池，尚未启动时按settings创建"""
+    return _executor or start()
@@ -0,0 +1,222 @@
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from face_recognition.gallery import FaceGallery, bump_version, gallery
+from face_recognition.matching import assign, similarity_matrix
+from face_recognition.models import Face
+from face_recognition.quantization import FEAT_FORMATS, encode
+
+DIM = 512
+THRESHOLD = 0.5
+
+
+def random_feats(rng, count, dim=DIM):
+    feats = rng.standard_normal((count, dim)).astype(np.float32)
+    feats /= np.linalg.norm(feats, axis=1, keepdims=True)
+    return feats
+
+
+def timed(func, repeat):
+    """运行repeat次，返回(中位数, 最小值)（毫秒）以及最后一次的返回值"""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {'median_ms': round(float(np.median(samples)), 3), 'min_ms': round(min(samples), 3)}, result
+
+
+class StubAnalyzer:
+    """不加载模型的分析器：返回固定数量的人脸，一半是特征库中人脸加噪声，一半是陌生人"""
+
+    def __init__(self, gallery_feats, detections, seed=0):
+        rng = np.random.default_rng(seed)
+        known = min(detections - detections // 2, len(gallery_feats))
+        picks = rng.choice(len(gallery_feats), size=known, replace=False)
+        queries = gallery_feats[picks] + rng.standard_normal((known, DIM)).astype(np.float32) * 0.02
+        queries = np.concatenate([queries, random_feats(rng, detections - known)])
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        self.faces = [
+            SimpleNamespace(
+                normed_embedding=feat,
+                bbox=np.array([0, 0, 64, 64], dtype=np.float32),
+                det_score=0.9,
+                kps=None,
+            )
+            for feat in queries
+        ]
+
+    def get(self, img):
+        return list(self.faces)
+
+
+class Command(BaseCommand):
+    help = '用随机特征对人脸匹配做基准测试（不需要模型和GPU），结果写入JSON文件以便比较不同提交'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='特征库大小')
+        parser.add_argument('--detections', type=int, nargs='+', default=[1, 30, 100], help='每张照片检测到的人脸数')
+        parser.add_argument('--repeat', type=int, default=5, help='每项计时的重复次数，取中位数')
+        parser.add_argument('--feat-format', choices=FEAT_FORMATS, default=None, help='特征库存储格式，默认为 FEAT_FORMAT')
+        parser.add_argument('--skip-view', action='store_true', help='不测试完整的考勤视图')
+        parser.add_argument('--output', default='benchmark_results.json', help='结果JSON文件路径')
+        parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+
+    def handle(self, *args, **options):
+        if options['repeat'] <= 0:
+            raise CommandError("--repeat 必须大于0")
+        sizes = sorted(set(options['sizes']))
+        face_config = dict(getattr(settings, 'FACE_RECOGNITION', {}))
+        if options['feat_format']:
+            face_config['FEAT_FORMAT'] = options['feat_format']
+        # 每次请求上传同一张图像，关闭结果缓存以免跳过推理
+        face_config['RESULT_CACHE'] = {**face_config.get('RESULT_CACHE', {}), 'ENABLED': False}
+
+        # 在独立的测试数据库和临时快照目录中运行，不影响真实数据
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            face_config['SNAPSHOT'] = {**face_config.get('SNAPSHOT', {}), 'DIR': snapshot_dir}
+            with override_settings(FACE_RECOGNITION=face_config):
+                setup_test_environment()
+                old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+                try:
+                    results = self._run(sizes, options)
+                finally:
+                    connection.creation.destroy_test_db(old_name, verbosity=0)
+                    teardown_test_environment()
+
+        report = {
+            'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': self._commit(),
+            'environment': {
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'machine': platform.machine(),
+                'cpu_count': os.cpu_count(),
+                'database': connection.vendor,
+                'feat_format': face_config.get('FEAT_FORMAT', 'f32'),
+                'index': face_config.get('INDEX', {}).get('TYPE', 'flat'),
+            },
+            'options': {key: options[key] for key in ('sizes', 'detections', 'repeat', 'seed')},
+            'results': results,
+            'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"结果已写入 {options['output']}"))
+
+    def _run(self, sizes, options):
+        rng = np.random.default_rng(options['seed'])
+        all_feats = random_feats(rng, sizes[-1])
+        results = []
+        inserted = 0
+        for size in sizes:
+            # 特征库从小到大依次追加，不必每次清空
+            self._insert_faces(all_feats, inserted, size)
+            inserted = size
+            bump_version()
+            result = {'gallery_size': size, 'load': self._bench_load(options['repeat'])}
+            result['gallery_bytes'] = gallery.nbytes
+            feats, scales, _, _ = gallery.snapshot()
+            result['matching'] = [
+                self._bench_matching(feats, scales, all_feats[:size], detections, options)
+                for detections in options['detections']
+            ]
+            results.append(result)
+        return results
+
+    def _insert_faces(self, all_feats, start, end):
+        started = time.perf_counter()
+        faces = (Face(id=i + 1, name=f"bench_{i + 1}", **encode(all_feats[i])) for i in range(start, end))
+        Face.objects.bulk_create(faces, batch_size=1000)
+        self.stdout.write(f"写入人脸 {start + 1}-{end}，耗时{time.perf_counter() - started:.1f}s")
+
+    def _bench_load(self, repeat):
+        """从数据库全量加载和打开内存映射快照的耗时"""
+        face_config = settings.FACE_RECOGNITION
+        without_snapshot = {**face_config, 'SNAPSHOT': {**face_config['SNAPSHOT'], 'ENABLED': False}}
+        with override_settings(FACE_RECOGNITION=without_snapshot):
+            from_db, _ = timed(lambda: FaceGallery().load(), repeat)
+        gallery.load()  # 从数据库加载并导出当前版本的快照
+        from_snapshot, _ = timed(lambda: FaceGallery().load(), repeat)
+        self.stdout.write(f"  加载 {len(gallery)}: 数据库{from_db['median_ms']:.1f}ms，快照{from_snapshot['median_ms']:.1f}ms")
+        return {'database': from_db, 'snapshot': from_snapshot}
+
+    def _bench_matching(self, feats, scales, dense_feats, detections, options):
+        analyzer = StubAnalyzer(dense_feats, detections, seed=options['seed'])
+        query = np.stack([face.normed_embedding for face in analyzer.faces])
+        repeat = options['repeat']
+
+        similarity, sim = timed(lambda: similarity_matrix(query, feats, scales), repeat)
+        # 相似度矩阵写在线程复用的缓冲区中，复制后再单独测分配
+        sim = sim.copy()
+        assignment, _ = timed(lambda: assign(sim, THRESHOLD), repeat)
+        end_to_end, _ = timed(lambda: gallery.match(query, THRESHOLD), repeat)
+
+        tracemalloc.start()
+        gallery.match(query, THRESHOLD)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        result = {
+            'detections': detections,
+            'similarity': similarity,
+            'assignment': assignment,
+            'gallery_match': end_to_end,
+            'match_peak_bytes': peak,
+        }
+        if not options['skip_view']:
+            result['view'] = self._bench_view(analyzer, repeat)
+        self.stdout.write(
+            f"  {len(feats)}×{detections}: 相似度{similarity['median_ms']:.2f}ms，"
+            f"分配{assignment['median_ms']:.2f}ms，匹配{end_to_end['median_ms']:.2f}ms"
+            + (f"，视图{result['view']['median_ms']:.1f}ms" if 'view' in result else '')
+        )
+        return result
+
+    def _bench_view(self, analyzer, repeat):
+        """通过测试客户端调用完整的考勤视图，分析器替换为StubAnalyzer"""
+        import face_recognition.views
+        from face_recognition import inference
+
+        if inference.get_executor() is None:
+            inference.start()
+        face_recognition.views.app = analyzer
+        ok, buf = cv2.imencode('.jpg', np.zeros((480, 640, 3), dtype=np.uint8))
+        image = buf.tobytes()
+        client = Client()
+
+        def request():
+            upload = SimpleUploadedFile('benchmark.jpg', image, content_type='image/jpeg')
+            response = client.post('/face_recognition/check_attendance/', {'image': upload})
+            if response.json().get('status') != 'success':
+                raise CommandError(f"考勤视图返回错误: {response.json()}")
+
+        stats, _ = timed(request, repeat)
+        return stats
+
+    def _commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                cwd=settings.BASE_DIR,
+            ).stdout.strip()
+        except Exception:
+            return None
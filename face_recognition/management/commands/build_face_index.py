@@ -0,0 +1,40 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from face_recognition.gallery import gallery
+from face_recognition.index import create_index
+
+
+class Command(BaseCommand):
+    help = '重新构建人脸特征索引，并报告其相对精确搜索的召回率'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retrain', action='store_true', help='删除已持久化的索引并重新训练聚类中心')
+        parser.add_argument('--sample', type=int, default=200, help='用于估计召回率的查询数量')
+        parser.add_argument('--k', type=int, nargs='+', default=[1, 10], help='统计召回率的top-k')
+
+    def handle(self, *args, **options):
+        index = create_index()
+        path = getattr(index, 'path', None)
+        if options['retrain'] and path and os.path.exists(path):
+            os.remove(path)
+
+        start = time.perf_counter()
+        gallery.index = index
+        gallery.load()
+        elapsed = time.perf_counter() - start
+        feats = gallery.dense()
+        ids = gallery.snapshot()[2]
+        self.stdout.write(f"索引类型: {index.name}，人脸数: {len(ids)}，构建耗时: {elapsed:.2f}s")
+
+        if len(ids) == 0:
+            return
+
+        rows = index.candidates(feats[:1], len(ids))
+        scanned = len(ids) if rows is None else len(rows)
+        self.stdout.write(f"单次查询扫描行数: {scanned} ({scanned / len(ids):.1%})")
+        for k in options['k']:
+            recall = index.recall(feats, k=k, sample=options['sample'])
+            self.stdout.write(self.style.SUCCESS(f"recall@{k}: {recall:.4f}"))
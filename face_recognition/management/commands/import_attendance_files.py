@@ -0,0 +1,52 @@
+import datetime
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from face_recognition.attendance import ATTENDANCE_DIR, FILENAME_PATTERN, parse_attendance_file, save_attendance
+from face_recognition.models import AttendanceRecord
+
+
+class Command(BaseCommand):
+    help = '把 attendance_records/ 下已有的考勤文本文件导入数据库'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true', help='导入成功后删除原文件')
+        parser.add_argument('--dry-run', action='store_true', help='只统计待导入的文件，不写入数据库')
+
+    def handle(self, *args, **options):
+        if not default_storage.exists(ATTENDANCE_DIR):
+            self.stdout.write(f"目录不存在: {ATTENDANCE_DIR}")
+            return
+
+        _, files = default_storage.listdir(ATTENDANCE_DIR)
+        filenames = sorted(name for name in files if FILENAME_PATTERN.match(name))
+        imported = set(AttendanceRecord.objects.filter(filename__in=filenames).values_list('filename', flat=True))
+        pending = [name for name in filenames if name not in imported]
+        self.stdout.write(f"考勤文件{len(filenames)}个，已导入{len(imported)}个，待导入{len(pending)}个")
+        if options['dry_run'] or not pending:
+            return
+
+        count = 0
+        with transaction.atomic():
+            for filename in pending:
+                path = f'{ATTENDANCE_DIR}/{filename}'
+                with default_storage.open(path) as f:
+                    records = parse_attendance_file(f.read().decode('utf-8'))
+                save_attendance(records, created_at=self._created_at(filename, path), filename=filename)
+                count += 1
+
+        if options['delete']:
+            for filename in pending:
+                default_storage.delete(f'{ATTENDANCE_DIR}/{filename}')
+        self.stdout.write(self.style.SUCCESS(f"已导入{count}个考勤文件"))
+
+    def _created_at(self, filename, path):
+        """考勤时间取自文件名（本地时间），无法解析时使用文件修改时间"""
+        timestamp = FILENAME_PATTERN.match(filename).group(1)
+        try:
+            return timezone.make_aware(datetime.datetime.strptime(timestamp, '%Y%m%d_%H%M%S'))
+        except ValueError:
+            return default_storage.get_modified_time(path)
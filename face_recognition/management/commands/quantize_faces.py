@@ -0,0 +1,86 @@
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from face_recognition.gallery import bump_version
+from face_recognition.models import Face, FaceTemplate
+from face_recognition.quantization import FEAT_FORMATS, decode, dequantize, encode, quantize
+
+
+class Command(BaseCommand):
+    help = '把已有人脸特征转换为指定的存储格式（f32/f16/i8），并报告对识别精度的影响'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', required=True, choices=FEAT_FORMATS, help='目标存储格式')
+        parser.add_argument('--dry-run', action='store_true', help='只评估精度和体积，不写入数据库')
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批更新的行数')
+        parser.add_argument('--sample', type=int, default=1000, help='用于评估top-1一致率的查询数量')
+        parser.add_argument('--noise', type=float, default=0.3, help='评估查询相对原特征的噪声强度')
+
+    def handle(self, *args, **options):
+        target = options['format']
+        rows = list(Face.objects.order_by('id').values_list('id', 'feat', 'feat_format', 'feat_scale'))
+        if not rows:
+            self.stdout.write("数据库中没有人脸数据")
+            return
+
+        ids = [row[0] for row in rows]
+        feats = np.stack([decode(feat, feat_format, scale) for _, feat, feat_format, scale in rows])
+        compact, scales = quantize(feats, target)
+        restored = dequantize(compact, scales)
+
+        self._report(feats, restored, rows, compact, scales, options)
+
+        if options['dry_run']:
+            return
+
+        batch_size = options['batch_size']
+        if batch_size <= 0:
+            raise CommandError("--batch-size 必须大于0")
+        with transaction.atomic():
+            for start in range(0, len(ids), batch_size):
+                batch = [
+                    Face(id=face_id, **encode(feat, target))
+                    for face_id, feat in zip(ids[start:start + batch_size], feats[start:start + batch_size])
+                ]
+                Face.objects.bulk_update(batch, ['feat', 'feat_format', 'feat_scale'])
+            template_count = self._convert_templates(target, batch_size)
+            # bulk_update不会触发信号，递增版本号通知所有worker重新加载
+            transaction.on_commit(bump_version)
+        self.stdout.write(self.style.SUCCESS(f"已将{len(ids)}个人脸（{template_count}个模板）转换为{target}格式"))
+
+    def _convert_templates(self, target, batch_size):
+        """逐批转换各身份的录入模板"""
+        template_ids = list(FaceTemplate.objects.exclude(feat_format=target).order_by('id').values_list('id', flat=True))
+        for start in range(0, len(template_ids), batch_size):
+            rows = FaceTemplate.objects.filter(id__in=template_ids[start:start + batch_size]).values_list(
+                'id', 'feat', 'feat_format', 'feat_scale'
+            )
+            batch = [
+                FaceTemplate(id=template_id, **encode(decode(feat, feat_format, scale), target))
+                for template_id, feat, feat_format, scale in rows
+            ]
+            FaceTemplate.objects.bulk_update(batch, ['feat', 'feat_format', 'feat_scale'])
+        return len(template_ids)
+
+    def _report(self, feats, restored, rows, compact, scales, options):
+        stored_bytes = sum(len(feat) for _, feat, _, _ in rows)
+        target_bytes = compact.nbytes + (scales.nbytes if options['format'] == 'i8' else 0)
+        self.stdout.write(f"人脸数: {len(rows)}，特征维度: {feats.shape[1]}")
+        self.stdout.write(f"特征体积: {stored_bytes / 1024:.1f}KB -> {target_bytes / 1024:.1f}KB ({stored_bytes / target_bytes:.2f}x)")
+
+        cosine = np.sum(feats * restored, axis=1) / (
+            np.linalg.norm(feats, axis=1) * np.linalg.norm(restored, axis=1)
+        )
+        self.stdout.write(f"原特征与转换后特征的余弦相似度: 平均{cosine.mean():.6f}，最小{cosine.min():.6f}")
+
+        # 以加噪声的特征模拟同一个人的新照片，比较转换前后的相似度误差和top-1结果
+        rng = np.random.default_rng(0)
+        picks = rng.choice(len(feats), size=min(options['sample'], len(feats)), replace=False)
+        queries = feats[picks] + rng.standard_normal((len(picks), feats.shape[1])).astype(np.float32) * options['noise'] / np.sqrt(feats.shape[1])
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        exact = queries @ feats.T
+        approx = queries @ restored.T
+        agreement = np.mean(exact.argmax(axis=1) == approx.argmax(axis=1))
+        self.stdout.write(f"相似度最大绝对误差: {np.abs(exact - approx).max():.6f}")
+        self.stdout.write(self.style.SUCCESS(f"top-1一致率: {agreement:.4%}"))
@@ -0,0 +1,114 @@
+"""
+人脸匹配
+
+一次矩阵乘法计算所有检测人脸与特征库的相似度，
+再做一对一分配，保证同一个人在一张照片中最多只被识别一次。
+有多个录入模板的身份先按质心比较，只对前几名候选逐模板重新打分。
+"""
+import threading
+
+import numpy as np
+
+from .quantization import dequantize
+
+# 每个线程复用一块相似度缓冲区，避免每次请求重新分配
+_local = threading.local()
+
+# 紧凑格式特征库每次反量化的行数
+DEQUANTIZE_BLOCK = 4096
+
+
+def _buffer(size):
+    buf = getattr(_local, 'buffer', None)
+    if buf is None or buf.size < size:
+        buf = np.empty(max(size, 1), dtype=np.float32)
+        _local.buffer = buf
+    return buf[:size]
+
+
+def similarity_matrix(query_feats, known_feats, scales=None):
+    """
+    计算 (检测人脸数 × 特征库大小) 的相似度矩阵，结果写入线程复用的缓冲区。
+    特征库为float16/int8紧凑格式时分块反量化后计算，不生成完整的float32副本；
+    int8格式的每行缩放系数在最后统一乘上。
+    """
+    query_feats = np.ascontiguousarray(query_feats, dtype=np.float32)
+    n, m = len(query_feats), len(known_feats)
+    sim = _buffer(n * m).reshape(n, m)
+    if known_feats.dtype == np.float32:
+        np.matmul(query_feats, known_feats.T, out=sim)
+        return sim
+
+    for start in range(0, m, DEQUANTIZE_BLOCK):
+        block = known_feats[start:start + DEQUANTIZE_BLOCK].astype(np.float32)
+        np.matmul(query_feats, block.T, out=sim[:, start:start + len(block)])
+    if known_feats.dtype == np.int8 and scales is not None:
+        sim *= scales
+    return sim
+
+
+def rescore_templates(sim, query_feats, candidate_ids, templates, top_k):
+    """
+    对每个检测人脸质心相似度最高的top_k个候选，取质心与该身份各模板相似度中的最大值。
+    扫描整个特征库的成本不随模板数增长，逐模板比较只涉及少量候选。
+    templates: 人脸id -> (模板特征, 缩放系数)，没有条目的身份保持质心相似度
+    """
+    n, m = sim.shape
+    if n == 0 or m == 0:
+        return sim
+    k = min(top_k, m)
+    top = np.argpartition(-sim, k - 1, axis=1)[:, :k]
+    query_feats = np.asarray(query_feats, dtype=np.float32)
+    for col in np.unique(top):
+        entry = templates.get(int(candidate_ids[col]))
+        if entry is None:
+            continue
+        rows = np.nonzero((top == col).any(axis=1))[0]
+        template_feats, template_scales = entry
+        template_sim = dequantize(template_feats, template_scales) @ query_feats[rows].T
+        sim[rows, col] = np.maximum(sim[rows, col], template_sim.max(axis=0))
+    return sim
+
+
+def assign(sim, threshold):
+    """
+    贪心一对一分配：按相似度从高到低依次配对，每个身份和每个检测人脸最多使用一次。
+    返回每个检测人脸对应的特征库下标（未识别为-1）以及对应的相似度。
+    """
+    n, m = sim.shape
+    matches = np.full(n, -1, dtype=np.int64)
+    if m == 0:
+        return matches, np.zeros(n, dtype=np.float32)
+
+    best_idx = sim.argmax(axis=1)
+    scores = sim[np.arange(n), best_idx].astype(np.float32)
+
+    rows, cols = np.nonzero(sim > threshold)
+    if len(rows) == 0:
+        return matches, scores
+    order = np.argsort(-sim[rows, cols], kind='stable')
+
+    used = set()
+    for k in order:
+        i, j = rows[k], cols[k]
+        if matches[i] != -1 or j in used:
+            continue
+        matches[i] = j
+        scores[i] = sim[i, j]
+        used.add(j)
+        if len(used) == n:
+            break
+    return matches, scores
+
+
+def match_faces(query_feats, known_feats, threshold, scales=None, rescore=None):
+    """
+    批量匹配检测到的人脸，返回(特征库下标数组, 相似度数组)。
+    rescore为可选的函数，在分配前原地修正相似度矩阵（如按模板重新打分）
+    """
+    if len(query_feats) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    sim = similarity_matrix(query_feats, known_feats, scales)
+    if rescore is not None:
+        rescore(sim)
+    return assign(sim, threshold)
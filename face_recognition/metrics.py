@@ -0,0 +1,78 @@
+"""
+进程内指标
+
+简单的线程安全计数器、派生指标与耗时直方图，由 metrics 接口以JSON输出。
+"""
+import threading
+from collections import defaultdict, deque
+
+import numpy as np
+
+# 直方图保留最近的观测值个数，分位数按这些值计算
+HISTOGRAM_WINDOW = 2048
+
+
+class MetricsRegistry:
+    """进程内指标注册表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._gauges = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1):
+        """计数器累加"""
+        with self._lock:
+            self._counters[name] += value
+
+    def get(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def observe(self, name, value):
+        """记录一次观测值（如某阶段的耗时）"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = {'count': 0, 'sum': 0.0, 'window': deque(maxlen=HISTOGRAM_WINDOW)}
+            histogram['count'] += 1
+            histogram['sum'] += value
+            histogram['window'].append(value)
+
+    def histogram(self, name):
+        """返回总次数、总和以及最近观测值的p50/p95/p99和最大值"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                return None
+            count, total, window = histogram['count'], histogram['sum'], np.array(histogram['window'])
+        p50, p95, p99 = np.percentile(window, [50, 95, 99])
+        return {
+            'count': count,
+            'sum': round(total, 3),
+            'p50': round(float(p50), 3),
+            'p95': round(float(p95), 3),
+            'p99': round(float(p99), 3),
+            'max': round(float(window.max()), 3),
+        }
+
+    def register_gauge(self, name, func):
+        """注册派生指标，输出时调用func计算"""
+        self._gauges[name] = func
+
+    def snapshot(self):
+        with self._lock:
+            data = {'counters': dict(self._counters)}
+            names = list(self._histograms)
+        data['histograms'] = {name: self.histogram(name) for name in names}
+        data['gauges'] = {}
+        for name, func in self._gauges.items():
+            try:
+                data['gauges'][name] = func()
+            except Exception:
+                data['gauges'][name] = None
+        return data
+
+
+metrics = MetricsRegistry()
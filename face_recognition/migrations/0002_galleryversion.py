@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("face_recognition", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GalleryVersion",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("version", models.BigIntegerField(default=0)),
+            ],
+            options={
+                "db_table": "face_gallery_version",
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("face_recognition", "0002_galleryversion"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="face",
+            name="feat_format",
+            field=models.CharField(
+                choices=[
+                    ("f32", "float32"),
+                    ("f16", "float16"),
+                    ("i8", "int8+缩放系数"),
+                ],
+                default="f32",
+                max_length=4,
+            ),
+        ),
+        migrations.AddField(
+            model_name="face",
+            name="feat_scale",
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
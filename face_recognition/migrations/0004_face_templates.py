@@ -0,0 +1,79 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_faces_to_templates(apps, schema_editor):
+    """已有的每个人脸特征作为该身份的第一个模板"""
+    Face = apps.get_model("face_recognition", "Face")
+    FaceTemplate = apps.get_model("face_recognition", "FaceTemplate")
+    templates = (
+        FaceTemplate(
+            face_id=face_id,
+            feat=feat,
+            feat_format=feat_format,
+            feat_scale=feat_scale,
+        )
+        for face_id, feat, feat_format, feat_scale in Face.objects.values_list(
+            "id", "feat", "feat_format", "feat_scale"
+        ).iterator()
+    )
+    FaceTemplate.objects.bulk_create(templates, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("face_recognition", "0003_face_feat_format"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FaceTemplate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("feat", models.BinaryField()),
+                (
+                    "feat_format",
+                    models.CharField(
+                        choices=[
+                            ("f32", "float32"),
+                            ("f16", "float16"),
+                            ("i8", "int8+缩放系数"),
+                        ],
+                        default="f32",
+                        max_length=4,
+                    ),
+                ),
+                ("feat_scale", models.FloatField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "face",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="templates",
+                        to="face_recognition.face",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "face_templates",
+                "indexes": [
+                    models.Index(
+                        fields=["face", "created_at"],
+                        name="face_templa_face_id_a29091_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(copy_faces_to_templates, migrations.RunPython.noop),
+    ]
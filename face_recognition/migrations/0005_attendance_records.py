@@ -0,0 +1,122 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:35
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("course_management", "0006_remove_courseannouncement_course_and_more"),
+        ("face_recognition", "0004_face_templates"),
+        ("user_management", "0007_alter_student_student_id_alter_teacher_teacher_id"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AttendanceRecord",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("filename", models.CharField(max_length=100, unique=True)),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("face_count", models.IntegerField(default=0)),
+                ("present_count", models.IntegerField(default=0)),
+                (
+                    "course",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="attendance_records",
+                        to="course_management.course",
+                    ),
+                ),
+                (
+                    "course_time",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="attendance_records",
+                        to="course_management.coursetime",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "attendance_records",
+            },
+        ),
+        migrations.CreateModel(
+            name="AttendanceEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255)),
+                ("present", models.BooleanField(default=False)),
+                ("confidence", models.FloatField(blank=True, null=True)),
+                (
+                    "student",
+                    models.ForeignKey(
+                        blank=True,
+                        db_constraint=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="attendance_entries",
+                        to="user_management.student",
+                    ),
+                ),
+                (
+                    "record",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="entries",
+                        to="face_recognition.attendancerecord",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "attendance_entries",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="attendancerecord",
+            index=models.Index(
+                fields=["created_at"], name="attendance__created_9c8a99_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="attendancerecord",
+            index=models.Index(
+                fields=["course_time", "created_at"],
+                name="attendance__course__6161c7_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="attendancerecord",
+            index=models.Index(
+                fields=["course", "created_at"], name="attendance__course__270dff_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="attendanceentry",
+            index=models.Index(
+                fields=["student", "record"], name="attendance__student_1b0fcb_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("face_recognition", "0005_attendance_records"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="attendancerecord",
+            name="attendance__created_9c8a99_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="attendancerecord",
+            name="attendance__course__6161c7_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="attendancerecord",
+            name="attendance__course__270dff_idx",
+        ),
+        migrations.AddIndex(
+            model_name="attendancerecord",
+            index=models.Index(
+                fields=["created_at", "id"], name="attendance__created_defbc0_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="attendancerecord",
+            index=models.Index(
+                fields=["course_time", "created_at", "id"],
+                name="attendance__course__9fca72_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="attendancerecord",
+            index=models.Index(
+                fields=["course", "created_at", "id"],
+                name="attendance__course__a97628_idx",
+            ),
+        ),
+    ]
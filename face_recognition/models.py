@@ -1,13 +1,96 @@
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 class Face(models.Model):
+    FEAT_FORMAT_CHOICES = (
+        ('f32', 'float32'),
+        ('f16', 'float16'),
+        ('i8', 'int8+缩放系数'),
+    )
+    
     id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=255, null=False)
     feat = models.BinaryField(null=False)
+    feat_format = models.CharField(max_length=4, choices=FEAT_FORMAT_CHOICES, default='f32')
+    feat_scale = models.FloatField(null=True, blank=True)
     
     class Meta:
         db_table = 'faces'
         
     def __str__(self):
         return self.name
+    
+    def get_embedding(self):
+        """返回float32格式的特征"""
+        from .quantization import decode
+        return decode(bytes(self.feat), self.feat_format, self.feat_scale)
+
+
+class FaceTemplate(models.Model):
+    """同一身份的每张录入照片各自的特征（模板），Face.feat 保存这些模板归一化后的均值（质心）"""
+    face = models.ForeignKey(Face, on_delete=models.CASCADE, related_name='templates')
+    feat = models.BinaryField(null=False)
+    feat_format = models.CharField(max_length=4, choices=Face.FEAT_FORMAT_CHOICES, default='f32')
+    feat_scale = models.FloatField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'face_templates'
+        indexes = [
+            models.Index(fields=['face', 'created_at']),
+        ]
+    
+    def get_embedding(self):
+        """返回float32格式的特征"""
+        from .quantization import decode
+        return decode(bytes(self.feat), self.feat_format, self.feat_scale)
+
+
+class GalleryVersion(models.Model):
+    """人脸特征库版本号，Face每次变更后递增，供各worker判断是否需要重新加载"""
+    SINGLETON_ID = 1
+
+    id = models.AutoField(primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'face_gallery_version'
+
+
+class AttendanceRecord(models.Model):
+    """一次考勤识别的结果，下载时按原来的文本格式生成"""
+    filename = models.CharField(max_length=100, unique=True)
+    course = models.ForeignKey('course_management.Course', on_delete=models.SET_NULL, null=True, blank=True, related_name='attendance_records')
+    course_time = models.ForeignKey('course_management.CourseTime', on_delete=models.SET_NULL, null=True, blank=True, related_name='attendance_records')
+    created_at = models.DateTimeField(default=timezone.now)
+    face_count = models.IntegerField(default=0)
+    present_count = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'attendance_records'
+        # 列表接口按(created_at, id)游标分页，索引包含id以便直接按索引顺序扫描
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['course_time', 'created_at', 'id']),
+            models.Index(fields=['course', 'created_at', 'id']),
+        ]
+    
+    def __str__(self):
+        return self.filename
+
+
+class AttendanceEntry(models.Model):
+    """考勤结果中的一个人脸，未识别的人脸student为空"""
+    record = models.ForeignKey(AttendanceRecord, on_delete=models.CASCADE, related_name='entries')
+    # 人脸id与学号一致，但可能存在未建立学生档案的人脸，因此不建立数据库外键约束
+    student = models.ForeignKey('user_management.Student', on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='attendance_entries')
+    name = models.CharField(max_length=255)
+    present = models.BooleanField(default=False)
+    confidence = models.FloatField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'attendance_entries'
+        indexes = [
+            models.Index(fields=['student', 'record']),
+        ]
@@ -0,0 +1,142 @@
+"""
+人脸质量检查
+
+检测之后、特征提取之前过滤质量太差的人脸：检测分数低、人脸太小、模糊、侧脸或低头抬头过大。
+这些人脸提取特征既浪费时间，匹配结果也多半是"未知"。不合格的人脸不提取特征，
+在考勤结果中单独列出并给出原因；检查的人脸数和不合格数记入指标。
+
+只对能分别调用检测、识别模型的后端生效（fake/replay后端检测时已经提取了特征）。
+
+通过 settings.FACE_RECOGNITION['QUALITY'] 配置：
+    'ENABLED': 是否启用（默认启用）
+    'MIN_DET_SCORE': 最低检测分数
+    'MIN_FACE_SIZE': 人脸框短边的最小像素数（原图中的像素，与预缩放的程度无关）
+    'MIN_SHARPNESS': 人脸区域（大于64×64时先缩小到64×64）拉普拉斯响应的最小方差
+    'MAX_YAW': 鼻尖偏离两眼中点的程度（占两眼间距的比例）
+    'MAX_PITCH': 鼻尖偏离眼睛与嘴角连线中点的程度（占眼嘴距离的比例）
+"""
+import cv2
+import numpy as np
+from django.conf import settings
+
+from .metrics import metrics
+
+REASON_LOW_SCORE = 'low_score'
+REASON_TOO_SMALL = 'too_small'
+REASON_BLURRY = 'blurry'
+REASON_POSE = 'pose'
+
+REASON_LABELS = {
+    REASON_LOW_SCORE: '检测置信度低',
+    REASON_TOO_SMALL: '人脸太小',
+    REASON_BLURRY: '图像模糊',
+    REASON_POSE: '人脸角度过大',
+}
+
+# 估计清晰度时较大的人脸区域缩小到的边长
+SHARPNESS_SIZE = 64
+
+
+def quality_config():
+    return getattr(settings, 'FACE_RECOGNITION', {}).get('QUALITY', {})
+
+
+def sharpness(img, bbox):
+    """人脸区域的灰度拉普拉斯响应方差，越小越模糊"""
+    height, width = img.shape[:2]
+    x1, y1 = max(0, int(bbox[0])), max(0, int(bbox[1]))
+    x2, y2 = min(width, int(np.ceil(bbox[2]))), min(height, int(np.ceil(bbox[3])))
+    if x2 <= x1 or y2 <= y1:
+        return 0.0
+    gray = cv2.cvtColor(img[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+    # 只缩小不放大，放大会把小人脸都判为模糊
+    if min(gray.shape) > SHARPNESS_SIZE:
+        gray = cv2.resize(gray, (SHARPNESS_SIZE, SHARPNESS_SIZE), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def pose(kps):
+    """
+    由5点关键点（左眼、右眼、鼻尖、左嘴角、右嘴角）粗略估计姿态，返回(yaw, pitch)。
+    先按两眼连线转正，yaw为鼻尖相对两眼中点的水平偏移占两眼间距的比例，
+    pitch为鼻尖在眼睛与嘴角之间的竖直位置偏离中点的比例；正脸时两者都接近0
+    """
+    kps = np.asarray(kps, dtype=np.float32)
+    left_eye, right_eye, nose = kps[0], kps[1], kps[2]
+    eye_center = (left_eye + right_eye) / 2
+    mouth_center = (kps[3] + kps[4]) / 2
+    axis = right_eye - left_eye
+    eye_distance = float(np.linalg.norm(axis))
+    if eye_distance == 0:
+        return 1.0, 1.0
+    axis /= eye_distance
+    normal = np.array([-axis[1], axis[0]], dtype=np.float32)
+
+    yaw = float(np.dot(nose - eye_center, axis)) / eye_distance
+    mouth_depth = float(np.dot(mouth_center - eye_center, normal))
+    if mouth_depth <= 0:
+        return yaw, 1.0
+    pitch = float(np.dot(nose - eye_center, normal)) / mouth_depth - 0.5
+    return yaw, pitch
+
+
+def assess(img, bbox, kps, det_score, config=None, scale=1.0):
+    """检查一张人脸，合格时返回None，否则返回不合格原因。scale为img相对原图的缩放比例"""
+    config = quality_config() if config is None else config
+    if det_score < config.get('MIN_DET_SCORE', 0.5):
+        return REASON_LOW_SCORE
+    if min(bbox[2] - bbox[0], bbox[3] - bbox[1]) / scale < config.get('MIN_FACE_SIZE', 20):
+        return REASON_TOO_SMALL
+    if kps is not None:
+        yaw, pitch = pose(kps)
+        if abs(yaw) > config.get('MAX_YAW', 0.35) or abs(pitch) > config.get('MAX_PITCH', 0.3):
+            return REASON_POSE
+    if sharpness(img, bbox) < config.get('MIN_SHARPNESS', 20):
+        return REASON_BLURRY
+    return None
+
+
+def assess_faces(img, bboxes, kpss, scale=1.0):
+    """
+    检查检测到的所有人脸，返回与bboxes等长的原因列表（合格为None）。
+    bboxes每行为 x1, y1, x2, y2, score；scale为img相对原图的缩放比例（见 inference.decode_image），
+    人脸尺寸换算为原图像素后比较。未启用时全部合格
+    """
+    config = quality_config()
+    if not config.get('ENABLED', True):
+        return [None] * len(bboxes)
+    reasons = [
+        assess(img, bbox[:4], kpss[i] if kpss is not None else None, bbox[4], config, scale)
+        for i, bbox in enumerate(bboxes)
+    ]
+    metrics.inc('face_quality_checked', len(reasons))
+    for reason in reasons:
+        if reason is not None:
+            metrics.inc('face_quality_rejected')
+            metrics.inc(f'face_quality_rejected_{reason}')
+    return reasons
+
+
+def reject_ratio():
+    """不合格人脸占检查人脸总数的比例"""
+    checked = metrics.get('face_quality_checked')
+    return metrics.get('face_quality_rejected') / checked if checked else None
+
+
+def split_faces(faces):
+    """把人脸列表分为(合格的人脸, 不合格的人脸)"""
+    accepted = [face for face in faces if getattr(face, 'rejected', None) is None]
+    rejected = [face for face in faces if getattr(face, 'rejected', None) is not None]
+    return accepted, rejected
+
+
+def describe(face):
+    """不合格人脸在响应中的表示"""
+    return {
+        'bbox': [round(float(value), 1) for value in face.bbox[:4]],
+        'det_score': round(float(face.det_score), 3),
+        'reason': face.rejected,
+    }
+
+
+metrics.register_gauge('face_quality_reject_ratio', reject_ratio)
@@ -0,0 +1,78 @@
+"""
+人脸特征的紧凑存储格式
+
+Face.feat 可以用以下格式存储，格式记录在每行的 feat_format 字段：
+- f32：原始float32（每个512维特征2KB）
+- f16：float16，体积减半
+- i8：int8加每行一个缩放系数（feat_scale），体积为原来的1/4
+
+新写入的特征使用 settings.FACE_RECOGNITION['FEAT_FORMAT'] 指定的格式，
+进程内特征库也以该格式保存，匹配时分块反量化计算相似度。
+"""
+import numpy as np
+from django.conf import settings
+
+FEAT_FORMATS = ('f32', 'f16', 'i8')
+
+DTYPES = {
+    'f32': np.float32,
+    'f16': np.float16,
+    'i8': np.int8,
+}
+
+
+def default_format():
+    """新写入特征使用的存储格式"""
+    feat_format = getattr(settings, 'FACE_RECOGNITION', {}).get('FEAT_FORMAT', 'f32')
+    if feat_format not in FEAT_FORMATS:
+        raise ValueError(f"未知的特征存储格式: {feat_format}")
+    return feat_format
+
+
+def quantize(feats, feat_format):
+    """
+    把float32特征（一维或二维）转换为指定格式，返回(紧凑数组, 缩放系数)。
+    i8格式按行对称量化，缩放系数为每行的 max|x| / 127；其他格式缩放系数为1。
+    """
+    feats = np.asarray(feats, dtype=np.float32)
+    if feat_format == 'i8':
+        scale = np.abs(feats).max(axis=-1, keepdims=True) / 127
+        scale = np.where(scale > 0, scale, 1).astype(np.float32)
+        compact = np.clip(np.rint(feats / scale), -127, 127).astype(np.int8)
+        return compact, scale.squeeze(-1)
+    ones = np.ones(feats.shape[:-1], dtype=np.float32)
+    return feats.astype(DTYPES[feat_format]), ones
+
+
+def dequantize(compact, scale=None):
+    """把紧凑格式的特征恢复为float32"""
+    feats = np.asarray(compact).astype(np.float32)
+    if scale is not None and compact.dtype == np.int8:
+        feats *= np.asarray(scale, dtype=np.float32)[..., None]
+    return feats
+
+
+def encode(feat, feat_format=None):
+    """把一个float32特征编码为Face模型的字段值"""
+    feat_format = feat_format or default_format()
+    compact, scale = quantize(feat, feat_format)
+    return {
+        'feat': compact.tobytes(),
+        'feat_format': feat_format,
+        'feat_scale': float(scale) if feat_format == 'i8' else None,
+    }
+
+
+def decode(data, feat_format='f32', scale=None, target_format=None):
+    """
+    解码数据库中的特征字节。
+    target_format为None时返回float32；否则返回该格式的(紧凑数组, 缩放系数)，
+    格式一致时直接读取，不经过float32转换。
+    """
+    compact = np.frombuffer(data, dtype=DTYPES[feat_format])
+    scale = np.float32(scale if scale is not None else 1.0)
+    if target_format is None:
+        return dequantize(compact, scale)
+    if target_format == feat_format:
+        return compact, scale
+    return quantize(dequantize(compact, scale), target_format)
@@ -0,0 +1,86 @@
+"""
+按图像内容缓存的识别结果
+
+考勤终端上传失败会重试，部分客户端还会重复发送同一帧。
+对上传的原始字节做哈希，检测和特征提取的结果按哈希缓存在进程内的LRU中，
+相同的图像再次提交时跳过推理，只与当前的特征库重新匹配。
+
+通过 settings.FACE_RECOGNITION['RESULT_CACHE'] 配置：
+    'ENABLED': 是否启用（默认启用）
+    'MAX_ENTRIES': 最多缓存的图像数
+    'TTL': 缓存有效期（秒）
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .metrics import metrics
+
+
+def content_key(img_data):
+    """上传图像的内容哈希"""
+    return hashlib.blake2b(img_data, digest_size=16).hexdigest()
+
+
+class ResultCache:
+    """按内容哈希缓存人脸检测与特征提取结果的LRU"""
+
+    def __init__(self, max_entries=256, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+        metrics.register_gauge('face_result_cache_hit_ratio', self.hit_ratio)
+        metrics.register_gauge('face_result_cache_size', lambda: len(self._entries))
+
+    def get(self, key):
+        """返回缓存的人脸列表，未命中或已过期时返回None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] >= self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        metrics.inc('face_result_cache_hits' if entry is not None else 'face_result_cache_misses')
+        return list(entry[1]) if entry is not None else None
+
+    def put(self, key, faces):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), list(faces))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def hit_ratio(self):
+        hits = metrics.get('face_result_cache_hits')
+        total = hits + metrics.get('face_result_cache_misses')
+        return hits / total if total else None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """按settings创建结果缓存，未启用时返回None"""
+    global _cache
+    cache_config = getattr(settings, 'FACE_RECOGNITION', {}).get('RESULT_CACHE', {})
+    if not cache_config.get('ENABLED', True):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(
+                max_entries=cache_config.get('MAX_ENTRIES', 256),
+                ttl=cache_config.get('TTL', 300),
+            )
+    return _cache
@@ -0,0 +1,80 @@
+"""
+识别后端会话池
+
+一个insightface分析器的onnxruntime会话同时只交给一个线程使用。
+池中保存SIZE个独立的后端实例，每个实例的会话设置较少的intra-op/inter-op线程数，
+推理时借出一个实例、用完归还，多个推理线程在同一进程内真正并行，总线程数不超过CPU核数。
+
+通过 settings.FACE_RECOGNITION['SESSION_POOL'] 配置：
+    'SIZE': 实例数，为1时不使用会话池
+    'INTRA_OP_THREADS': 每个会话的算子内线程数，默认为 CPU核数 / SIZE
+    'INTER_OP_THREADS': 每个会话的算子间线程数
+    'CHECKOUT_TIMEOUT': 借出实例最多等待的秒数
+"""
+import queue
+import time
+from contextlib import contextmanager, nullcontext
+
+from .metrics import metrics
+
+
+class SessionPool:
+    """识别后端实例池，对外提供与单个后端相同的 name、model_version 和 get"""
+
+    def __init__(self, backends, checkout_timeout=30):
+        if not backends:
+            raise ValueError("会话池至少需要一个后端实例")
+        self.backends = list(backends)
+        self.checkout_timeout = checkout_timeout
+        self._idle = queue.LifoQueue()
+        for backend in self.backends:
+            self._idle.put(backend)
+
+        metrics.register_gauge('face_session_pool_size', lambda: len(self.backends))
+        metrics.register_gauge('face_session_pool_idle', self._idle.qsize)
+
+    def __len__(self):
+        return len(self.backends)
+
+    @property
+    def name(self):
+        return self.backends[0].name
+
+    @property
+    def model_version(self):
+        return self.backends[0].model_version
+
+    @contextmanager
+    def checkout(self):
+        """借出一个后端实例，退出时归还"""
+        start = time.perf_counter()
+        try:
+            backend = self._idle.get(timeout=self.checkout_timeout)
+        except queue.Empty:
+            from .inference import InferenceTimeout
+
+            metrics.inc('face_session_checkout_timeouts')
+            raise InferenceTimeout("人脸识别服务繁忙，请稍后重试")
+        metrics.observe('face_session_checkout_wait_ms', (time.perf_counter() - start) * 1000)
+        try:
+            yield backend
+        finally:
+            self._idle.put(backend)
+
+    def get(self, img):
+        with self.checkout() as backend:
+            return backend.get(img)
+
+
+def checkout(analyzer):
+    """从会话池借出一个后端实例；不是会话池时直接使用该分析器"""
+    if isinstance(analyzer, SessionPool):
+        return analyzer.checkout()
+    return nullcontext(analyzer)
+
+
+def members(analyzer):
+    """会话池中的所有后端实例，不是会话池时为该分析器本身"""
+    if isinstance(analyzer, SessionPool):
+        return list(analyzer.backends)
+    return [analyzer]
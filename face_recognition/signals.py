@@ -0,0 +1,39 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from course_management.models import StudentCourse, ClassCourse
+from user_management.models import Student
+from .models import Face
+from .gallery import gallery
+from .course_gallery import course_galleries
+
+
+@receiver(post_save, sender=Face)
+def update_gallery_on_save(sender, instance, **kwargs):
+    """
+    保存人脸后原地更新进程内特征库（Face.feat为各模板的质心）。
+    特征和模板在事务内读取，事务提交后才修改特征库，回滚时特征库不变
+    """
+    templates = [template.get_embedding() for template in instance.templates.all()] if gallery.loaded else None
+    gallery.queue_upsert(instance.id, instance.name, instance.get_embedding(), templates)
+
+
+@receiver(post_delete, sender=Face)
+def update_gallery_on_delete(sender, instance, **kwargs):
+    """删除人脸的事务提交后从进程内特征库移除"""
+    gallery.queue_remove(instance.id)
+
+
+@receiver(post_save, sender=StudentCourse)
+@receiver(post_delete, sender=StudentCourse)
+@receiver(post_save, sender=ClassCourse)
+@receiver(post_delete, sender=ClassCourse)
+def invalidate_course_gallery(sender, instance, **kwargs):
+    """选课或班级课程变化后清除该课程的特征子矩阵缓存"""
+    course_galleries.invalidate(instance.course_id)
+
+
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Student)
+def invalidate_all_course_galleries(sender, instance, **kwargs):
+    """学生调班后可能影响多门课程，清除全部缓存"""
+    course_galleries.invalidate()
@@ -0,0 +1,105 @@
+"""
+特征库快照文件
+
+把特征库导出为 MEDIA_ROOT/face_gallery/ 下按版本号命名的 .npy 文件，
+各个worker用 np.load(mmap_mode='r') 打开同一份文件，共享操作系统的页缓存，
+不必每个进程各自保存一份特征矩阵，也不必各自从数据库重建。
+
+每个版本的文件先写入临时文件再原子重命名，最后更新 current.json 指向最新版本。
+
+通过 settings.FACE_RECOGNITION['SNAPSHOT'] 配置：
+    'ENABLED': 是否启用
+    'DIR': 快照目录，默认为 MEDIA_ROOT/face_gallery
+    'KEEP': 保留的历史版本数
+"""
+import glob
+import json
+import os
+import re
+import uuid
+
+import numpy as np
+from django.conf import settings
+
+ARRAYS = ('feats', 'scales', 'ids', 'names', 'template_feats', 'template_scales', 'template_ids')
+
+
+def _config():
+    return getattr(settings, 'FACE_RECOGNITION', {}).get('SNAPSHOT', {})
+
+
+def enabled():
+    return _config().get('ENABLED', False)
+
+
+def snapshot_dir():
+    return _config().get('DIR') or os.path.join(settings.MEDIA_ROOT, 'face_gallery')
+
+
+def _path(version, name):
+    return os.path.join(snapshot_dir(), f"v{version}_{name}.npy")
+
+
+def _replace_atomically(path, write):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_snapshot(version, feats, scales, ids, names, templates):
+    """导出指定版本的快照，templates为(模板特征, 缩放系数, 所属人脸id)，同一人脸的模板连续存放"""
+    template_feats, template_scales, template_ids = templates
+    os.makedirs(snapshot_dir(), exist_ok=True)
+    arrays = {
+        'feats': np.ascontiguousarray(feats),
+        'scales': np.ascontiguousarray(scales, dtype=np.float32),
+        'ids': np.ascontiguousarray(ids, dtype=np.int64),
+        # 定长Unicode数组可以直接内存映射，object数组不行
+        'names': np.array([str(name) for name in names], dtype=str) if len(names) else np.empty(0, dtype='<U1'),
+        'template_feats': np.ascontiguousarray(template_feats),
+        'template_scales': np.ascontiguousarray(template_scales, dtype=np.float32),
+        'template_ids': np.ascontiguousarray(template_ids, dtype=np.int64),
+    }
+    for name, array in arrays.items():
+        def write(tmp_path, array=array):
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+        _replace_atomically(_path(version, name), write)
+
+    def write_pointer(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': version, 'size': len(ids), 'dtype': str(feats.dtype)}, f)
+    _replace_atomically(os.path.join(snapshot_dir(), 'current.json'), write_pointer)
+
+    prune(keep=_config().get('KEEP', 3))
+
+
+def open_snapshot(version):
+    """以内存映射方式打开指定版本的快照，不存在或损坏时返回None"""
+    paths = {name: _path(version, name) for name in ARRAYS}
+    if not all(os.path.exists(path) for path in paths.values()):
+        return None
+    try:
+        return {name: np.load(path, mmap_mode='r') for name, path in paths.items()}
+    except Exception as e:
+        print(f"特征库快照读取失败，将从数据库加载: {e}")
+        return None
+
+
+def prune(keep=3):
+    """删除较旧的快照；已映射旧文件的worker在POSIX系统上仍可继续读取"""
+    versions = set()
+    for path in glob.glob(os.path.join(snapshot_dir(), 'v*_*.npy')):
+        match = re.match(r'v(\d+)_', os.path.basename(path))
+        if match:
+            versions.add(int(match.group(1)))
+    for version in sorted(versions)[:-keep] if keep > 0 else []:
+        for name in ARRAYS:
+            try:
+                os.remove(_path(version, name))
+            except OSError:
+                pass
@@ -1,3 +1,644 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import tempfile
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+import cv2
+
+import numpy as np
+from django.db import connection, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import urlsafe_base64_encode
+
+from class_management.models import Class
+from course_management.models import ClassCourse, Course, CourseTime, StudentCourse
+from status_management.models import Status
+from user_management.models import Student
+
+from .attendance import decode_cursor, encode_cursor, paginate_records, update_status
+from .downloads import RangeNotSatisfiable, content_response, parse_range
+from .matching import assign
+from .backends import DetectedFace
+from .enrollment import add_template, bulk_save_faces, centroid
+from .gallery import FaceGallery, current_version
+from .models import AttendanceRecord, Face, FaceTemplate
+from . import engine, quality, snapshot, tiling, views
+from .quantization import decode, dequantize, encode, quantize
+from .result_cache import ResultCache, content_key, get_result_cache
+
+
+def _unit_vectors(count, dim=512, seed=0):
+    feats = np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+    return feats / np.linalg.norm(feats, axis=1, keepdims=True)
+
+
+class AssignTests(SimpleTestCase):
+    """贪心一对一分配"""
+
+    def test_each_identity_used_once(self):
+        # 两个检测人脸都最像身份0，相似度更高的人脸得到身份0，另一个退而取身份1
+        sim = np.array([[0.9, 0.6], [0.8, 0.7]], dtype=np.float32)
+        matches, scores = assign(sim, 0.5)
+        self.assertEqual(matches.tolist(), [0, 1])
+        np.testing.assert_allclose(scores, [0.9, 0.7])
+
+    def test_below_threshold_is_unmatched(self):
+        sim = np.array([[0.9, 0.2], [0.85, 0.3]], dtype=np.float32)
+        matches, scores = assign(sim, 0.5)
+        self.assertEqual(matches.tolist(), [0, -1])
+        # 未识别的人脸返回其最高相似度
+        np.testing.assert_allclose(scores, [0.9, 0.85])
+
+    def test_more_faces_than_identities(self):
+        sim = np.array([[0.9], [0.95], [0.7]], dtype=np.float32)
+        matches, _ = assign(sim, 0.5)
+        self.assertEqual(matches.tolist(), [-1, 0, -1])
+
+    def test_empty_gallery(self):
+        matches, scores = assign(np.zeros((2, 0), dtype=np.float32), 0.5)
+        self.assertEqual(matches.tolist(), [-1, -1])
+        self.assertEqual(scores.tolist(), [0.0, 0.0])
+
+
+class RangeTests(SimpleTestCase):
+    """Range请求解析与206/416响应"""
+
+    content = b'0123456789'
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def _get(self, **headers):
+        return content_response(self.factory.get('/', **headers), self.content, 'a.txt', None)
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-3', 10), (0, 3))
+        self.assertEqual(parse_range('bytes=5-', 10), (5, 9))
+        self.assertEqual(parse_range('bytes=-4', 10), (6, 9))
+        self.assertEqual(parse_range('bytes=-20', 10), (0, 9))
+        # 结束位置超出内容时截断到末尾
+        self.assertEqual(parse_range('bytes=8-100', 10), (8, 9))
+
+    def test_unsupported_range_is_ignored(self):
+        self.assertIsNone(parse_range(None, 10))
+        self.assertIsNone(parse_range('bytes=-', 10))
+        self.assertIsNone(parse_range('bytes=0-1,4-5', 10))
+        self.assertIsNone(parse_range('items=0-1', 10))
+
+    def test_unsatisfiable_range(self):
+        for header in ('bytes=10-', 'bytes=5-2', 'bytes=-0'):
+            with self.assertRaises(RangeNotSatisfiable):
+                parse_range(header, 10)
+
+    def test_partial_response(self):
+        response = self._get(HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response['Content-Length'], '4')
+
+    def test_not_satisfiable_response(self):
+        response = self._get(HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_if_range(self):
+        etag = self._get()['ETag']
+        response = self._get(HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        # ETag不一致说明内容已变化，返回完整内容
+        response = self._get(HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, self.content)
+
+
+class CursorTests(TestCase):
+    """考勤记录的游标分页"""
+
+    def setUp(self):
+        now = timezone.now()
+        # 前两条创建时间相同，靠id区分先后
+        times = [now, now, now - datetime.timedelta(minutes=1), now - datetime.timedelta(minutes=2)]
+        for i, created_at in enumerate(times):
+            AttendanceRecord.objects.create(filename=f'attendance_{i}.txt', created_at=created_at)
+
+    def test_round_trip(self):
+        record = AttendanceRecord.objects.first()
+        self.assertEqual(decode_cursor(encode_cursor(record)), (record.created_at, record.id))
+
+    def test_pages_cover_all_records_once(self):
+        expected = list(AttendanceRecord.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        seen, cursor = [], None
+        while True:
+            page, cursor = paginate_records(AttendanceRecord.objects.all(), cursor, 3)
+            seen.extend(record.id for record in page)
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+
+    def test_bad_cursor(self):
+        bad_cursors = [
+            'not base64!',
+            urlsafe_base64_encode(b'not json'),
+            urlsafe_base64_encode(b'{}'),
+            urlsafe_base64_encode(b'[1, 2]'),
+            urlsafe_base64_encode(b'["2025-01-01T00:00:00", "x"]'),
+        ]
+        for cursor in bad_cursors:
+            with self.assertRaisesMessage(ValueError, 'cursor无效'):
+                decode_cursor(cursor)
+
+
+class QuantizationTests(SimpleTestCase):
+    """特征的紧凑存储格式"""
+
+    def test_f32_is_lossless(self):
+        feats = _unit_vectors(4)
+        compact, scale = quantize(feats, 'f32')
+        np.testing.assert_array_equal(dequantize(compact, scale), feats)
+
+    def test_round_trip_keeps_similarity(self):
+        feats = _unit_vectors(16)
+        for feat_format, dtype, tolerance in (('f16', np.float16, 1e-3), ('i8', np.int8, 2e-2)):
+            with self.subTest(feat_format=feat_format):
+                compact, scale = quantize(feats, feat_format)
+                self.assertEqual(compact.dtype, dtype)
+                restored = dequantize(compact, scale)
+                self.assertEqual(restored.dtype, np.float32)
+                np.testing.assert_allclose((restored * feats).sum(axis=1), 1.0, atol=tolerance)
+
+    def test_encode_decode(self):
+        feat = _unit_vectors(1)[0]
+        for feat_format in ('f32', 'f16', 'i8'):
+            with self.subTest(feat_format=feat_format):
+                fields = encode(feat, feat_format)
+                restored = decode(fields['feat'], fields['feat_format'], fields['feat_scale'])
+                self.assertGreater(float(restored @ feat), 0.999)
+
+    def test_decode_to_same_format_reads_bytes(self):
+        fields = encode(_unit_vectors(1)[0], 'i8')
+        compact, scale = decode(fields['feat'], 'i8', fields['feat_scale'], target_format='i8')
+        self.assertEqual(compact.tobytes(), fields['feat'])
+        self.assertAlmostEqual(float(scale), fields['feat_scale'], places=6)
+
+
+class QualityTests(SimpleTestCase):
+    """特征提取前的人脸质量检查"""
+
+    config = {'MIN_DET_SCORE': 0.5, 'MIN_FACE_SIZE': 20, 'MIN_SHARPNESS': 20, 'MAX_YAW': 0.35, 'MAX_PITCH': 0.3}
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.img = rng.integers(0, 256, (200, 200, 3), dtype=np.uint8)
+        # 右半边为纯色，没有纹理
+        self.img[:, 100:] = 128
+        self.sharp = np.array([10, 10, 90, 90], dtype=np.float32)
+        self.flat = np.array([110, 10, 190, 90], dtype=np.float32)
+
+    @staticmethod
+    def _kps(bbox, nose_x=0.5):
+        x1, y1, x2, y2 = bbox
+        size = x2 - x1
+        template = np.array([[0.3, 0.35], [0.7, 0.35], [nose_x, 0.55], [0.35, 0.75], [0.65, 0.75]], dtype=np.float32)
+        return np.array([x1, y1], dtype=np.float32) + template * size
+
+    def _assess(self, bbox, score=0.9, nose_x=0.5, scale=1.0):
+        return quality.assess(self.img, bbox, self._kps(bbox, nose_x), score, self.config, scale)
+
+    def test_good_face(self):
+        self.assertIsNone(self._assess(self.sharp))
+
+    def test_reasons(self):
+        self.assertEqual(self._assess(self.sharp, score=0.3), quality.REASON_LOW_SCORE)
+        self.assertEqual(self._assess(np.array([10, 10, 25, 25], dtype=np.float32)), quality.REASON_TOO_SMALL)
+        self.assertEqual(self._assess(self.sharp, nose_x=0.75), quality.REASON_POSE)
+        self.assertEqual(self._assess(self.flat), quality.REASON_BLURRY)
+
+    def test_face_size_in_original_pixels(self):
+        small = np.array([10, 10, 25, 25], dtype=np.float32)
+        # 检测图像缩小到原图的1/4时，15像素的人脸在原图中为60像素
+        self.assertIsNone(self._assess(small, scale=0.25))
+        self.assertEqual(self._assess(self.sharp, scale=5.0), quality.REASON_TOO_SMALL)
+
+    def test_frontal_pose(self):
+        yaw, pitch = quality.pose(self._kps(self.sharp))
+        self.assertAlmostEqual(yaw, 0.0, places=5)
+        self.assertAlmostEqual(pitch, 0.0, places=5)
+
+    def test_assess_faces(self):
+        bboxes = np.array([[*self.sharp, 0.9], [*self.flat, 0.9]], dtype=np.float32)
+        kpss = np.stack([self._kps(self.sharp), self._kps(self.flat)])
+        with override_settings(FACE_RECOGNITION={'QUALITY': self.config}):
+            self.assertEqual(quality.assess_faces(self.img, bboxes, kpss), [None, quality.REASON_BLURRY])
+        with override_settings(FACE_RECOGNITION={'QUALITY': dict(self.config, ENABLED=False)}):
+            self.assertEqual(quality.assess_faces(self.img, bboxes, kpss), [None, None])
+
+
+class ResultCacheTests(SimpleTestCase):
+    """按图像内容缓存的识别结果"""
+
+    def test_hit_and_miss(self):
+        cache = ResultCache(max_entries=4, ttl=60)
+        key = content_key(b'image')
+        self.assertIsNone(cache.get(key))
+        cache.put(key, ['face'])
+        self.assertEqual(cache.get(key), ['face'])
+        self.assertNotEqual(content_key(b'image2'), key)
+
+    def test_returns_copy(self):
+        cache = ResultCache(max_entries=4, ttl=60)
+        cache.put('a', ['face'])
+        cache.get('a').append('other')
+        self.assertEqual(cache.get('a'), ['face'])
+
+    def test_lru_eviction(self):
+        cache = ResultCache(max_entries=2, ttl=60)
+        cache.put('a', [1])
+        cache.put('b', [2])
+        cache.get('a')  # a成为最近使用的条目
+        cache.put('c', [3])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), [1])
+        self.assertEqual(cache.get('c'), [3])
+
+    def test_expired(self):
+        cache = ResultCache(max_entries=2, ttl=0)
+        cache.put('a', [1])
+        self.assertIsNone(cache.get('a'))
+
+    def test_disabled(self):
+        with override_settings(FACE_RECOGNITION={'RESULT_CACHE': {'ENABLED': False}}):
+            self.assertIsNone(get_result_cache())
+
+
+class TilingTests(SimpleTestCase):
+    """分块检测的网格划分、截断判定与NMS合并"""
+
+    def test_nms(self):
+        bboxes = np.array([
+            [0, 0, 100, 100, 0.8],
+            [5, 5, 105, 105, 0.9],  # 与第一个框高度重叠、分数更高
+            [200, 200, 260, 260, 0.7],
+        ], dtype=np.float32)
+        self.assertEqual(sorted(tiling.nms(bboxes, 0.4).tolist()), [1, 2])
+        # 阈值高于重叠程度时都保留
+        self.assertEqual(sorted(tiling.nms(bboxes, 0.95).tolist()), [0, 1, 2])
+
+    def test_tile_grid_covers_image(self):
+        origins = tiling.tile_grid(1500, 700, 640, 0.2)
+        self.assertEqual(origins[0], (0, 0))
+        # 最后一行/列与图像边缘对齐
+        self.assertEqual(max(x for x, _ in origins), 1500 - 640)
+        self.assertEqual(max(y for _, y in origins), 700 - 640)
+        self.assertEqual(tiling.tile_grid(500, 400, 640, 0.2), [(0, 0)])
+
+    def test_truncated_only_at_inner_edges(self):
+        bboxes = np.array([
+            [0, 100, 50, 150, 0.9],  # 贴着小块左边界
+            [300, 300, 350, 350, 0.9],  # 完整
+        ], dtype=np.float32)
+        # 小块位于图像左边缘时，左边界就是图像边界，不算截断
+        self.assertEqual(tiling._truncated(bboxes, 0, 0, 640, 640, 2000, 2000).tolist(), [False, False])
+        self.assertEqual(tiling._truncated(bboxes, 512, 0, 640, 640, 2000, 2000).tolist(), [True, False])
+
+
+class UpdateStatusTests(TestCase):
+    """考勤结果批量写入Status.if_come"""
+
+    def setUp(self):
+        self.course = Course.objects.create(title='course')
+        self.course_time = CourseTime.objects.create(course=self.course)
+        # 学生1、2直接选课，学生3、4通过班级选课
+        for student_id in (1, 2):
+            StudentCourse.objects.create(student=Student.objects.create(student_id=student_id), course=self.course)
+        klass = Class.objects.create(class_name='c', class_system='s')
+        ClassCourse.objects.create(class_id=klass, course=self.course)
+        for student_id in (3, 4):
+            Student.objects.create(student_id=student_id, class_id=klass)
+        Student.objects.create(student_id=99)
+
+        Status.objects.create(student_id=1, course_time=self.course_time, if_come=True)
+        Status.objects.create(student_id=3, course_time=self.course_time, if_come=False)
+        # 不在花名册上的学生不受影响
+        Status.objects.create(student_id=99, course_time=self.course_time, if_come=True)
+
+    def _if_come(self):
+        return dict(Status.objects.filter(course_time=self.course_time).values_list('student_id', 'if_come'))
+
+    def test_writes_whole_roster(self):
+        summary = update_status(self.course_time.id, self.course.course_id, [2, 3, 50])
+        self.assertEqual(summary, {'present': 2, 'absent': 2, 'created': 2})
+        self.assertEqual(self._if_come(), {1: False, 2: True, 3: True, 4: False, 99: True})
+
+    def test_rerun_updates_existing_rows(self):
+        update_status(self.course_time.id, self.course.course_id, [2, 3])
+        summary = update_status(self.course_time.id, self.course.course_id, [1])
+        self.assertEqual(summary, {'present': 1, 'absent': 3, 'created': 0})
+        self.assertEqual(self._if_come(), {1: True, 2: False, 3: False, 4: False, 99: True})
+        self.assertEqual(Status.objects.filter(course_time=self.course_time).count(), 5)
+
+    def test_query_count_independent_of_roster_size(self):
+        with CaptureQueriesContext(connection) as small:
+            update_status(self.course_time.id, self.course.course_id, [1])
+        for student_id in range(100, 150):
+            StudentCourse.objects.create(student=Student.objects.create(student_id=student_id), course=self.course)
+        with CaptureQueriesContext(connection) as large:
+            update_status(self.course_time.id, self.course.course_id, [1] + list(range(100, 150, 2)))
+        self.assertEqual(len(large), len(small))
+
+
+class _ColorAnalyzer:
+    """每张图像返回一张人脸，特征由图像的灰度值决定"""
+
+    def get(self, img):
+        feat = _unit_vectors(1, seed=int(img[0, 0, 0]))[0]
+        return [DetectedFace(np.array([0, 0, 10, 10], dtype=np.float32), None, 0.9, feat)]
+
+
+class BatchInsertFacesTests(TestCase):
+    """压缩包批量录入"""
+
+    @staticmethod
+    def _archive(files):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w') as archive:
+            for filename, value in files:
+                _, png = cv2.imencode('.png', np.full((12, 8, 3), value, dtype=np.uint8))
+                archive.writestr(filename, png.tobytes())
+        return SimpleUploadedFile('faces.zip', buf.getvalue(), content_type='application/zip')
+
+    def _post(self, files):
+        with mock.patch('face_recognition.views.get_analyzer', return_value=_ColorAnalyzer()):
+            return self.client.post('/face_recognition/batch_insert_faces/', {'archive': self._archive(files)}).json()
+
+    def _template_seeds(self, face_id):
+        feats = [template.get_embedding() for template in FaceTemplate.objects.filter(face_id=face_id).order_by('created_at', 'id')]
+        return [int(np.argmax([feat @ _unit_vectors(1, seed=seed)[0] for seed in range(256)])) for feat in feats]
+
+    def test_duplicate_ids_become_templates_in_archive_order(self):
+        result = self._post([('a_7.png', 10), ('b_8.png', 20), ('c_7.png', 30)])
+        self.assertEqual([item['file'] for item in result['details']['success']], ['a_7.png', 'b_8.png', 'c_7.png'])
+        self.assertEqual(self._template_seeds(7), [10, 30])
+        # 姓名以压缩包中最后一张为准
+        self.assertEqual(Face.objects.get(id=7).name, 'c')
+
+    @override_settings(FACE_RECOGNITION={'TEMPLATES': {'MAX_PER_IDENTITY': 2}})
+    def test_photos_over_limit_are_reported(self):
+        result = self._post([('a_7.png', 10), ('b_7.png', 20), ('c_7.png', 30)])
+        self.assertEqual([item['file'] for item in result['details']['success']], ['b_7.png', 'c_7.png'])
+        self.assertEqual([item['file'] for item in result['details']['failed']], ['a_7.png'])
+        self.assertEqual(self._template_seeds(7), [20, 30])
+
+
+@override_settings(FACE_RECOGNITION={'TEMPLATES': {'MAX_PER_IDENTITY': 3}})
+class TemplateTests(TestCase):
+    """多模板录入：模板替换、截断与质心"""
+
+    def setUp(self):
+        self.feats = _unit_vectors(8, seed=1)
+
+    def _templates(self, face_id):
+        return np.stack([
+            template.get_embedding()
+            for template in FaceTemplate.objects.filter(face_id=face_id).order_by('created_at', 'id')
+        ])
+
+    def assertCentroid(self, face_id, feats):
+        np.testing.assert_allclose(Face.objects.get(id=face_id).get_embedding(), centroid(feats), atol=1e-5)
+
+    def test_bulk_save_replaces_oldest_templates(self):
+        bulk_save_faces([(1, 'a', self.feats[:2])])
+        bulk_save_faces([(1, 'b', self.feats[2:4])])
+        # 上限为3，最早的模板被丢弃
+        np.testing.assert_allclose(self._templates(1), self.feats[1:4], atol=1e-6)
+        self.assertCentroid(1, self.feats[1:4])
+        self.assertEqual(Face.objects.get(id=1).name, 'b')
+
+    def test_bulk_save_truncates_new_photos(self):
+        bulk_save_faces([(1, 'a', self.feats[:5]), (2, 'b', self.feats[5:6])])
+        np.testing.assert_allclose(self._templates(1), self.feats[2:5], atol=1e-6)
+        self.assertEqual(len(self._templates(2)), 1)
+        self.assertCentroid(2, self.feats[5:6])
+
+    def test_add_template(self):
+        self.assertEqual(add_template(1, 'a', self.feats[0]), (True, 1))
+        for i in range(1, 4):
+            created, count = add_template(1, 'a', self.feats[i])
+        self.assertEqual((created, count), (False, 3))
+        np.testing.assert_allclose(self._templates(1), self.feats[1:4], atol=1e-6)
+        self.assertCentroid(1, self.feats[1:4])
+
+
+class EmbeddingsTests(SimpleTestCase):
+    """终端上传特征：解码与模型版本检查"""
+
+    def setUp(self):
+        self.feats = _unit_vectors(3, dim=4) * 2
+
+    def test_decode_normalizes(self):
+        for dtype, code in (('float32', '<f4'), ('float16', '<f2')):
+            decoded = views._decode_embeddings(self.feats.astype(code).tobytes(), dtype, 4)
+            self.assertEqual(decoded.dtype, np.float32)
+            np.testing.assert_allclose(decoded, self.feats / 2, atol=1e-3)
+
+    def test_decode_rejects_bad_data(self):
+        data = self.feats.astype('<f4').tobytes()
+        for args, message in (
+            ((data[:-1], 'float32', 4), '特征数据长度应为16字节的整数倍'),
+            ((b'', 'float32', 4), '特征数据长度应为16字节的整数倍'),
+            ((data, 'float64', 4), 'dtype只支持float32或float16'),
+            ((np.zeros(4, '<f4').tobytes(), 'float32', 4), '人脸特征包含无效值'),
+        ):
+            with self.assertRaisesMessage(ValueError, message):
+                views._decode_embeddings(*args)
+
+    def _post(self, data, **headers):
+        request = RequestFactory().post('/face_recognition/check_attendance_embeddings/', data, headers=headers)
+        analyzer = mock.Mock(model_version='buffalo_l')
+        with mock.patch('face_recognition.views.get_analyzer', return_value=analyzer):
+            return json.loads(views.check_attendance_embeddings(request).content)
+
+    def test_model_version_mismatch(self):
+        for headers, client in (({}, '未提供'), ({'X-Model-Version': 'antelopev2'}, 'antelopev2')):
+            result = self._post({'embeddings': ''}, **headers)
+            self.assertEqual(result['status'], 'error')
+            self.assertEqual(result['message'], f'模型版本不一致：终端为{client}，服务器为buffalo_l')
+            self.assertEqual(result['model_version'], 'buffalo_l')
+
+    def test_invalid_base64(self):
+        result = self._post({'embeddings': '不是base64'}, **{'X-Model-Version': 'buffalo_l'})
+        self.assertEqual(result['message'], 'embeddings不是有效的base64编码')
+
+
+@override_settings(FACE_RECOGNITION={})
+class GallerySignalTests(TestCase):
+    """Face的保存和删除在事务提交后同步到进程内特征库"""
+
+    def setUp(self):
+        self.feats = _unit_vectors(4, seed=2)
+        self.gallery = FaceGallery().load()
+        for module in ('signals', 'enrollment'):
+            patcher = mock.patch(f'face_recognition.{module}.gallery', self.gallery)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _save(self, face_id, feat):
+        Face(id=face_id, name=f'student{face_id}', **encode(feat)).save()
+
+    def test_one_callback_per_transaction(self):
+        version = current_version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                for face_id in range(1, 4):
+                    self._save(face_id, self.feats[face_id])
+                Face.objects.get(id=2).delete()
+                # 提交前特征库不变
+                self.assertEqual(len(self.gallery), 0)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(current_version(), version + 1)
+        self.assertEqual(self.gallery.version, version + 1)
+        self.assertEqual(sorted(self.gallery.snapshot()[2].tolist()), [1, 3])
+
+    def test_rolled_back_savepoint_is_discarded(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                self._save(1, self.feats[1])
+                try:
+                    with transaction.atomic():
+                        self._save(2, self.feats[2])
+                        raise ValueError
+                except ValueError:
+                    pass
+                self._save(3, self.feats[3])
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(sorted(self.gallery.snapshot()[2].tolist()), [1, 3])
+
+    def test_bulk_save_shares_callback(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                self._save(1, self.feats[1])
+                bulk_save_faces([(2, 'b', [self.feats[2]])])
+        # bulk_save_faces的atomic是新的保存点，单独一个回调
+        self.assertEqual(len(callbacks), 2)
+        self.assertEqual(sorted(self.gallery.snapshot()[2].tolist()), [1, 2])
+
+
+@override_settings(FACE_RECOGNITION={})
+class FaceGalleryTests(TestCase):
+    """进程内特征库：原地修改、版本号与快照"""
+
+    def setUp(self):
+        self.feats = _unit_vectors(6, seed=3)
+        Face.objects.bulk_create([Face(id=i, name=f'student{i}', **encode(self.feats[i])) for i in range(1, 4)])
+        self.gallery = FaceGallery().load()
+        patcher = mock.patch('face_recognition.signals.gallery', self.gallery)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _matched(self, gallery, feats):
+        matches, _, ids, names = gallery.match(np.asarray(feats), 0.9)
+        return [(int(ids[m]), str(names[m])) if m >= 0 else None for m in matches]
+
+    def test_upsert_updates_in_place(self):
+        self.gallery.upsert(2, 'renamed', self.feats[4])
+        self.gallery.upsert(5, 'student5', self.feats[5])
+        self.assertEqual(len(self.gallery), 4)
+        self.assertEqual(self.gallery.snapshot()[2].tolist(), [1, 2, 3, 5])
+        self.assertEqual(self._matched(self.gallery, self.feats[[2, 4, 5]]), [None, (2, 'renamed'), (5, 'student5')])
+
+    def test_remove_moves_last_row(self):
+        self.gallery.remove(1)
+        self.gallery.remove(404)
+        self.assertEqual(self.gallery.snapshot()[2].tolist(), [3, 2])
+        self.assertEqual(self._matched(self.gallery, self.feats[1:4]), [None, (2, 'student2'), (3, 'student3')])
+
+    def test_after_change_reloads_other_instance(self):
+        other = FaceGallery().load()
+        with self.captureOnCommitCallbacks(execute=True):
+            Face(id=5, name='student5', **encode(self.feats[5])).save()
+        self.assertEqual(self.gallery.version, current_version())
+        self.assertNotEqual(other.version, current_version())
+        other.ensure_current()
+        self.assertEqual(other.version, current_version())
+        self.assertEqual(self._matched(other, self.feats[[5]]), [(5, 'student5')])
+
+    def test_rollback_leaves_gallery_unchanged(self):
+        version = current_version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    Face(id=5, name='student5', **encode(self.feats[5])).save()
+                    Face.objects.get(id=1).delete()
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertEqual(current_version(), version)
+        self.assertEqual(self.gallery.snapshot()[2].tolist(), [1, 2, 3])
+
+    def test_snapshot_round_trip(self):
+        FaceTemplate.objects.bulk_create([FaceTemplate(face_id=1, **encode(feat)) for feat in self.feats[[1, 4]]])
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            with override_settings(FACE_RECOGNITION={'SNAPSHOT': {'ENABLED': True, 'DIR': snapshot_dir}}):
+                exported = FaceGallery().load()
+                self.assertIsNotNone(snapshot.open_snapshot(exported.version))
+                with mock.patch.object(Face.objects, 'order_by', side_effect=AssertionError('不应查询数据库')):
+                    opened = FaceGallery().load()
+                for before, after in zip(exported.snapshot(), opened.snapshot()):
+                    np.testing.assert_array_equal(before, after)
+                # 第二个模板只有逐模板重新打分才能匹配（一对一分配，分两次匹配）
+                for feat in self.feats[[1, 4]]:
+                    self.assertEqual(self._matched(opened, [feat]), [(1, 'student1')])
+                # 快照是只读的内存映射，修改前复制到进程内存
+                opened.upsert(2, 'renamed', self.feats[5])
+                self.assertEqual(self._matched(opened, self.feats[[5]]), [(2, 'renamed')])
+
+
+class PreloadTests(SimpleTestCase):
+    """preload模式：未fork的进程复用已加载的模型，fork出的worker重新创建会话"""
+
+    def setUp(self):
+        self.analyzer = mock.Mock(name='analyzer')
+        patches = [
+            mock.patch.multiple(engine, _attempted=False, _preloaded=None, _preload_pid=None, timings={}),
+            mock.patch.object(engine, 'load_analyzer', return_value=self.analyzer),
+            mock.patch.object(engine, 'warm_up'),
+            mock.patch.object(engine, '_reinit_sessions'),
+            mock.patch.object(engine, '_install'),
+            mock.patch.object(engine, '_report'),
+            mock.patch.object(engine.os, 'register_at_fork'),
+            mock.patch.object(views, 'app', None),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with mock.patch('builtins.print'):
+            engine._preload()
+
+    def test_no_fork_reuses_preloaded_analyzer(self):
+        with mock.patch('builtins.print'):
+            self.assertIs(engine.get_analyzer(), self.analyzer)
+        engine.load_analyzer.assert_called_once_with()
+        engine.warm_up.assert_called_once_with(self.analyzer)
+        engine._reinit_sessions.assert_not_called()
+        engine._install.assert_called_once_with(self.analyzer)
+
+    def test_forked_worker_reinitializes_sessions(self):
+        engine.os.register_at_fork.assert_called_once_with(after_in_child=engine._after_fork_in_child)
+        with mock.patch('builtins.print'):
+            engine._after_fork_in_child()
+        engine.load_analyzer.assert_called_once_with()
+        engine._reinit_sessions.assert_called_once_with(self.analyzer)
+        self.assertEqual(engine.warm_up.call_count, 2)
+        engine._install.assert_called_once_with(self.analyzer)
+        self.assertTrue(engine._attempted)
+
+    def test_other_process_loads_its_own(self):
+        with mock.patch.object(engine.os, 'getpid', return_value=engine._preload_pid + 1), mock.patch('builtins.print'):
+            engine.get_analyzer()
+        self.assertEqual(engine.load_analyzer.call_count, 2)
@@ -0,0 +1,173 @@
+"""
+大图分块检测
+
+阶梯教室的横幅照片缩小到 DET_SIZE（640×640）后，后排的人脸只剩几个像素，检测不到；
+直接用更大的检测尺寸又太慢。分块检测时图像不再预缩放到检测尺寸（只限制最长边），
+切成检测尺寸大小、相互重叠的小块，在会话池上并行检测，坐标换算回整图后用NMS合并。
+另外对整图做一次常规检测，找出比重叠区域还大的前排人脸。
+
+被小块边界（不是整图边界）截断的人脸框直接丢弃：人脸小于重叠宽度时，
+相邻的小块一定包含完整的人脸；更大的人脸由整图检测找到。
+
+可选按肤色比例跳过几乎没有皮肤颜色的小块（天花板、黑板、空座位）。
+
+通过 settings.FACE_RECOGNITION['TILING'] 配置：
+    'ENABLED': 是否启用
+    'MAX_IMAGE_SIZE': 解码后图像的最长边（像素），限制小块数量
+    'OVERLAP': 相邻小块重叠的比例
+    'NMS_THRESHOLD': 合并重复人脸框的IoU阈值
+    'WORKERS': 并行检测的线程数，默认为会话池的实例数
+    'SKIP_LOW_SKIN': 是否跳过肤色比例过低的小块
+    'MIN_SKIN_RATIO': 小块中肤色像素的最低比例
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from .imaging import decode_scaled
+from .metrics import metrics
+
+# 截断判定：人脸框距小块内部边界不超过该像素数
+EDGE_MARGIN = 2
+
+# YCrCb空间中的肤色范围
+_SKIN_LOWER = np.array([0, 133, 77], dtype=np.uint8)
+_SKIN_UPPER = np.array([255, 173, 127], dtype=np.uint8)
+
+
+def tiling_config():
+    return getattr(settings, 'FACE_RECOGNITION', {}).get('TILING', {})
+
+
+def enabled():
+    return tiling_config().get('ENABLED', False)
+
+
+def tile_size():
+    return max(getattr(settings, 'FACE_RECOGNITION', {}).get('DET_SIZE', (640, 640)))
+
+
+def decode_full(img_data):
+    """解码用于分块检测的图像：不缩小到检测尺寸，只把最长边限制在MAX_IMAGE_SIZE以内，返回(图像, 缩放比例)"""
+    max_size = tiling_config().get('MAX_IMAGE_SIZE', 1920)
+    return decode_scaled(img_data, (max_size, max_size))
+
+
+def should_tile(img):
+    """图像比检测输入尺寸大时才分块"""
+    return enabled() and max(img.shape[:2]) > tile_size()
+
+
+def _origins(length, tile, stride):
+    if length <= tile:
+        return [0]
+    origins = list(range(0, length - tile, stride))
+    origins.append(length - tile)
+    return origins
+
+
+def tile_grid(width, height, tile, overlap):
+    """小块的左上角坐标列表，最后一行/列与图像边缘对齐"""
+    stride = max(1, int(tile * (1 - overlap)))
+    return [(x, y) for y in _origins(height, tile, stride) for x in _origins(width, tile, stride)]
+
+
+def skin_ratio(tile):
+    """小块中肤色像素的比例，隔4个像素采样"""
+    sample = np.ascontiguousarray(tile[::4, ::4])
+    mask = cv2.inRange(cv2.cvtColor(sample, cv2.COLOR_BGR2YCrCb), _SKIN_LOWER, _SKIN_UPPER)
+    return cv2.countNonZero(mask) / mask.size
+
+
+def nms(bboxes, threshold):
+    """按分数从高到低做非极大值抑制，bboxes每行为 x1, y1, x2, y2, score，返回保留的下标"""
+    x1, y1, x2, y2, scores = bboxes.T
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        w = np.maximum(0.0, np.minimum(x2[i], x2[order[1:]]) - np.maximum(x1[i], x1[order[1:]]) + 1)
+        h = np.maximum(0.0, np.minimum(y2[i], y2[order[1:]]) - np.maximum(y1[i], y1[order[1:]]) + 1)
+        inter = w * h
+        iou = inter / (areas[i] + areas[order[1:]] - inter)
+        order = order[1:][iou <= threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def _truncated(bboxes, x, y, tile_w, tile_h, width, height):
+    """被小块内部边界截断的人脸框"""
+    truncated = np.zeros(len(bboxes), dtype=bool)
+    if x > 0:
+        truncated |= bboxes[:, 0] <= EDGE_MARGIN
+    if y > 0:
+        truncated |= bboxes[:, 1] <= EDGE_MARGIN
+    if x + tile_w < width:
+        truncated |= bboxes[:, 2] >= tile_w - EDGE_MARGIN
+    if y + tile_h < height:
+        truncated |= bboxes[:, 3] >= tile_h - EDGE_MARGIN
+    return truncated
+
+
+def detect_tiled(img, detect, map_fn=map):
+    """
+    分块检测，返回与 detect_faces 相同的(bboxes, kpss)。
+    detect(图像)检测一张图像；map_fn用于并行执行各小块（和整图）的检测
+    """
+    config = tiling_config()
+    height, width = img.shape[:2]
+    tile = tile_size()
+    origins = tile_grid(width, height, tile, config.get('OVERLAP', 0.2))
+    if config.get('SKIP_LOW_SKIN', False):
+        min_ratio = config.get('MIN_SKIN_RATIO', 0.01)
+        kept = [(x, y) for x, y in origins if skin_ratio(img[y:y + tile, x:x + tile]) >= min_ratio]
+        metrics.inc('face_tiles_skipped', len(origins) - len(kept))
+        origins = kept
+    metrics.observe('face_tiles_per_image', len(origins))
+
+    # 第一项为整图检测（检测模型内部缩放到检测尺寸，坐标已是整图坐标）
+    jobs = [None] + origins
+    results = map_fn(lambda origin: detect(img if origin is None else img[origin[1]:origin[1] + tile, origin[0]:origin[0] + tile]), jobs)
+
+    all_bboxes, all_kpss = [], []
+    for origin, (bboxes, kpss) in zip(jobs, results):
+        if len(bboxes) == 0:
+            continue
+        bboxes = np.array(bboxes, dtype=np.float32)
+        kpss = np.array(kpss, dtype=np.float32)
+        if origin is not None:
+            x, y = origin
+            keep = ~_truncated(bboxes, x, y, min(tile, width - x), min(tile, height - y), width, height)
+            bboxes, kpss = bboxes[keep], kpss[keep]
+            bboxes[:, [0, 2]] += x
+            bboxes[:, [1, 3]] += y
+            kpss += (x, y)
+        all_bboxes.append(bboxes)
+        all_kpss.append(kpss)
+
+    if not all_bboxes:
+        return np.zeros((0, 5), dtype=np.float32), np.zeros((0, 5, 2), dtype=np.float32)
+    bboxes = np.concatenate(all_bboxes)
+    kpss = np.concatenate(all_kpss)
+    keep = nms(bboxes, config.get('NMS_THRESHOLD', 0.4))
+    return bboxes[keep], kpss[keep]
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(default_workers):
+    """并行检测小块的线程池；小块检测只占用会话池中的实例，不占用推理线程池，避免相互等待"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=tiling_config().get('WORKERS') or default_workers,
+                thread_name_prefix='face-tile',
+            )
+    return _executor
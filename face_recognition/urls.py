@@ -5,5 +5,8 @@ urlpatterns = [
     path('insert_face/', views.insert_face, name='insert_face'),
     path('batch_insert_faces/', views.batch_insert_faces, name='batch_insert_faces'),
     path('check_attendance/', views.check_attendance, name='check_attendance'),
+    path('check_attendance_embeddings/', views.check_attendance_embeddings, name='check_attendance_embeddings'),
     path('download_attendance_file/', views.download_attendance_file, name='download_attendance_file'),
+    path('attendance_records/', views.list_attendance_records, name='list_attendance_records'),
+    path('metrics/', views.face_metrics, name='face_metrics'),
 ] 
\ No newline at end of file
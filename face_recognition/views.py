@@ -1,23 +1,46 @@
 from django.shortcuts import render
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 import os
 import json
+import base64
 import tempfile
-import re
 import numpy as np
-import cv2
 from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
 import datetime
-from django.conf import settings
-from .models import Face
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from django.db import transaction
+from django.utils import timezone
+from course_management.models import Course, CourseTime
+from .gallery import gallery
+from .course_gallery import course_galleries
+from .matching import match_faces
+from .enrollment import parse_name_id, extract_single_face_feat, iter_archive_images, bulk_save_faces, add_template, max_templates
+from .inference import get_executor, analyze_image, InferenceQueueFull, InferenceTimeout
+from .batching import get_scheduler
+from .metrics import metrics
+from .attendance import (
+    ATTENDANCE_DIR, ATTENDANCE_PAGE_SIZE, ATTENDANCE_MAX_PAGE_SIZE,
+    save_attendance, render_attendance, update_status, paginate_records,
+)
+from .models import AttendanceRecord
+from . import downloads
+from .engine import get_analyzer
+from .timing import StageTimer
+from .result_cache import content_key, get_result_cache
+from .quality import split_faces, describe
 
 # Create your views here.
 
-# 人脸分析器将在 apps.py 的 ready() 方法中初始化
+# 识别后端（backends.py）由 engine.py 按启动方式初始化，视图通过 get_analyzer() 获取
 app = None
 
+# 终端提交人脸特征时支持的数据类型（小端序）、默认维度和每次最多的人脸数
+EMBEDDING_DTYPES = {'float32': '<f4', 'float16': '<f2'}
+EMBEDDING_DIM = 512
+EMBEDDINGS_MAX_FACES = 500
+
 @csrf_exempt
 def insert_face(request):
     """插入单个人脸"""
@@ -31,17 +54,13 @@ def insert_face(request):
     filename = image_file.name
     
     # 解析文件名获取人名和ID
-    name_id = os.path.splitext(filename)[0]  # 移除扩展名
-    match = re.search(r'(.+)_(\d+)', name_id)
-    if match:
-        name = match.group(1)
-        face_id = int(match.group(2))
-    else:
-        name = name_id
+    name, face_id = parse_name_id(filename)
+    if face_id is None:
         face_id = 1
 
-    # 测试模式或insightface未初始化
-    if app is None:
+    # 识别引擎初始化失败（如insightface不可用）
+    analyzer = get_analyzer()
+    if analyzer is None:
         # 返回模拟成功响应
         return JsonResponse({
             "status": "success", 
@@ -51,43 +70,24 @@ def insert_face(request):
     
     # 真实模式
     try:
-        # 读取图像数据
+        # 读取图像数据并获取人脸特征
         img_data = image_file.read()
-        nparr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        # 检测人脸
-        faces = app.get(img)
-        
-        if len(faces) == 0:
+        try:
+            feat = get_executor().run(extract_single_face_feat, analyzer, img_data)
+        except (ValueError, InferenceQueueFull, InferenceTimeout) as e:
             return JsonResponse({
                 "status": "error",
-                "message": "未检测到人脸"
+                "message": str(e)
             })
         
-        if len(faces) > 1:
-            return JsonResponse({
-                "status": "error",
-                "message": f"检测到多个人脸({len(faces)}个)，请提供单人照片"
-            })
-        
-        # 获取人脸特征
-        face = faces[0]
-        feat = face.normed_embedding
-        
-        # 保存到数据库
-        face_obj, created = Face.objects.update_or_create(
-            id=face_id,
-            defaults={
-                'name': name,
-                'feat': feat.tobytes()
-            }
-        )
+        # 保存为该身份的一个新模板，并更新质心
+        created, template_count = add_template(face_id, name, feat)
         
         return JsonResponse({
             "status": "success",
-            "message": f"成功{'添加' if created else '更新'}{name}的人脸",
-            "id": face_id
+            "message": f"成功添加{name}的人脸" if created else f"成功为{name}新增人脸模板，共{template_count}个",
+            "id": face_id,
+            "templates": template_count
         })
         
     except Exception as e:
@@ -102,8 +102,9 @@ def batch_insert_faces(request):
     if request.method != 'POST':
         return JsonResponse({"status": "error", "message": "只支持POST请求"})
     
-    # 测试模式或insightface未初始化
-    if app is None:
+    # 识别引擎初始化失败（如insightface不可用）
+    analyzer = get_analyzer()
+    if analyzer is None:
         # 返回模拟成功响应
         return JsonResponse({
             "status": "success",
@@ -114,14 +115,214 @@ def batch_insert_faces(request):
             }
         })
     
-    # 真实模式实现批量插入（可根据实际需求扩展）
-    # ...
-
+    if 'archive' not in request.FILES:
+        return JsonResponse({"status": "error", "message": "未提供压缩包文件（zip或tar，内含 姓名_学号.jpg 图片）"})
+    
+    archive_file = request.FILES['archive']
+    executor = get_executor()
+    # 同时在处理中的图片数上限，避免压缩包中的图片全部读入内存
+    max_pending = executor.workers * 2
+    
+    start_time = time.perf_counter()
+    failed = []
+    # id -> [(在压缩包中的顺序, 文件名, 姓名, 特征), ...]
+    extracted = {}
+    
+    pending = {}
+    
+    def collect(future):
+        order, filename, name, face_id = pending.pop(future)
+        try:
+            feat = executor.result(future)
+        except Exception as e:
+            failed.append({"file": filename, "reason": str(e)})
+            return
+        extracted.setdefault(face_id, []).append((order, filename, name, feat))
+    
+    try:
+        # 在共享的推理线程池中并行提取特征，队列满时等待而不是拒绝
+        for order, (filename, img_data) in enumerate(iter_archive_images(archive_file)):
+            name, face_id = parse_name_id(filename)
+            if face_id is None:
+                failed.append({"file": filename, "reason": "文件名格式应为 姓名_学号.jpg"})
+                continue
+            
+            future = executor.submit(extract_single_face_feat, analyzer, img_data, block=True)
+            pending[future] = (order, filename, name, face_id)
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+        
+        for future in list(pending):
+            collect(future)
+    except ValueError as e:
+        return JsonResponse({"status": "error", "message": str(e)})
+    except Exception as e:
+        return JsonResponse({"status": "error", "message": f"读取压缩包失败: {str(e)}"})
+    
+    # 特征提取的完成顺序不确定，按压缩包中的顺序整理：同一id的多张照片都保存为模板，
+    # 超过每个身份的模板上限时保留最后的几张，姓名以最后一张为准
+    limit = max_templates()
+    records, saved = [], []
+    for face_id, items in extracted.items():
+        items.sort(key=lambda item: item[0])
+        for _, filename, _, _ in items[:-limit]:
+            failed.append({"file": filename, "reason": f"同一id的照片超过{limit}张，只保存最后{limit}张"})
+        kept = items[-limit:]
+        records.append((face_id, kept[-1][2], [feat for _, _, _, feat in kept]))
+        saved.extend((order, {"file": filename, "id": face_id, "name": name}) for order, filename, name, _ in kept)
+    success = [item for _, item in sorted(saved, key=lambda pair: pair[0])]
+    
+    # 所有图片处理完成后一次性写入数据库
+    try:
+        if records:
+            bulk_save_faces(records)
+    except Exception as e:
+        return JsonResponse({"status": "error", "message": f"保存人脸失败: {str(e)}"})
+    
+    elapsed = time.perf_counter() - start_time
+    total = len(success) + len(failed)
     return JsonResponse({
-        "status": "error",
-        "message": "批量插入人脸功能尚未实现"
+        "status": "success",
+        "message": f"批量插入完成，成功{len(success)}个，失败{len(failed)}个",
+        "details": {
+            "success": success,
+            "failed": failed
+        },
+        "stats": {
+            "total": total,
+            "elapsed_seconds": round(elapsed, 3),
+            "images_per_second": round(total / elapsed, 2) if elapsed > 0 else None
+        }
     })
 
+def _resolve_course(params):
+    """从请求参数中解析(课程id, 课程时间id)，支持course_time_id或course_id，未提供的为None"""
+    course_time_id = params.get('course_time_id')
+    if course_time_id:
+        if not course_time_id.isdigit():
+            raise ValueError("course_time_id必须为整数")
+        course_id = CourseTime.objects.filter(pk=int(course_time_id)).values_list('course_id', flat=True).first()
+        if course_id is None:
+            raise ValueError("课程时间不存在")
+        return course_id, int(course_time_id)
+    
+    course_id = params.get('course_id')
+    if course_id:
+        if not course_id.isdigit():
+            raise ValueError("course_id必须为整数")
+        if not Course.objects.filter(pk=int(course_id)).exists():
+            raise ValueError("课程不存在")
+        return int(course_id), None
+    
+    return None, None
+
+def _debug_requested(request):
+    value = request.POST.get('debug') or request.GET.get('debug') or ''
+    return value.lower() in ('1', 'true', 'yes')
+
+def _timed_response(data, timer, debug):
+    """结束计时，把各阶段耗时写入Server-Timing响应头，debug时也写入响应内容"""
+    timer.finish()
+    if debug:
+        data["timings"] = timer.as_dict()
+    response = JsonResponse(data)
+    response['Server-Timing'] = timer.server_timing()
+    return response
+
+def _dim_mismatch(query_feats, known_dim, timer, debug):
+    return _timed_response({
+        "status": "error",
+        "message": f"人脸特征维度({query_feats.shape[1]})与特征库({known_dim})不一致"
+    }, timer, debug)
+
+def _match_and_record(query_feats, rejected, course_id, course_time_id, timer, debug):
+    """
+    把已归一化的人脸特征与特征库（或课程花名册）匹配，保存考勤记录并生成响应。
+    rejected为未通过质量检查的人脸，只在响应中列出
+    """
+    threshold = 0.5  # 可根据需要调整
+    
+    if course_id is not None:
+        # 课程花名册的特征子矩阵（缓存），一次矩阵乘法完成匹配
+        with timer.stage('gallery'):
+            known_feats, known_scales, known_ids, known_names = course_galleries.get(course_id)
+        if len(known_ids) == 0:
+            return _timed_response({
+                "status": "error",
+                "message": "该课程没有已录入人脸的学生"
+            }, timer, debug)
+        known_dim = known_feats.shape[1]
+        if query_feats.shape[1] != known_dim:
+            return _dim_mismatch(query_feats, known_dim, timer, debug)
+        with timer.stage('match'):
+            best_indices, best_sims = match_faces(
+                query_feats, known_feats, threshold, known_scales, gallery.rescorer(query_feats, known_ids)
+            )
+    else:
+        # 获取已知人脸特征库（进程内缓存，版本变化时自动重新加载）
+        with timer.stage('gallery'):
+            gallery.ensure_current()
+        if len(gallery) == 0:
+            return _timed_response({
+                "status": "error",
+                "message": "数据库中没有已知人脸数据"
+            }, timer, debug)
+        known_dim = gallery.dim
+        if query_feats.shape[1] != known_dim:
+            return _dim_mismatch(query_feats, known_dim, timer, debug)
+    
+        # 经索引筛选候选后，一次矩阵乘法计算所有人脸的相似度，并保证每个人最多被识别一次
+        with timer.stage('match'):
+            best_indices, best_sims, known_ids, known_names = gallery.match(query_feats, threshold)
+    
+    # 创建考勤记录
+    attendance_records = []
+    
+    for best_idx, best_sim in zip(best_indices, best_sims):
+        if best_idx >= 0:
+            # 识别成功
+            attendance_records.append({
+                'id': int(known_ids[best_idx]),  # 将numpy的int64转换为Python的int
+                'name': known_names[best_idx],
+                'present': 1,
+                'confidence': float(best_sim)
+            })
+        else:
+            # 未能识别的人脸
+            attendance_records.append({
+                'id': -1,
+                'name': "未知",
+                'present': 0,
+                'confidence': float(best_sim)
+            })
+    
+    # 保存考勤记录（一次插入记录、一次批量插入明细），下载时按文本格式生成；
+    # 指定课程时间时在同一事务中更新整个花名册的Status.if_come
+    status_summary = None
+    with timer.stage('persist'), transaction.atomic():
+        record = save_attendance(attendance_records, course_id, course_time_id)
+        if course_time_id is not None:
+            present_ids = [item['id'] for item in attendance_records if item['present']]
+            status_summary = update_status(course_time_id, course_id, present_ids)
+    path = f'{ATTENDANCE_DIR}/{record.filename}'
+    
+    # 统计出席人数
+    present_count = sum(1 for record in attendance_records if record['present'] == 1)
+    
+    response = {
+        "status": "success",
+        "message": f"已生成考勤记录，检测到{len(query_feats) + len(rejected)}个人脸，识别出{present_count}人"
+                   + (f"，{len(rejected)}个人脸未通过质量检查" if rejected else ""),
+        "file_path": path,
+        "attendance_records": attendance_records,
+        "rejected_faces": rejected
+    }
+    if status_summary is not None:
+        response["course_status"] = status_summary
+    return _timed_response(response, timer, debug)
+
 @csrf_exempt
 def check_attendance(request):
     """检查考勤"""
@@ -135,8 +336,9 @@ def check_attendance(request):
     image_file = request.FILES['image']
     file_name = os.path.splitext(image_file.name)[0]
     
-    # 测试模式或insightface未初始化
-    if app is None:
+    # 识别引擎初始化失败（如insightface不可用）
+    analyzer = get_analyzer()
+    if analyzer is None:
         # 创建模拟考勤记录
         attendance_records = {
             "1": {'id': 1, 'name': '张三', 'present': 1},
@@ -144,23 +346,11 @@ def check_attendance(request):
             "3": {'id': 3, 'name': '王五', 'present': 1}
         }
         
-        # 使用当前时间作为考勤文件名
-        current_time = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"attendance_{current_time}.txt"
+        # 保存考勤记录，下载时按文本格式生成
+        record = save_attendance(list(attendance_records.values()))
+        path = f'{ATTENDANCE_DIR}/{record.filename}'
         
-        # 创建文件内容
-        file_content = ""
-        for record in attendance_records.values():
-            file_content += f"{record['id']} {record['name']} {record['present']}\n"
-        
-        # 确保目录存在
-        attendance_dir = os.path.join(settings.MEDIA_ROOT, 'attendance_records')
-        os.makedirs(attendance_dir, exist_ok=True)
-        
-        # 将文件存储到默认存储位置
-        path = default_storage.save(f'attendance_records/{filename}', ContentFile(file_content.encode('utf-8')))
-        
-        # 统计出席和缺席人数
+        # 统计出席人数
         present_count = sum(1 for record in attendance_records.values() if record['present'] == 1)
         absent_count = len(attendance_records) - present_count
         
@@ -172,128 +362,246 @@ def check_attendance(request):
         })
     
     # 真实模式
+    # 各阶段计时，写入Server-Timing响应头和耗时直方图；带debug参数时也写入响应
+    timer = StageTimer('check_attendance')
+    debug = _debug_requested(request)
     try:
-        # 读取图像数据
+        # 指定课程时只与该课程花名册上的学生比较
+        try:
+            course_id, course_time_id = _resolve_course(request.POST)
+        except ValueError as e:
+            return JsonResponse({"status": "error", "message": str(e)})
+        
+        # 在推理线程池中解码图像并检测人脸；启用微批调度时与同时到达的请求合并推理
         img_data = image_file.read()
-        nparr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        # 相同图像重复提交时直接使用缓存的检测和特征提取结果，只重新匹配
+        result_cache = get_result_cache()
+        faces = None
+        if result_cache is not None:
+            with timer.stage('cache'):
+                cache_key = content_key(img_data)
+                faces = result_cache.get(cache_key)
+        if faces is None:
+            inference_start = time.perf_counter()
+            try:
+                scheduler = get_scheduler()
+                if scheduler is not None:
+                    faces = get_executor().result(scheduler.submit(img_data, timer))
+                else:
+                    faces = get_executor().run(analyze_image, analyzer, img_data, timer)
+            except (ValueError, InferenceQueueFull, InferenceTimeout) as e:
+                return JsonResponse({"status": "error", "message": str(e)})
+            # 等待推理线程的时间
+            inference_stages = sum(timer.stages.get(name, 0.0) for name in ('decode', 'detect', 'quality', 'embed'))
+            timer.add('queue', max(0.0, time.perf_counter() - inference_start - inference_stages))
+            if result_cache is not None:
+                result_cache.put(cache_key, faces)
         
-        # 检测人脸
-        faces = app.get(img)
+        # 质量不合格的人脸没有特征，不参与匹配，在响应中单独列出
+        faces, rejected_faces = split_faces(faces)
+        rejected = [describe(face) for face in rejected_faces]
         
         if len(faces) == 0:
-            return JsonResponse({
+            return _timed_response({
                 "status": "error",
-                "message": "未检测到人脸"
-            })
+                "message": f"检测到{len(rejected)}个人脸，均未通过质量检查" if rejected else "未检测到人脸",
+                "rejected_faces": rejected
+            }, timer, debug)
         
-        # 获取所有已知人脸
-        known_faces = Face.objects.all()
-        if not known_faces:
-            return JsonResponse({
-                "status": "error",
-                "message": "数据库中没有已知人脸数据"
-            })
-        
-        # 构建人脸特征矩阵
-        known_feats = []
-        for face_obj in known_faces:
-            feat = np.frombuffer(face_obj.feat, dtype=np.float32)
-            known_feats.append(feat)
-        
-        known_feats = np.array(known_feats)
-        
-        # 创建考勤记录
-        attendance_records = []
-        recognized_faces = []
-        
-        for face in faces:
-            feat = face.normed_embedding
-            
-            # 计算相似度
-            sim = np.dot(known_feats, feat)
-            best_idx = np.argmax(sim)
-            best_sim = sim[best_idx]
-            
-            # 阈值判断
-            threshold = 0.5  # 可根据需要调整
-            if best_sim > threshold:
-                # 识别成功
-                face_obj = known_faces[int(best_idx)]  # 将numpy的int64转换为Python的int
-                attendance_records.append({
-                    'id': face_obj.id,
-                    'name': face_obj.name,
-                    'present': 1,
-                    'confidence': float(best_sim)
-                })
-                recognized_faces.append(face_obj)
-            else:
-                # 未能识别的人脸
-                attendance_records.append({
-                    'id': -1,
-                    'name': "未知",
-                    'present': 0,
-                    'confidence': float(best_sim)
-                })
-        
-        # 使用当前时间作为考勤文件名
-        current_time = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"attendance_{current_time}.txt"
-        
-        # 创建文件内容
-        file_content = ""
-        for record in attendance_records:
-            file_content += f"{record['id']} {record['name']} {record['present']}\n"
-        
-        # 确保目录存在
-        attendance_dir = os.path.join(settings.MEDIA_ROOT, 'attendance_records')
-        os.makedirs(attendance_dir, exist_ok=True)
-        
-        # 将文件存储到默认存储位置
-        path = default_storage.save(f'attendance_records/{filename}', ContentFile(file_content.encode('utf-8')))
-        
-        # 统计出席和缺席人数
-        present_count = sum(1 for record in attendance_records if record['present'] == 1)
-        absent_count = len(attendance_records) - present_count
+        query_feats = np.stack([face.normed_embedding for face in faces])
+        return _match_and_record(query_feats, rejected, course_id, course_time_id, timer, debug)
         
+    except Exception as e:
         return JsonResponse({
-            "status": "success",
-            "message": f"已生成考勤记录，检测到{len(faces)}个人脸，识别出{present_count}人",
-            "file_path": path,
-            "attendance_records": attendance_records
+            "status": "error",
+            "message": f"处理失败: {str(e)}"
+        })
+
+def _decode_embeddings(data, dtype, dim):
+    """把小端序的特征矩阵字节解码为 (N, dim) 的归一化float32矩阵"""
+    if dtype not in EMBEDDING_DTYPES:
+        raise ValueError("dtype只支持float32或float16")
+    row_size = np.dtype(EMBEDDING_DTYPES[dtype]).itemsize * dim
+    if not data or len(data) % row_size:
+        raise ValueError(f"特征数据长度应为{row_size}字节的整数倍")
+    if len(data) // row_size > EMBEDDINGS_MAX_FACES:
+        raise ValueError(f"每次最多提交{EMBEDDINGS_MAX_FACES}个人脸特征")
+    feats = np.frombuffer(data, dtype=EMBEDDING_DTYPES[dtype]).astype(np.float32).reshape(-1, dim)
+    norms = np.linalg.norm(feats, axis=1, keepdims=True)
+    if not np.all(np.isfinite(norms)) or np.any(norms == 0):
+        raise ValueError("人脸特征包含无效值")
+    return feats / norms
+
+@csrf_exempt
+def check_attendance_embeddings(request):
+    """
+    用考勤终端本地提取的人脸特征检查考勤，跳过解码、检测和特征提取，直接匹配并保存考勤记录。
+    请求头X-Model-Version必须与服务器识别模型的版本一致，否则特征不可比较，直接拒绝。
+    特征为小端序的float32或float16矩阵 (N, dim)：
+    - Content-Type为application/octet-stream时请求体为原始字节，dtype、dim、course_id、course_time_id为查询参数
+    - 表单提交时embeddings字段为base64编码的字节（或上传名为embeddings的文件），其余参数为表单字段
+    """
+    if request.method != 'POST':
+        return JsonResponse({"status": "error", "message": "只支持POST请求"})
+    
+    analyzer = get_analyzer()
+    server_version = getattr(analyzer, 'model_version', None)
+    if server_version is None:
+        return JsonResponse({"status": "error", "message": "识别引擎未初始化，无法确认模型版本"})
+    client_version = request.headers.get('X-Model-Version', '')
+    if client_version != server_version:
+        return JsonResponse({
+            "status": "error",
+            "message": f"模型版本不一致：终端为{client_version or '未提供'}，服务器为{server_version}",
+            "model_version": server_version
         })
+    
+    timer = StageTimer('check_attendance_embeddings')
+    debug = _debug_requested(request)
+    try:
+        if request.content_type == 'application/octet-stream':
+            params, data = request.GET, request.body
+        elif 'embeddings' in request.FILES:
+            params, data = request.POST, request.FILES['embeddings'].read()
+        else:
+            params = request.POST
+            try:
+                data = base64.b64decode(params.get('embeddings', ''), validate=True)
+            except ValueError:
+                # 非ASCII字符会抛出ValueError而不是binascii.Error
+                raise ValueError("embeddings不是有效的base64编码")
         
+        dim = params.get('dim', str(EMBEDDING_DIM))
+        if not dim.isdigit() or int(dim) == 0:
+            raise ValueError("dim必须为正整数")
+        with timer.stage('decode'):
+            query_feats = _decode_embeddings(data, params.get('dtype', 'float32'), int(dim))
+        course_id, course_time_id = _resolve_course(params)
+    except ValueError as e:
+        return JsonResponse({"status": "error", "message": str(e)})
+    
+    try:
+        return _match_and_record(query_feats, [], course_id, course_time_id, timer, debug)
     except Exception as e:
         return JsonResponse({
             "status": "error",
             "message": f"处理失败: {str(e)}"
         })
 
+def _parse_date(value, name):
+    """把YYYY-MM-DD解析为当天0点（本地时区）"""
+    try:
+        date = datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name}格式应为YYYY-MM-DD")
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+
 @csrf_exempt
 def download_attendance_file(request):
-    """下载考勤记录文件"""
+    """
+    下载考勤记录文件。
+    filename：下载单个考勤文件，支持Range、ETag/Last-Modified条件请求和gzip；
+    start_date、end_date（YYYY-MM-DD，可选course_id）：把日期范围内的考勤记录拼接为一个流导出
+    """
     if request.method != 'GET':
         return JsonResponse({"status": "error", "message": "只支持GET请求"})
     
     # 获取指定文件名
     filename = request.GET.get('filename', '')
+    start_date = request.GET.get('start_date', '')
+    end_date = request.GET.get('end_date', '')
     
-    if not filename:
-        return JsonResponse({"status": "error", "message": "未指定文件名"})
-    
-    file_path = f'attendance_records/{filename}'
+    if not filename and not (start_date or end_date):
+        return JsonResponse({"status": "error", "message": "未指定文件名或日期范围"})
     
     try:
-        # 检查文件是否存在
-        if default_storage.exists(file_path):
-            # 读取文件内容
-            file_content = default_storage.open(file_path).read()
-            
-            # 创建响应
-            response = HttpResponse(file_content, content_type='text/plain')
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            return response
+        if not filename:
+            return _export_attendance(request, start_date, end_date)
+        
+        # 考勤记录保存在数据库中，按原来的文本格式生成
+        record = AttendanceRecord.objects.filter(filename=filename).first()
+        if record is not None:
+            content = render_attendance(record).encode('utf-8')
+            return downloads.content_response(request, content, filename, record.created_at)
+        
+        # 尚未导入数据库的历史文件，流式读取
+        file_path = f'{ATTENDANCE_DIR}/{filename}'
+        if '/' not in filename and '\\' not in filename and default_storage.exists(file_path):
+            return downloads.file_response(request, file_path, filename)
         else:
             return JsonResponse({"status": "error", "message": "文件不存在"})
+    except ValueError as e:
+        return JsonResponse({"status": "error", "message": str(e)})
     except Exception as e:
         return JsonResponse({"status": "error", "message": f"下载失败: {str(e)}"})
+
+def _filter_records(request):
+    """
+    按查询参数过滤考勤记录：start_date、end_date（YYYY-MM-DD，本地时区，含首尾两天）、course_id、course_time_id。
+    按时间范围而不是按日期过滤，可以使用created_at上的索引
+    """
+    records = AttendanceRecord.objects.all()
+    start_date = request.GET.get('start_date')
+    end_date = request.GET.get('end_date')
+    if start_date:
+        records = records.filter(created_at__gte=_parse_date(start_date, 'start_date'))
+    if end_date:
+        records = records.filter(created_at__lt=_parse_date(end_date, 'end_date') + datetime.timedelta(days=1))
+    for name in ('course_id', 'course_time_id'):
+        value = request.GET.get(name)
+        if value:
+            if not value.isdigit():
+                raise ValueError(f"{name}必须为整数")
+            records = records.filter(**{name: int(value)})
+    return records
+
+def _export_attendance(request, start_date, end_date):
+    """按日期范围导出考勤记录"""
+    records = _filter_records(request)
+    export_name = f"attendance_{start_date or 'begin'}_{end_date or 'end'}.txt"
+    return downloads.export_response(request, records, export_name)
+
+def list_attendance_records(request):
+    """
+    分页列出考勤记录，按考勤时间从新到旧排列。
+    支持start_date、end_date、course_id、course_time_id过滤；
+    limit为每页条数，cursor为上一页返回的next_cursor
+    """
+    if request.method != 'GET':
+        return JsonResponse({"status": "error", "message": "只支持GET请求"})
+    
+    try:
+        records = _filter_records(request)
+        limit = request.GET.get('limit', str(ATTENDANCE_PAGE_SIZE))
+        if not limit.isdigit() or not 0 < int(limit) <= ATTENDANCE_MAX_PAGE_SIZE:
+            raise ValueError(f"limit必须为1到{ATTENDANCE_MAX_PAGE_SIZE}之间的整数")
+        page, next_cursor = paginate_records(records, request.GET.get('cursor'), int(limit))
+    except ValueError as e:
+        return JsonResponse({"status": "error", "message": str(e)})
+    
+    return JsonResponse({
+        "status": "success",
+        "records": [
+            {
+                "filename": record.filename,
+                "file_path": f'{ATTENDANCE_DIR}/{record.filename}',
+                "course_id": record.course_id,
+                "course_time_id": record.course_time_id,
+                "created_at": timezone.localtime(record.created_at).isoformat(),
+                "face_count": record.face_count,
+                "present_count": record.present_count,
+            }
+            for record in page
+        ],
+        "next_cursor": next_cursor
+    })
+
+def face_metrics(request):
+    """人脸识别进程内指标"""
+    if request.method != 'GET':
+        return JsonResponse({"status": "error", "message": "只支持GET请求"})
+    
+    return JsonResponse({
+        "status": "success",
+        "metrics": metrics.snapshot()
+    })
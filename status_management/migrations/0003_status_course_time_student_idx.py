@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("course_management", "0006_remove_courseannouncement_course_and_more"),
+        (
+            "status_management",
+            "0002_alter_status_options_alter_status_concentrate_and_more",
+        ),
+        ("user_management", "0007_alter_student_student_id_alter_teacher_teacher_id"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="status",
+            index=models.Index(
+                fields=["course_time", "student"], name="status_mana_course__504fb4_idx"
+            ),
+        ),
+    ]
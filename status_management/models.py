@@ -16,6 +16,9 @@ class Status(models.Model):
         app_label = 'status_management'
         verbose_name = '课堂状态'
         verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['course_time', 'student']),
+        ]
     
     def __str__(self):
         student_name = self.student.username if self.student else "未知学生"
@@ -165,15 +165,113 @@ SIMPLE_JWT = {
 }
 
 # 人脸识别应用设置
-# 测试模式下不加载真实的人脸识别模型
+# 测试模式下不加载真实的人脸识别模型，BACKEND为insightface时改用fake后端
 FACE_RECOGNITION_TEST_MODE = False
 
 # 人脸识别模型配置
 FACE_RECOGNITION = {
+    # 识别后端：'insightface'真实模型；'fake'确定性假后端（压测用，不需要模型）；
+    # 'replay'回放录制的检测结果。环境变量 FACE_RECOGNITION_BACKEND 可以覆盖
+    'BACKEND': {
+        'TYPE': 'insightface',
+        'FAKE': {
+            'SEED': 0,
+            'IDENTITIES': 1000,  # 虚拟身份数
+            'FACES_PER_IMAGE': 30,  # 横拍照片中的人脸数，竖拍照片只有一张人脸
+            'NOISE': 0.5,  # 同一身份不同照片间特征的差异
+            'DETECT_MS': 40,  # 模拟的检测耗时
+            'EMBED_MS': 3,  # 模拟的每张人脸特征提取耗时
+        },
+        'REPLAY': {
+            'DIR': BASE_DIR / 'face_data' / 'face_replay',  # 为None时使用 MEDIA_ROOT/face_replay
+            'RECORD': False,  # 未录制的图像交给insightface处理并保存
+            'LATENCY': True,  # 按录制时的耗时等待
+        },
+    },
     'MODEL_NAME': 'buffalo_sc',
     'PROVIDERS': ['CPUExecutionProvider'],
     'CUDA_DEVICE_ID': 0,
     'DET_SIZE': (640, 640),
+    # 启动方式：'eager'每个worker启动时加载并预热；'lazy'首次使用时加载；
+    # 'preload'在master进程（gunicorn --preload）中预加载，fork后各worker重建会话并预热
+    'START_MODE': 'eager',
+    # 人脸特征存储格式：'f32'、'f16'或'i8'（int8加缩放系数），已有数据用 quantize_faces 命令转换
+    'FEAT_FORMAT': 'f32',
+    # 检测前预缩放：读取图像头后按检测输入尺寸缩小解码，只在缩小后的图像上检测；
+    # 人脸在其中不足112像素时按所需分辨率重新解码一次用于对齐，识别精度不受预缩放影响。
+    # MIN_FACE_SIZE（像素，可选）限制检测图像缩小的程度，使原图中不小于该尺寸的人脸在检测图像中不低于112像素
+    'PRESCALE': {
+        'ENABLED': True,
+        'MIN_FACE_SIZE': None,
+    },
+    # 大图分块检测：阶梯教室的横幅照片不缩小到DET_SIZE，按DET_SIZE切成重叠的小块并行检测后用NMS合并，
+    # 同时对整图做一次常规检测；启用后PRESCALE不再生效
+    'TILING': {
+        'ENABLED': False,
+        'MAX_IMAGE_SIZE': 1920,  # 解码后的最长边，限制小块数量
+        'OVERLAP': 0.2,
+        'NMS_THRESHOLD': 0.4,
+        'WORKERS': None,  # 并行检测的线程数，默认为SESSION_POOL.SIZE
+        'SKIP_LOW_SKIN': False,  # 跳过几乎没有肤色像素的小块
+        'MIN_SKIN_RATIO': 0.01,
+    },
+    # 人脸质量检查：检测后、提取特征前过滤检测分数低、太小（原图中的像素）、模糊、角度过大的人脸，
+    # 不合格的人脸不提取特征，在考勤结果的rejected_faces中列出原因
+    'QUALITY': {
+        'ENABLED': True,
+        'MIN_DET_SCORE': 0.5,
+        'MIN_FACE_SIZE': 20,
+        'MIN_SHARPNESS': 20,  # 拉普拉斯响应方差
+        'MAX_YAW': 0.35,  # 鼻尖偏离两眼中点 / 两眼间距
+        'MAX_PITCH': 0.3,  # 鼻尖在眼睛与嘴角之间偏离中点的比例
+    },
+    # 特征提取时每批送入识别模型的最多人脸数，一张照片（或一个微批）中的人脸对齐后按批推理
+    'EMBED_BATCH_SIZE': 32,
+    # 人脸特征索引：'flat'为精确搜索；'ivf'为倒排聚类索引，适用于数万人规模的特征库
+    'INDEX': {
+        'TYPE': 'flat',
+        'NLIST': None,  # 聚类数，默认为sqrt(人脸数)
+        'NPROBE': 8,  # 每次查询搜索的聚类数
+        'MAX_CANDIDATE_FRACTION': 0.5,  # 所有查询的候选行超过特征库的该比例时改为精确搜索
+        'PATH': BASE_DIR / 'face_data' / 'face_index' / 'ivf.npz',  # 聚类中心文件，为None时使用 MEDIA_ROOT/face_index/ivf.npz
+    },
+    # 多模板录入：每个身份最多保留的模板数；匹配时先比较质心，再对前RESCORE_TOP_K个候选逐模板打分
+    'TEMPLATES': {
+        'MAX_PER_IDENTITY': 5,
+        'RESCORE_TOP_K': 5,
+    },
+    # 课程花名册特征子矩阵的缓存时间（秒），本进程内花名册变更会立即失效
+    'ROSTER_CACHE_TTL': 300,
+    # 特征库快照：导出为.npy文件，各worker以内存映射方式共享
+    'SNAPSHOT': {
+        'ENABLED': True,
+        'DIR': BASE_DIR / 'face_data' / 'face_gallery',  # 为None时使用 MEDIA_ROOT/face_gallery
+        'KEEP': 3,  # 保留的历史版本数
+    },
+    # 推理线程池：线程数、最多排队的任务数、单个任务超时（秒）
+    'INFERENCE_WORKERS': 2,
+    'INFERENCE_QUEUE_SIZE': 16,
+    'INFERENCE_TIMEOUT': 30,
+    # 识别会话池：SIZE个独立的模型实例（各占一份模型内存），推理线程借出一个实例、用完归还；
+    # SIZE一般与INFERENCE_WORKERS相同，为1时所有推理线程共用一个实例
+    'SESSION_POOL': {
+        'SIZE': 1,
+        'INTRA_OP_THREADS': None,  # 每个会话的算子内线程数，默认为 CPU核数 / SIZE
+        'INTER_OP_THREADS': None,
+        'CHECKOUT_TIMEOUT': 30,  # 秒
+    },
+    # 识别结果缓存：按上传图像的内容哈希缓存检测和特征提取结果，重复提交时只重新匹配
+    'RESULT_CACHE': {
+        'ENABLED': True,
+        'MAX_ENTRIES': 256,
+        'TTL': 300,  # 秒
+    },
+    # 跨请求微批调度：几毫秒内到达的考勤请求合并为一批做人脸识别
+    'BATCHING': {
+        'ENABLED': False,
+        'MAX_BATCH_SIZE': 8,
+        'MAX_WAIT_MS': 5,
+    },
 }
 
 # CORS设置